@@ -0,0 +1,118 @@
+"""
+Profiles the cold-start import cost of each Cloud Function in functions/main.py.
+
+main.py imports handler modules inside each function body, so a cold instance only pays for the
+modules its own function needs. This script finds those per-function imports by parsing main.py,
+then runs `python -X importtime` in a fresh interpreter for each function (importing main plus the
+function's handler modules) and reports the total and the heaviest top-level packages.
+
+Usage (from the repository root, with the functions dependencies installed):
+    python .github/scripts/profile_function_imports.py              # compare against the baseline
+    python .github/scripts/profile_function_imports.py --update     # rewrite the baseline
+
+common.core creates a Firestore client at import time, so credentials must be resolvable
+(Application Default Credentials or GOOGLE_APPLICATION_CREDENTIALS); no network call is made.
+Timings are noisy, so each function is measured --runs times, in rounds over all functions, and the fastest
+run is kept.
+"""
+import argparse
+import ast
+import json
+import os
+import re
+import subprocess
+import sys
+
+REPO_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+FUNCTIONS_DIR = os.path.join(REPO_ROOT, "functions")
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), "function_import_baseline.json")
+IMPORTTIME_LINE = re.compile(r"^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|\s+(\S+)$")
+# A function counts as regressed when it is this much slower than its baseline.
+REGRESSION_TOLERANCE = 1.25
+
+
+def find_function_imports(main_path: str) -> dict:
+    """Maps each decorated function in main.py to the modules it imports inside its body."""
+    with open(main_path) as f:
+        tree = ast.parse(f.read())
+    function_imports = {}
+    for node in tree.body:
+        if not isinstance(node, ast.FunctionDef) or not node.decorator_list:
+            continue
+        modules = [child.module for child in ast.walk(node) if isinstance(child, ast.ImportFrom) and child.module]
+        modules += [alias.name for child in ast.walk(node) if isinstance(child, ast.Import) for alias in child.names]
+        function_imports[node.name] = sorted(set(modules))
+    return function_imports
+
+
+def profile_imports(modules: list) -> dict:
+    """Imports main plus the given modules in a fresh interpreter and summarizes -X importtime output."""
+    statement = "; ".join(["import main"] + [f"import {module}" for module in modules])
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", statement],
+        cwd=FUNCTIONS_DIR, capture_output=True, text=True
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"Importing {modules or ['main']} failed:\n{result.stderr[-2000:]}")
+
+    total_us, packages = 0, {}
+    for line in result.stderr.splitlines():
+        match = IMPORTTIME_LINE.match(line)
+        if not match:
+            continue
+        self_us, name = int(match.group(1)), match.group(3)
+        total_us += self_us
+        # Attribute each module's own time to its top-level package.
+        top_level = name.split(".")[0]
+        packages[top_level] = packages.get(top_level, 0) + self_us
+    heaviest = sorted(packages.items(), key=lambda item: item[1], reverse=True)[:8]
+    return {
+        "totalMs": round(total_us / 1000, 1),
+        "topPackagesMs": {name: round(us / 1000, 1) for name, us in heaviest},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--update", action="store_true", help="Write the results as the new baseline.")
+    parser.add_argument("--runs", type=int, default=3, help="Measurements per function; the fastest is kept.")
+    args = parser.parse_args()
+
+    function_imports = find_function_imports(os.path.join(FUNCTIONS_DIR, "main.py"))
+    targets = {"main": [], **function_imports}
+    samples = {name: [] for name in targets}
+    # Rounds go over every function in turn, so a slow stretch on the machine slows them all alike.
+    for _ in range(args.runs):
+        for name, modules in targets.items():
+            samples[name].append(profile_imports(modules))
+    results = {}
+    for name, runs in samples.items():
+        profile = min(runs, key=lambda r: r["totalMs"])
+        results[name] = profile if name == "main" else {"modules": targets[name], **profile}
+
+    baseline = {}
+    if os.path.exists(BASELINE_PATH):
+        with open(BASELINE_PATH) as f:
+            baseline = json.load(f).get("functions", {})
+
+    regressions = []
+    print(f"{'function':<40} {'import ms':>10} {'baseline':>10}  heaviest packages")
+    for function_name, profile in results.items():
+        baseline_ms = baseline.get(function_name, {}).get("totalMs")
+        heaviest = ", ".join(f"{name} {ms:.0f}" for name, ms in list(profile["topPackagesMs"].items())[:4])
+        print(f"{function_name:<40} {profile['totalMs']:>10.1f} {baseline_ms if baseline_ms is not None else '-':>10}  {heaviest}")
+        if baseline_ms and profile["totalMs"] > baseline_ms * REGRESSION_TOLERANCE:
+            regressions.append(function_name)
+
+    if args.update:
+        with open(BASELINE_PATH, "w") as f:
+            json.dump({"python": sys.version.split()[0], "functions": results}, f, indent=2)
+            f.write("\n")
+        print(f"Baseline written to {os.path.relpath(BASELINE_PATH, REPO_ROOT)}")
+    elif regressions:
+        print(f"Import time regressed by more than {int((REGRESSION_TOLERANCE - 1) * 100)}% for: {', '.join(regressions)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,2 @@
+# functions/benchmarks/__init__.py
+# Offline benchmarks and load tools for the agent run pipeline. Not deployed (see firebase.json "ignore").
@@ -0,0 +1,87 @@
+# functions/benchmarks/chat_trees.py
+"""
+Synthetic chat trees in the schema the app writes: user turns, assistant turns (model:/agent:) and
+context_stuffed messages carrying file_data parts, linked by parentMessageId/childMessageIds.
+"""
+import random
+import datetime
+
+CONTEXT_BUCKET = "bench-context-uploads"
+WORDS = ("agent model tool context branch message latency token retrieval session query cache stream "
+         "function result summary document section table figure answer question").split()
+
+
+def _text(rng: random.Random, chars: int) -> str:
+    words, length = [], 0
+    while length < chars:
+        word = rng.choice(WORDS)
+        words.append(word)
+        length += len(word) + 1
+    return " ".join(words)[:chars]
+
+
+def generate_chat_tree(message_count: int, branching: int = 1, participant: str = "model:bench-model",
+                       user_id: str = "bench-user", text_chars: int = 400, context_every: int = 25,
+                       context_chars: int = 4_000, seed: int = 7, storage_client=None) -> dict:
+    """
+    Builds a chat tree of about message_count messages as {messageId: data}. The main line alternates
+    user and assistant turns; every user turn on it gets branching - 1 extra edited siblings (each answered),
+    which is how forks appear in the UI. Every context_every-th turn is preceded by a context_stuffed
+    message whose text file is uploaded to storage_client (if given) so history builds can download it.
+    Returns {"messages": {...}, "leafMessageId": id of the main line's last message}.
+    """
+    rng = random.Random(seed)
+    messages, next_id = {}, 0
+    started_at = datetime.datetime(2025, 1, 1, tzinfo=datetime.timezone.utc)
+
+    def add(data: dict, parent_id: str | None) -> str:
+        nonlocal next_id
+        message_id = f"m{next_id:06d}"
+        next_id += 1
+        messages[message_id] = {
+            **data, "id": message_id, "parentMessageId": parent_id, "childMessageIds": [],
+            "timestamp": started_at + datetime.timedelta(seconds=next_id),
+        }
+        if parent_id:
+            messages[parent_id]["childMessageIds"].append(message_id)
+        return message_id
+
+    def add_turn(parent_id: str | None) -> str:
+        user_message_id = add({"participant": f"user:{user_id}", "parts": [{"text": _text(rng, text_chars)}]}, parent_id)
+        return add({"participant": participant, "parts": [{"text": _text(rng, text_chars)}], "status": "completed"}, user_message_id)
+
+    leaf_id, turn = None, 0
+    while len(messages) < message_count:
+        if context_every and turn % context_every == context_every - 1:
+            blob_name = f"bench/{user_id}/context-{turn:05d}.txt"
+            if storage_client is not None:
+                storage_client.bucket(CONTEXT_BUCKET).blob(blob_name).upload_from_string(_text(rng, context_chars), content_type="text/plain")
+            leaf_id = add({"participant": "context_stuffed", "createdBy": f"user:{user_id}", "parts": [{
+                "file_data": {"file_uri": f"gs://{CONTEXT_BUCKET}/{blob_name}", "mime_type": "text/plain"},
+                "preview": {"kind": "text"},
+            }]}, leaf_id)
+        for _ in range(branching - 1):
+            if len(messages) >= message_count - 2:
+                break
+            add_turn(leaf_id)  # An abandoned fork off the same parent.
+        leaf_id = add_turn(leaf_id)
+        turn += 1
+    return {"messages": messages, "leafMessageId": leaf_id}
+
+
+def write_chat_tree(db, chat_id: str, tree: dict, owner_id: str = "bench-user"):
+    """Writes the chat document and its messages with batched writes (up to 400 per batch)."""
+    chat_ref = db.collection("chats").document(chat_id)
+    chat_ref.set({"title": f"Benchmark chat {chat_id}", "ownerId": owner_id, "createdAt": datetime.datetime.now(datetime.timezone.utc)})
+    batch, pending = db.batch(), 0
+    for message_id, data in tree["messages"].items():
+        batch.set(chat_ref.collection("messages").document(message_id), data)
+        pending += 1
+        if pending == 400:
+            batch.commit()
+            batch, pending = db.batch(), 0
+    if pending:
+        batch.commit()
+
+
+__all__ = ['generate_chat_tree', 'write_chat_tree', 'CONTEXT_BUCKET']
@@ -0,0 +1,353 @@
+# functions/benchmarks/fakes.py
+"""
+In-process stand-ins for Firestore, Cloud Storage and the LLM, so the run pipeline can be benchmarked
+without network access or credentials.
+
+install_fakes() must run before any module that imports common.core: that module creates the Firestore
+client at import time, and every handler module binds `db` from it.
+"""
+import asyncio
+import copy
+import datetime
+import itertools
+import threading
+from google.cloud.firestore_v1 import transforms
+from google.genai import types as genai_types
+from google.adk.models import BaseLlm, LlmResponse
+
+_auto_ids = itertools.count()
+_installed = {}
+# Batches and transactions apply under one lock, so concurrent runs on worker threads see atomic commits.
+_commit_lock = threading.RLock()
+
+
+def _apply_value(current, value):
+    if value is transforms.SERVER_TIMESTAMP:
+        return datetime.datetime.now(datetime.timezone.utc)
+    if isinstance(value, transforms.Increment):
+        return (current or 0) + value.value
+    if isinstance(value, transforms.ArrayUnion):
+        existing = list(current or [])
+        return existing + [v for v in value.values if v not in existing]
+    if isinstance(value, transforms.ArrayRemove):
+        return [v for v in (current or []) if v not in value.values]
+    if isinstance(value, dict):
+        return {k: _apply_value(None, v) for k, v in value.items() if v is not transforms.DELETE_FIELD}
+    return copy.deepcopy(value)
+
+
+def _merge_into(target: dict, updates: dict):
+    for key, value in updates.items():
+        if value is transforms.DELETE_FIELD:
+            target.pop(key, None)
+        elif isinstance(value, dict) and isinstance(target.get(key), dict):
+            _merge_into(target[key], value)
+        else:
+            target[key] = _apply_value(target.get(key), value)
+
+
+def _update_path(target: dict, dotted_key: str, value):
+    *parents, leaf = dotted_key.split(".")
+    for parent in parents:
+        target = target.setdefault(parent, {})
+    if value is transforms.DELETE_FIELD:
+        target.pop(leaf, None)
+    else:
+        target[leaf] = _apply_value(target.get(leaf), value)
+
+
+def _field_value(data: dict, dotted_key: str):
+    for part in dotted_key.split("."):
+        if not isinstance(data, dict) or part not in data:
+            return None
+        data = data[part]
+    return data
+
+
+class FakeDocumentSnapshot:
+    def __init__(self, reference, data):
+        self.reference, self.id, self._data = reference, reference.id, data
+
+    @property
+    def exists(self):
+        return self._data is not None
+
+    def to_dict(self):
+        return copy.deepcopy(self._data) if self._data is not None else None
+
+    def get(self, field_path):
+        return copy.deepcopy(_field_value(self._data or {}, field_path))
+
+
+class FakeDocumentReference:
+    def __init__(self, store, path: str):
+        self._store, self.path = store, path
+        self.id = path.rsplit("/", 1)[-1]
+
+    @property
+    def parent(self):
+        return FakeCollectionReference(self._store, self.path.rsplit("/", 1)[0])
+
+    def collection(self, name: str):
+        return FakeCollectionReference(self._store, f"{self.path}/{name}")
+
+    def _docs(self):
+        return self._store.collections.setdefault(self.path.rsplit("/", 1)[0], {})
+
+    def get(self, transaction=None):
+        return FakeDocumentSnapshot(self, self._docs().get(self.id))
+
+    def set(self, data: dict, merge=False):
+        docs = self._docs()
+        if isinstance(merge, (list, tuple)) and self.id in docs:
+            for field_path in merge:  # merge=[fields] replaces just those fields
+                _update_path(docs[self.id], field_path, _field_value(data, field_path))
+        elif merge and self.id in docs:
+            _merge_into(docs[self.id], data)
+        else:
+            docs[self.id] = {}
+            _merge_into(docs[self.id], data)
+
+    def create(self, data: dict):
+        if self.id in self._docs():
+            raise ValueError(f"Document {self.path} already exists.")
+        self.set(data)
+
+    def update(self, data: dict):
+        docs = self._docs()
+        if self.id not in docs:
+            raise ValueError(f"No document to update: {self.path}")
+        for key, value in data.items():
+            _update_path(docs[self.id], key, value)
+
+    def delete(self):
+        self._docs().pop(self.id, None)
+
+    def on_snapshot(self, callback):
+        """Listeners never fire: nothing outside the process writes to the fake."""
+        return _NoopWatch()
+
+
+class _NoopWatch:
+    def unsubscribe(self):
+        pass
+
+
+class FakeQuery:
+    _OPERATORS = {
+        "==": lambda a, b: a == b, "!=": lambda a, b: a != b,
+        "<": lambda a, b: a is not None and a < b, "<=": lambda a, b: a is not None and a <= b,
+        ">": lambda a, b: a is not None and a > b, ">=": lambda a, b: a is not None and a >= b,
+        "in": lambda a, b: a in b, "array_contains": lambda a, b: b in (a or []),
+    }
+
+    def __init__(self, collection, filters=(), orders=(), limit_count=None):
+        self._collection, self._filters, self._orders, self._limit = collection, list(filters), list(orders), limit_count
+
+    def where(self, field_path=None, op_string=None, value=None, *, filter=None):
+        if filter is not None:
+            field_path, op_string, value = filter.field_path, filter.op_string, filter.value
+        return FakeQuery(self._collection, self._filters + [(field_path, op_string, value)], self._orders, self._limit)
+
+    def order_by(self, field_path, direction="ASCENDING"):
+        return FakeQuery(self._collection, self._filters, self._orders + [(field_path, direction)], self._limit)
+
+    def limit(self, count):
+        return FakeQuery(self._collection, self._filters, self._orders, count)
+
+    def stream(self, transaction=None):
+        docs = self._collection._docs()
+        matches = [(doc_id, data) for doc_id, data in docs.items()
+                   if all(self._OPERATORS[op](_field_value(data, field), value) for field, op, value in self._filters)]
+        for field, direction in reversed(self._orders):
+            matches.sort(key=lambda item: (_field_value(item[1], field) is None, _field_value(item[1], field)),
+                         reverse=direction == "DESCENDING")
+        if self._limit is not None:
+            matches = matches[:self._limit]
+        for doc_id, data in matches:
+            yield FakeDocumentSnapshot(self._collection.document(doc_id), data)
+
+    def get(self, transaction=None):
+        return list(self.stream())
+
+
+class FakeCollectionReference(FakeQuery):
+    def __init__(self, store, path: str):
+        super().__init__(self)
+        self._store, self.path = store, path
+        self.id = path.rsplit("/", 1)[-1]
+
+    @property
+    def parent(self):
+        return FakeDocumentReference(self._store, self.path.rsplit("/", 1)[0]) if "/" in self.path else None
+
+    def _docs(self):
+        return self._store.collections.setdefault(self.path, {})
+
+    def document(self, document_id: str | None = None):
+        return FakeDocumentReference(self._store, f"{self.path}/{document_id or f'auto{next(_auto_ids):012d}'}")
+
+    def add(self, data: dict):
+        ref = self.document()
+        ref.set(data)
+        return None, ref
+
+
+class FakeWriteBatch:
+    def __init__(self):
+        self._writes = []
+
+    def set(self, ref, data, merge=False):
+        self._writes.append(lambda: ref.set(data, merge=merge))
+
+    def create(self, ref, data):
+        self._writes.append(lambda: ref.create(data))
+
+    def update(self, ref, data):
+        self._writes.append(lambda: ref.update(data))
+
+    def delete(self, ref):
+        self._writes.append(ref.delete)
+
+    def commit(self):
+        with _commit_lock:
+            for write in self._writes:
+                write()
+        self._writes = []
+
+
+class FakeTransaction(FakeWriteBatch):
+    pass
+
+
+def fake_transactional(func):
+    """Stands in for firestore.transactional: runs func and commits its writes while holding the commit lock."""
+    def run_in_transaction(transaction, *args, **kwargs):
+        with _commit_lock:
+            result = func(transaction, *args, **kwargs)
+            transaction.commit()
+        return result
+    return run_in_transaction
+
+
+class FakeFirestore:
+    """
+    Dict-backed subset of the Firestore client: documents, subcollections, batches, simple queries and the
+    SERVER_TIMESTAMP / Increment / ArrayUnion / DELETE_FIELD transforms. Transactions are serialized by
+    a process-wide lock (see fake_transactional) rather than retried; snapshot listeners never fire.
+    """
+
+    def __init__(self):
+        self.collections = {}
+
+    def collection(self, name: str):
+        return FakeCollectionReference(self, name)
+
+    def document(self, path: str):
+        return FakeDocumentReference(self, path)
+
+    def batch(self):
+        return FakeWriteBatch()
+
+    def transaction(self, **kwargs):
+        return FakeTransaction()
+
+
+class FakeBlob:
+    def __init__(self, bucket, name: str):
+        self.bucket, self.name = bucket, name
+
+    def exists(self):
+        return self.name in self.bucket.objects
+
+    def upload_from_string(self, data, content_type=None):
+        self.bucket.objects[self.name] = data.encode("utf-8") if isinstance(data, str) else bytes(data)
+
+    def download_as_bytes(self, raw_download=False):
+        return self.bucket.objects[self.name]
+
+    def download_as_text(self, encoding="utf-8"):
+        return self.bucket.objects[self.name].decode(encoding)
+
+    def delete(self):
+        del self.bucket.objects[self.name]
+
+
+class FakeBucket:
+    def __init__(self, name: str):
+        self.name, self.objects = name, {}
+
+    def blob(self, name: str):
+        return FakeBlob(self, name)
+
+    def get_blob(self, name: str):
+        return FakeBlob(self, name) if name in self.objects else None
+
+    def list_blobs(self, prefix: str = ""):
+        return [FakeBlob(self, name) for name in list(self.objects) if name.startswith(prefix)]
+
+
+class FakeStorageClient:
+    def __init__(self):
+        self.buckets = {}
+
+    def bucket(self, name: str):
+        return self.buckets.setdefault(name, FakeBucket(name))
+
+    def lookup_bucket(self, name: str):
+        return self.bucket(name)
+
+
+class FakeLlm(BaseLlm):
+    """Answers every request with a fixed-size text reply after latency_seconds, reporting token usage."""
+    latency_seconds: float = 0.0
+    reply_chars: int = 400
+
+    async def generate_content_async(self, llm_request, stream: bool = False):
+        if self.latency_seconds:
+            await asyncio.sleep(self.latency_seconds)
+        prompt_chars = sum(len(part.text or "") for content in llm_request.contents for part in (content.parts or []))
+        yield LlmResponse(
+            content=genai_types.Content(role="model", parts=[genai_types.Part(text="x" * self.reply_chars)]),
+            usage_metadata=genai_types.GenerateContentResponseUsageMetadata(
+                prompt_token_count=prompt_chars // 4, candidates_token_count=self.reply_chars // 4,
+                total_token_count=(prompt_chars + self.reply_chars) // 4,
+            ),
+        )
+
+
+def install_fakes(firestore_client=None, llm_latency_seconds: float = 0.0, fake_llm: bool = True):
+    """
+    Routes the repo's Firestore, Storage and LiteLLM use to the fakes. Pass firestore_client to keep a real
+    client (e.g. one pointed at the emulator), or fake_llm=False to build real LiteLlm models.
+    Calling it again in the same process returns the fakes installed by the first call.
+    Returns (firestore_client, storage_client).
+    """
+    if _installed:
+        return _installed["firestore"], _installed["storage"]
+    from firebase_admin import firestore as firebase_firestore
+
+    if firestore_client is None:
+        firestore_client = FakeFirestore()
+        firebase_firestore.transactional = fake_transactional
+    firebase_firestore.client = lambda *args, **kwargs: firestore_client
+
+    from common import clients
+    storage_client = FakeStorageClient()
+    clients.get_or_create("storage", lambda: storage_client)
+    clients.get_or_create("firestore", lambda: firestore_client)
+    _installed.update(firestore=firestore_client, storage=storage_client)
+
+    if not fake_llm:
+        return firestore_client, storage_client
+    from common.agents import llm_config
+    llm_config.PromptCachingLiteLlm = lambda model, **kwargs: FakeLlm(model=model, latency_seconds=llm_latency_seconds)
+    return firestore_client, storage_client
+
+
+__all__ = [
+    'FakeFirestore',
+    'FakeStorageClient',
+    'FakeLlm',
+    'install_fakes',
+]
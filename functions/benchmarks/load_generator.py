@@ -0,0 +1,152 @@
+# functions/benchmarks/load_generator.py
+"""
+Scale test for the run pipeline: fills Firestore with large synthetic chat trees, then runs many agent
+turns concurrently through _run_agent_task_logic with a fake model, and reports throughput and latency.
+
+Each run forks a new branch: it answers a randomly chosen user message somewhere in a chat, so history
+depth varies across runs the way it does with real branching. Runs execute on worker threads, one event
+loop each, like concurrent Cloud Tasks deliveries.
+
+Usage (from functions/, with requirements.txt installed):
+    python -m benchmarks.load_generator --chats 4 --messages 10000 --branching 50 --runs 500 --concurrency 200
+    FIRESTORE_EMULATOR_HOST=localhost:8080 python -m benchmarks.load_generator --firestore emulator ...
+
+The default in-process fake Firestore shows the cost of our own code. The emulator adds realistic
+RPC and serialization overhead (but not production network latency or quotas).
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from .fakes import install_fakes
+from .chat_trees import generate_chat_tree, write_chat_tree
+
+LOAD_MODEL_ID = "load-model"
+# Per-phase metrics (from the assistant message's metrics map) summarized in the report.
+REPORTED_PHASES = ["historyMs", "branchSessionMs", "contentBuildMs", "instantiateMs", "sessionSetupMs",
+                   "firstEventMs", "agentRunMs", "eventWriteMs", "totalMs"]
+
+
+def _percentiles(values: list) -> dict:
+    if not values:
+        return {}
+    ordered = sorted(values)
+
+    def at(q):
+        return round(ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))], 1)
+    return {"count": len(ordered), "mean": round(statistics.fmean(ordered), 1), "p50": at(0.50), "p95": at(0.95), "p99": at(0.99), "max": round(ordered[-1], 1)}
+
+
+def seed_chats(db, storage_client, chat_count: int, message_count: int, branching: int, user_id: str) -> dict:
+    """Writes chat_count chat trees; returns {chatId: [user message ids]} as fork points for the runs."""
+    fork_points = {}
+    for index in range(chat_count):
+        chat_id = f"load-chat-{index:03d}"
+        tree = generate_chat_tree(message_count, branching=branching, participant=f"model:{LOAD_MODEL_ID}",
+                                  user_id=user_id, seed=index, storage_client=storage_client)
+        started = time.perf_counter()
+        write_chat_tree(db, chat_id, tree, owner_id=user_id)
+        print(f"Seeded {chat_id}: {len(tree['messages'])} messages in {time.perf_counter() - started:.1f}s", file=sys.stderr)
+        fork_points[chat_id] = [mid for mid, data in tree["messages"].items() if data["participant"].startswith("user:")]
+    return fork_points
+
+
+def _start_run(db, chat_id: str, parent_id: str, run_index: int, user_id: str) -> dict:
+    """Creates the assistant placeholder the orchestrator would create and returns the task payload."""
+    from firebase_admin import firestore
+    messages_ref = db.collection("chats").document(chat_id).collection("messages")
+    assistant_message_id = f"load-run-{run_index:06d}"
+    messages_ref.document(assistant_message_id).set({
+        "id": assistant_message_id, "participant": f"model:{LOAD_MODEL_ID}", "parentMessageId": parent_id,
+        "childMessageIds": [], "parts": [], "timestamp": firestore.SERVER_TIMESTAMP,
+    })
+    messages_ref.document(parent_id).update({"childMessageIds": firestore.ArrayUnion([assistant_message_id])})
+    return {
+        "chatId": chat_id, "assistantMessageId": assistant_message_id, "agentId": None, "modelId": LOAD_MODEL_ID,
+        "adkUserId": user_id, "firebaseAuthUid": user_id,
+        "dispatchMetrics": {"firestoreBatchMs": None, "enqueuedAtMs": int(time.time() * 1000)},
+    }
+
+
+def _run_once(db, chat_id: str, parent_id: str, run_index: int, user_id: str) -> dict:
+    from handlers.vertex.task import _run_agent_task_logic
+    payload = _start_run(db, chat_id, parent_id, run_index, user_id)
+    started = time.perf_counter()
+    asyncio.run(_run_agent_task_logic(payload))
+    latency_ms = (time.perf_counter() - started) * 1000
+    message = db.collection("chats").document(chat_id).collection("messages").document(payload["assistantMessageId"]).get().to_dict() or {}
+    return {"latencyMs": latency_ms, "status": message.get("status"), "metrics": message.get("metrics") or {},
+            "errors": message.get("errorDetails")}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chats", type=int, default=4)
+    parser.add_argument("--messages", type=int, default=10_000, help="Messages per chat.")
+    parser.add_argument("--branching", type=int, default=50, help="Sibling forks per user turn on the main line.")
+    parser.add_argument("--runs", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=200, help="Runs in flight at once.")
+    parser.add_argument("--model-latency", type=float, default=0.5, help="Seconds the fake model takes per call.")
+    parser.add_argument("--firestore", choices=["fake", "emulator"], default="fake")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="Write the report as JSON to this path (default: stdout).")
+    parser.add_argument("--verbose", action="store_true", help="Keep the handlers' log output.")
+    args = parser.parse_args()
+
+    firestore_client = None
+    if args.firestore == "emulator":
+        if not os.environ.get("FIRESTORE_EMULATOR_HOST"):
+            parser.error("--firestore emulator needs FIRESTORE_EMULATOR_HOST (e.g. localhost:8080).")
+        from google.cloud import firestore as cloud_firestore
+        firestore_client = cloud_firestore.Client(project=os.environ.get("GCLOUD_PROJECT", "demo-bench"))
+    db, storage_client = install_fakes(firestore_client, llm_latency_seconds=args.model_latency)
+    if not args.verbose:
+        from .run_benchmarks import _quiet_logger
+        _quiet_logger()
+
+    user_id = "load-user"
+    db.collection("models").document(LOAD_MODEL_ID).set({"name": "Load model", "provider": "openai", "modelString": "gpt-load"})
+    fork_points = seed_chats(db, storage_client, args.chats, args.messages, args.branching, user_id)
+
+    rng = random.Random(args.seed)
+    chat_ids = list(fork_points)
+    plan = [(chat_id, rng.choice(fork_points[chat_id]), index) for index in range(args.runs) for chat_id in [rng.choice(chat_ids)]]
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        outcomes = list(pool.map(lambda item: _run_once(db, item[0], item[1], item[2], user_id), plan))
+    wall_seconds = time.perf_counter() - started
+
+    statuses = {}
+    for outcome in outcomes:
+        statuses[outcome["status"]] = statuses.get(outcome["status"], 0) + 1
+    report = {
+        "config": {k: v for k, v in vars(args).items() if k not in ("output", "verbose")},
+        "wallSeconds": round(wall_seconds, 2),
+        "throughputRunsPerSecond": round(len(outcomes) / wall_seconds, 2),
+        "statuses": statuses,
+        "latencyMs": _percentiles([o["latencyMs"] for o in outcomes]),
+        "phasesMs": {phase: _percentiles([o["metrics"][phase] for o in outcomes if phase in o["metrics"]]) for phase in REPORTED_PHASES},
+        "sampleErrors": [o["errors"] for o in outcomes if o["errors"]][:5],
+    }
+
+    latency = report["latencyMs"]
+    print(f"{len(outcomes)} runs in {wall_seconds:.1f}s ({report['throughputRunsPerSecond']} runs/s), statuses {statuses}; "
+          f"latency p50 {latency.get('p50')}ms p95 {latency.get('p95')}ms p99 {latency.get('p99')}ms", file=sys.stderr)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+            f.write("\n")
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        sys.stdout.write("\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,201 @@
+# functions/benchmarks/run_benchmarks.py
+"""
+Offline micro-benchmarks for the stages of an agent run.
+
+Each stage runs against in-process fakes (benchmarks/fakes.py): a dict-backed Firestore, an in-memory
+GCS and a stub LLM. No credentials or network are needed. Set FIRESTORE_EMULATOR_HOST and pass
+--firestore emulator to time the Firestore-bound stages against the emulator instead.
+
+Usage (from functions/, with requirements.txt installed):
+    python -m benchmarks.run_benchmarks                                  # all stages
+    python -m benchmarks.run_benchmarks --only history content_build     # some stages
+    python -m benchmarks.run_benchmarks --output bench.json              # write the results to a file
+    python -m benchmarks.run_benchmarks --compare bench.json             # exit 1 on a >25% regression
+
+A summary table goes to stderr. The results go to stdout (or --output) as JSON: one entry per
+(stage, size) with min/mean/p50/p95 milliseconds over --repeats runs.
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import time
+
+from .fakes import install_fakes
+from .chat_trees import generate_chat_tree, write_chat_tree
+
+# A stage counts as regressed when its p50 is this much slower than in the compared results.
+REGRESSION_TOLERANCE = 1.25
+BENCH_MODEL_ID = "bench-model"
+
+
+def _quiet_logger():
+    # Handlers log every step through firebase_functions.logger; printing that would dominate the timings.
+    from common import core
+    for level in ("debug", "info", "log", "warn", "warning"):
+        if hasattr(core.logger, level):
+            setattr(core.logger, level, lambda *args, **kwargs: None)
+
+
+def _sample_events(count: int) -> list:
+    """Event dicts shaped like ADK Event.model_dump(): tool call/response pairs followed by a final answer."""
+    from google.adk.events import Event
+    from google.genai import types
+    events = []
+    for index in range(count - 1):
+        if index % 2 == 0:
+            part = types.Part(function_call=types.FunctionCall(id=f"call-{index}", name="search", args={"query": f"q{index}", "limit": 5}))
+            role = "model"
+        else:
+            part = types.Part(function_response=types.FunctionResponse(id=f"call-{index - 1}", name="search", response={"result": ["hit " * 40] * 5}))
+            role = "user"
+        events.append(Event(author="bench_agent", invocation_id="inv", content=types.Content(role=role, parts=[part])).model_dump())
+    events.append(Event(author="bench_agent", invocation_id="inv", content=types.Content(role="model", parts=[types.Part(text="answer " * 200)]),
+                        usage_metadata=types.GenerateContentResponseUsageMetadata(prompt_token_count=1200, candidates_token_count=300, total_token_count=1500)).model_dump())
+    return events
+
+
+def _agent_tree_config(llm_agents: int, fan_out: int = 5) -> dict:
+    """A SequentialAgent whose children are ParallelAgents of LlmAgents, with llm_agents leaves in total."""
+    leaves = [{"name": f"worker_{i}", "agentType": "Agent", "modelId": BENCH_MODEL_ID,
+               "systemInstruction": "You are a benchmark worker.", "tools": []} for i in range(llm_agents)]
+    groups = [leaves[i:i + fan_out] for i in range(0, len(leaves), fan_out)]
+    # Descriptions are set as the UI sets them: Sequential/ParallelAgent reject a missing description.
+    return {"name": "bench_root", "agentType": "SequentialAgent", "description": "Benchmark pipeline.",
+            "childAgents": [{"name": f"group_{i}", "agentType": "ParallelAgent", "description": f"Group {i}.", "childAgents": group}
+                            for i, group in enumerate(groups)]}
+
+
+def build_stages(db, storage_client) -> dict:
+    """Maps stage name -> (sizes, setup(size) -> zero-argument callable or coroutine function)."""
+    from handlers.vertex.task.history_builder import get_full_message_history, _build_adk_content_from_history
+    from handlers.vertex.task.agent_runner import _write_events, _find_final_response_from_events
+    from common.agents import instantiate_adk_agent_from_config
+
+    db.collection("models").document(BENCH_MODEL_ID).set({
+        "name": "Benchmark model", "provider": "openai", "modelString": "gpt-bench",
+        "parameters": {"temperature": 0.2, "maxOutputTokens": 1024},
+    })
+
+    def history(size):
+        chat_id = f"bench-history-{size}"
+        tree = generate_chat_tree(size, branching=3, storage_client=storage_client)
+        write_chat_tree(db, chat_id, tree)
+        return lambda: get_full_message_history(chat_id, tree["leafMessageId"])
+
+    def content_build(size):
+        tree = generate_chat_tree(size, branching=1, storage_client=storage_client)
+        messages, current, chain = tree["messages"], tree["leafMessageId"], []
+        while current:
+            chain.insert(0, messages[current])
+            current = messages[current]["parentMessageId"]
+        return lambda: _build_adk_content_from_history(chain)
+
+    def event_write(size):
+        events = _sample_events(size)
+        events_ref = db.collection("chats").document("bench-events").collection("messages").document(f"m{size}").collection("events")
+        return lambda: _write_events(events, events_ref, "attempt-01")
+
+    def instantiate(size):
+        config = _agent_tree_config(size)
+        return lambda: instantiate_adk_agent_from_config(config)
+
+    def final_response(size):
+        events = _sample_events(size)
+        return lambda: _find_final_response_from_events(events)
+
+    return {
+        "history": ([100, 1_000, 10_000], history),
+        "content_build": ([10, 100, 1_000], content_build),
+        "event_write": ([10, 100, 400], event_write),
+        "instantiate": ([1, 10, 50], instantiate),
+        "final_response": ([10, 1_000, 10_000], final_response),
+    }
+
+
+def _time_call(call) -> float:
+    started = time.perf_counter()
+    result = call()
+    if asyncio.iscoroutine(result):
+        asyncio.run(result)
+    return (time.perf_counter() - started) * 1000
+
+
+def run_stage(name: str, sizes: list, setup, repeats: int) -> list:
+    results = []
+    for size in sizes:
+        call = setup(size)
+        _time_call(call)  # Warm-up: imports, caches and lazily built clients.
+        samples = sorted(_time_call(call) for _ in range(repeats))
+        results.append({
+            "stage": name, "size": size, "repeats": repeats,
+            "minMs": round(samples[0], 3),
+            "meanMs": round(statistics.fmean(samples), 3),
+            "p50Ms": round(statistics.median(samples), 3),
+            "p95Ms": round(samples[min(len(samples) - 1, int(round(0.95 * (len(samples) - 1))))], 3),
+        })
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--only", nargs="*", help="Stages to run (default: all).")
+    parser.add_argument("--repeats", type=int, default=10, help="Timed runs per stage and size.")
+    parser.add_argument("--firestore", choices=["fake", "emulator"], default="fake")
+    parser.add_argument("--output", help="Write the results as JSON to this path.")
+    parser.add_argument("--compare", help="Earlier results JSON; exit 1 if any stage's p50 regressed.")
+    parser.add_argument("--verbose", action="store_true", help="Keep the handlers' log output.")
+    args = parser.parse_args()
+
+    firestore_client = None
+    if args.firestore == "emulator":
+        if not os.environ.get("FIRESTORE_EMULATOR_HOST"):
+            parser.error("--firestore emulator needs FIRESTORE_EMULATOR_HOST (e.g. localhost:8080).")
+        from google.cloud import firestore as cloud_firestore
+        firestore_client = cloud_firestore.Client(project=os.environ.get("GCLOUD_PROJECT", "demo-bench"))
+    db, storage_client = install_fakes(firestore_client)
+    if not args.verbose:
+        _quiet_logger()
+
+    stages = build_stages(db, storage_client)
+    unknown = set(args.only or []) - set(stages)
+    if unknown:
+        parser.error(f"Unknown stages: {', '.join(sorted(unknown))}. Available: {', '.join(stages)}")
+
+    results = []
+    for name, (sizes, setup) in stages.items():
+        if args.only and name not in args.only:
+            continue
+        results.extend(run_stage(name, sizes, setup, args.repeats))
+
+    previous = {}
+    if args.compare:
+        with open(args.compare) as f:
+            previous = {(r["stage"], r["size"]): r for r in json.load(f)["results"]}
+
+    regressions = []
+    print(f"{'stage':<16} {'size':>7} {'p50 ms':>10} {'p95 ms':>10} {'min ms':>10} {'prev p50':>10}", file=sys.stderr)
+    for result in results:
+        earlier = previous.get((result["stage"], result["size"]), {}).get("p50Ms")
+        print(f"{result['stage']:<16} {result['size']:>7} {result['p50Ms']:>10.3f} {result['p95Ms']:>10.3f} "
+              f"{result['minMs']:>10.3f} {earlier if earlier is not None else '-':>10}", file=sys.stderr)
+        if earlier and result["p50Ms"] > earlier * REGRESSION_TOLERANCE:
+            regressions.append(f"{result['stage']}[{result['size']}]")
+
+    report = {"python": sys.version.split()[0], "firestore": args.firestore, "results": results}
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+            f.write("\n")
+    else:
+        json.dump(report, sys.stdout)
+        sys.stdout.write("\n")
+    if regressions:
+        print(f"p50 regressed by more than {int((REGRESSION_TOLERANCE - 1) * 100)}% for: {', '.join(regressions)}", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
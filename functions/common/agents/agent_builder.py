@@ -7,6 +7,7 @@ from google.genai import types as genai_types
 
 from .llm_config import prepare_llm_and_generation_config
 from .tool_factory import prepare_tools_from_config
+from .workflow_agents import BoundedParallelAgent, BudgetedLoopAgent
 from ..core import logger
 from ..adk_helpers import get_model_config_from_firestore
 
@@ -41,6 +42,22 @@ async def _prepare_llm_agent_kwargs(merged_config: dict, adk_agent_name: str, co
     return {k: v for k, v in agent_kwargs.items() if v is not None}
 
 
+def _parse_positive_number(agent_config: dict, key: str, cast, adk_agent_name: str):
+    """Reads an optional positive number from the agent config; missing, invalid or non-positive values give None."""
+    raw_value = agent_config.get(key)
+    if raw_value in (None, ""):
+        return None
+    try:
+        value = cast(raw_value)
+    except (TypeError, ValueError):
+        logger.warn(f"Invalid {key} value '{raw_value}' for agent '{adk_agent_name}'. Ignoring it.")
+        return None
+    if value <= 0:
+        logger.warn(f"{key} for agent '{adk_agent_name}' is {value}, which is not positive. Ignoring it.")
+        return None
+    return value
+
+
 def sanitize_adk_agent_name(name_str: str, prefix_if_needed: str = "agent_") -> str:
     # ADK agent names should be valid Python identifiers.
     # Replace non-alphanumeric (excluding underscore) with underscore
@@ -149,10 +166,10 @@ async def instantiate_adk_agent_from_config(agent_config, parent_adk_name_for_co
             try:
                 max_iterations = int(max_iterations_str)
                 if max_iterations <= 0:  # Must be positive
-                    logger.warning(f"maxLoops for LoopAgent '{adk_agent_name}' is {max_iterations}, which is not positive. Defaulting to 3.")
+                    logger.warn(f"maxLoops for LoopAgent '{adk_agent_name}' is {max_iterations}, which is not positive. Defaulting to 3.")
                     max_iterations = 3
             except ValueError:
-                logger.warning(f"Invalid maxLoops value '{max_iterations_str}' for LoopAgent '{adk_agent_name}'. Defaulting to 3.")
+                logger.warn(f"Invalid maxLoops value '{max_iterations_str}' for LoopAgent '{adk_agent_name}'. Defaulting to 3.")
                 max_iterations = 3
 
             loop_agent_kwargs = {
@@ -160,9 +177,15 @@ async def instantiate_adk_agent_from_config(agent_config, parent_adk_name_for_co
                 "description": agent_config.get("description"),
                 "sub_agents": [looped_child_agent_instance],  # Pass as list
                 "max_iterations": max_iterations,              # Correct parameter name
+                "max_loop_seconds": _parse_positive_number(agent_config, "maxLoopSeconds", float, adk_agent_name),
+                "max_loop_tokens": _parse_positive_number(agent_config, "maxLoopTokens", int, adk_agent_name),
+                # Convergence is judged on the looped child's output, which it saves under outputKey.
+                "convergence_key": merged_config.get("outputKey") if agent_config.get("stopOnConvergence") else None,
             }
+            if agent_config.get("stopOnConvergence") and not merged_config.get("outputKey"):
+                logger.warn(f"LoopAgent '{adk_agent_name}' has stopOnConvergence but no outputKey to compare. Ignoring it.")
             logger.debug(f"Final kwargs for LoopAgent '{adk_agent_name}': {{name, description, max_iterations, sub_agents count: {len(loop_agent_kwargs['sub_agents'])}}}")
-            return LoopAgent(**loop_agent_kwargs)
+            return BudgetedLoopAgent(**loop_agent_kwargs)
 
     elif AgentClass == SequentialAgent or AgentClass == ParallelAgent:
         child_agent_configs = agent_config.get("childAgents", [])
@@ -189,6 +212,16 @@ async def instantiate_adk_agent_from_config(agent_config, parent_adk_name_for_co
             "description": agent_config.get("description"),
             "sub_agents": instantiated_child_agents
         }
+        if AgentClass == ParallelAgent:
+            max_parallel_branches = _parse_positive_number(agent_config, "maxParallelBranches", int, adk_agent_name)
+            branch_timeout_seconds = _parse_positive_number(agent_config, "branchTimeoutSeconds", float, adk_agent_name)
+            if max_parallel_branches or branch_timeout_seconds:
+                AgentClass = BoundedParallelAgent
+                orchestrator_kwargs.update({
+                    "max_parallel_branches": max_parallel_branches,
+                    "branch_timeout_seconds": branch_timeout_seconds,
+                    "return_partial_results": agent_config.get("returnPartialResults", True) is not False,
+                })
         logger.debug(f"Final kwargs for {AgentClass.__name__} '{adk_agent_name}': {{name, description, num_sub_agents: {len(instantiated_child_agents)}}}")
         return AgentClass(**orchestrator_kwargs)
 
@@ -0,0 +1,165 @@
+# functions/common/agents/failover_llm.py
+import asyncio
+import time
+from collections import deque
+from typing import Any, AsyncGenerator, Optional, Union
+from google.adk.models import BaseLlm, LlmRequest, LlmResponse
+
+from ..core import logger
+
+# A provider that fails or times out is tried last by this process for this long.
+UNHEALTHY_COOLDOWN_SECONDS = 60
+# hedgeAfterSeconds "p95" uses the primary's observed time to first response once this many samples exist.
+MIN_LATENCY_SAMPLES = 20
+LATENCY_WINDOW = 200
+
+_unhealthy_until = {}
+_first_response_latencies = {}
+
+
+def _candidate_key(llm: BaseLlm) -> str:
+    api_base = (getattr(llm, "_additional_args", None) or {}).get("api_base")
+    return f"{llm.model}@{api_base}" if api_base else llm.model
+
+
+def _record_latency(key: str, seconds: float):
+    _first_response_latencies.setdefault(key, deque(maxlen=LATENCY_WINDOW)).append(seconds)
+
+
+def observed_p95_seconds(key: str) -> float | None:
+    """The 95th percentile of recent times to first response for a candidate, or None with too few samples."""
+    samples = sorted(_first_response_latencies.get(key) or [])
+    if len(samples) < MIN_LATENCY_SAMPLES:
+        return None
+    return samples[min(len(samples) - 1, int(round(0.95 * (len(samples) - 1))))]
+
+
+def _request_for(llm_request: LlmRequest, generate_content_config) -> LlmRequest:
+    """The request with a fallback's own sampling parameters laid over the agent's generation config."""
+    if not generate_content_config:
+        return llm_request
+    request = llm_request.model_copy(deep=True)
+    overrides = generate_content_config.model_dump(exclude_none=True)
+    request.config = request.config.model_copy(update=overrides) if request.config else generate_content_config.model_copy()
+    return request
+
+
+async def _abandon(task: asyncio.Future, generator):
+    """Cancels a candidate's pending first response and closes its generator so its connection is released."""
+    task.cancel()
+    await asyncio.wait([task])
+    try:
+        await generator.aclose()
+    except Exception as e:
+        logger.warn(f"Closing an abandoned model request failed: {type(e).__name__}: {e}")
+
+
+class FailoverLlm(BaseLlm):
+    """
+    Sends each request to an ordered list of LiteLlm endpoints: the agent's own model, then its fallbacks.
+    A candidate that raises, or produces nothing within request_timeout_seconds, is abandoned for the next.
+    With hedge_after_seconds set, a backup request goes to the next candidate if the first has not responded
+    by then, and whichever answers first is used. Once a candidate has yielded a response the run stays on it.
+    Candidates are (llm, generate_content_config or None) pairs; model is the primary's model string.
+    """
+    candidates: list[Any]
+    request_timeout_seconds: Optional[float] = None
+    hedge_after_seconds: Optional[Union[float, str]] = None
+
+    def _ordered_candidates(self) -> list:
+        # Healthy candidates first, keeping the configured order within each group.
+        now = time.monotonic()
+        return sorted(self.candidates, key=lambda candidate: _unhealthy_until.get(_candidate_key(candidate[0]), 0) > now)
+
+    def _hedge_delay(self, primary_key: str) -> float | None:
+        if self.hedge_after_seconds == "p95":
+            return observed_p95_seconds(primary_key)
+        return float(self.hedge_after_seconds) if self.hedge_after_seconds else None
+
+    @staticmethod
+    def _mark_unhealthy(key: str, reason: str):
+        _unhealthy_until[key] = time.monotonic() + UNHEALTHY_COOLDOWN_SECONDS
+        logger.warn(f"Model endpoint '{key}' failed ({reason}); trying the next fallback.")
+
+    def _start(self, candidate, llm_request: LlmRequest, stream: bool, in_flight: dict) -> str:
+        """Starts a candidate's request and adds its first-response task to in_flight; returns its key."""
+        llm, generate_content_config = candidate
+        key = _candidate_key(llm)
+        generator = llm.generate_content_async(_request_for(llm_request, generate_content_config), stream=stream)
+        started = time.monotonic()
+
+        async def first_response():
+            response = await generator.__anext__()
+            _record_latency(key, time.monotonic() - started)
+            return response
+
+        deadline = started + self.request_timeout_seconds if self.request_timeout_seconds else None
+        in_flight[asyncio.ensure_future(first_response())] = (key, generator, deadline)
+        return key
+
+    async def generate_content_async(self, llm_request: LlmRequest, stream: bool = False) -> AsyncGenerator[LlmResponse, None]:
+        pending = list(self._ordered_candidates())
+        in_flight = {}  # first-response task -> (key, generator, deadline)
+        winner = None
+        try:
+            while winner is None:
+                if not in_flight:
+                    if not pending:
+                        raise RuntimeError("Every model endpoint failed or timed out.")
+                    self._start(pending.pop(0), llm_request, stream, in_flight)
+
+                now = time.monotonic()
+                deadlines = [deadline for _, _, deadline in in_flight.values() if deadline]
+                wait_for = min(deadlines) - now if deadlines else None
+                hedge_delay = self._hedge_delay(next(iter(in_flight.values()))[0]) if len(in_flight) == 1 and pending else None
+                if hedge_delay is not None:
+                    wait_for = hedge_delay if wait_for is None else min(wait_for, hedge_delay)
+
+                done, _ = await asyncio.wait(in_flight, timeout=max(wait_for, 0) if wait_for is not None else None,
+                                             return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    key, generator, _ = in_flight.pop(task)
+                    try:
+                        winner = (key, generator, task.result())
+                        break
+                    except StopAsyncIteration:
+                        self._mark_unhealthy(key, "no response")
+                    except Exception as e:
+                        self._mark_unhealthy(key, f"{type(e).__name__}: {e}")
+                if winner:
+                    break
+
+                now = time.monotonic()
+                for task, (key, generator, deadline) in list(in_flight.items()):
+                    if deadline and now >= deadline:
+                        in_flight.pop(task)
+                        await _abandon(task, generator)
+                        self._mark_unhealthy(key, f"no response within {self.request_timeout_seconds}s")
+                if not done and len(in_flight) == 1 and pending and hedge_delay is not None:
+                    key = self._start(pending.pop(0), llm_request, stream, in_flight)
+                    logger.info(f"Hedging model request to '{key}' after {hedge_delay:.2f}s without a response.")
+        finally:
+            # The generator can only be closed once its pending __anext__ has finished unwinding.
+            await asyncio.gather(*(_abandon(task, generator) for task, (_, generator, _) in in_flight.items()))
+
+        key, generator, first = winner
+        if key != _candidate_key(self.candidates[0][0]):
+            logger.info(f"Model request for '{self.model}' served by fallback '{key}'.")
+        yield first
+        async for response in generator:
+            yield response
+
+
+def unwrap_failover_models(root_agent):
+    """
+    Replaces every FailoverLlm in the agent tree with its primary LiteLlm. Deployed agents are pickled for
+    Vertex AI, which cannot import this module, so fallbacks only apply to runs executed by the functions.
+    """
+    if isinstance(getattr(root_agent, "model", None), FailoverLlm):
+        logger.warn(f"Agent '{root_agent.name}' is deployed without its fallback models.")
+        root_agent.model = root_agent.model.candidates[0][0]
+    for sub_agent in getattr(root_agent, "sub_agents", None) or []:
+        unwrap_failover_models(sub_agent)
+
+
+__all__ = ['FailoverLlm', 'observed_p95_seconds', 'unwrap_failover_models']
@@ -1,8 +1,13 @@
 # functions/common/agents/llm_config.py
 import os
+from google.adk.models import BaseLlm
 from google.adk.models.lite_llm import LiteLlm
+from .prompt_cache import PromptCachingLiteLlm, cache_hint_style
 from google.genai import types as genai_types
 from ..core import logger
+from ..adk_helpers import get_model_config_from_firestore
+from .failover_llm import FailoverLlm
+from .rate_governor import GovernedLiteLLMClient, get_rate_governor
 
 BACKEND_LITELLM_PROVIDER_CONFIG = {
     "openai": {"prefix": "openai", "apiKeyEnv": "OPENAI_API_KEY"},
@@ -21,9 +26,10 @@ BACKEND_LITELLM_PROVIDER_CONFIG = {
     "custom": {"prefix": None, "apiKeyEnv": None} # No prefix, user provides full string
 }
 
-async def prepare_llm_and_generation_config(merged_agent_and_model_config: dict, adk_agent_name: str, context_for_log: str = "") -> tuple[LiteLlm, genai_types.GenerateContentConfig | None]:
+async def prepare_llm_and_generation_config(merged_agent_and_model_config: dict, adk_agent_name: str, context_for_log: str = "") -> tuple[BaseLlm, genai_types.GenerateContentConfig | None]:
     """
     Prepares the LiteLlm model instance and the GenerateContentConfig from the merged configuration.
+    With fallbackModelIds, the LiteLlm is wrapped in a FailoverLlm that also tries those models' endpoints.
     """
     # --- Part 1: Prepare LiteLlm instance ---
     selected_provider_id = merged_agent_and_model_config.get("provider")
@@ -95,7 +101,11 @@ async def prepare_llm_and_generation_config(merged_agent_and_model_config: dict,
             else:
                 logger.warn(f"WatsonX deployment model used for {adk_agent_name} but space_id not found. Deployment may fail or use default space.")
 
-    actual_model_for_adk = LiteLlm(**model_constructor_kwargs)
+    # Calls wait for the provider key's requests/tokens-per-minute budget, shared across instances, and mark
+    # the stable prompt prefix for providers that take cache hints (unless the config sets promptCache: false).
+    hint_style = cache_hint_style(selected_provider_id, final_model_str_for_litellm) if merged_agent_and_model_config.get("promptCache", True) else None
+    model_constructor_kwargs["llm_client"] = GovernedLiteLLMClient(get_rate_governor(selected_provider_id, final_api_key), cache_hint_style=hint_style)
+    actual_model_for_adk = PromptCachingLiteLlm(**model_constructor_kwargs)
 
     # --- Part 2: Prepare GenerateContentConfig ---
     model_params = merged_agent_and_model_config
@@ -134,4 +144,36 @@ async def prepare_llm_and_generation_config(merged_agent_and_model_config: dict,
         logger.info(f"Agent '{adk_agent_name}' has model generation parameters: {generate_config_kwargs}")
         generate_content_config = genai_types.GenerateContentConfig(**generate_config_kwargs)
 
-    return actual_model_for_adk, generate_content_config
\ No newline at end of file
+    fallback_model_ids = merged_agent_and_model_config.get("fallbackModelIds") or []
+    if fallback_model_ids:
+        candidates = [(actual_model_for_adk, None)]
+        for fallback_model_id in fallback_model_ids:
+            # Fallbacks bring their own endpoint and sampling parameters but not their own fallbacks.
+            fallback_config = {**await get_model_config_from_firestore(fallback_model_id), "fallbackModelIds": []}
+            fallback_llm, fallback_generate_config = await prepare_llm_and_generation_config(
+                fallback_config, adk_agent_name, context_for_log=f"(fallback {fallback_model_id}) {context_for_log}")
+            candidates.append((fallback_llm, fallback_generate_config))
+        logger.info(f"Agent '{adk_agent_name}' will fail over to models {fallback_model_ids}.")
+        actual_model_for_adk = FailoverLlm(
+            model=actual_model_for_adk.model, candidates=candidates,
+            request_timeout_seconds=merged_agent_and_model_config.get("requestTimeoutSeconds"),
+            hedge_after_seconds=merged_agent_and_model_config.get("hedgeAfterSeconds"),
+        )
+
+    return actual_model_for_adk, generate_content_config
+
+
+def prepare_models_for_deployment(root_agent):
+    """
+    Rebuilds every LiteLlm in the agent tree as a plain LiteLlm with the default client before the tree is
+    pickled for Vertex AI. The governed client holds a lock and the functions' Firestore client, neither of
+    which pickles, and deployed agents cannot import the rate governor or PromptCachingLiteLlm, so deployed
+    calls go straight to the provider without cache hints. Run it after unwrap_failover_models so fallback
+    candidates are already gone.
+    """
+    model = getattr(root_agent, "model", None)
+    if isinstance(model, LiteLlm) and (type(model) is not LiteLlm or isinstance(model.llm_client, GovernedLiteLLMClient)):
+        # _additional_args holds the constructor kwargs minus llm_client, so the endpoint and key carry over.
+        root_agent.model = LiteLlm(model=model.model, **model._additional_args)
+    for sub_agent in getattr(root_agent, "sub_agents", None) or []:
+        prepare_models_for_deployment(sub_agent)
@@ -0,0 +1,111 @@
+# functions/common/agents/prompt_cache.py
+import contextvars
+from google.adk.models.lite_llm import LiteLlm
+
+# Providers whose LiteLLM integration takes cache_control hints. OpenAI and DeepSeek cache long prompt
+# prefixes automatically, so they need no hints; their cached token counts are still recorded.
+CACHE_HINT_PROVIDERS = {"anthropic": "anthropic", "google_ai_studio": "gemini"}
+# Anthropic accepts at most four cache breakpoints per request.
+MAX_BREAKPOINTS = 4
+_EPHEMERAL = {"type": "ephemeral"}
+
+# Number of leading parts of the run's new message that repeat turn after turn (earlier turns and pinned
+# context), set by the history builder. Model calls in the same task read it when placing breakpoints.
+_stable_prefix_parts = contextvars.ContextVar("stable_prefix_parts", default=None)
+# Cached prompt tokens reported for the latest LiteLLM call in this task.
+_last_cached_tokens = contextvars.ContextVar("last_cached_tokens", default=None)
+
+
+def mark_stable_prefix(part_count: int):
+    """Records that the first part_count parts of the message being built form a stable, cacheable prefix."""
+    _stable_prefix_parts.set(part_count)
+
+
+def cache_hint_style(provider: str, model_string: str | None) -> str | None:
+    """"anthropic" or "gemini" when the provider takes cache_control hints through LiteLLM, else None."""
+    if provider == "bedrock" and "anthropic" in (model_string or ""):
+        return "anthropic"
+    return CACHE_HINT_PROVIDERS.get(provider)
+
+
+def _mark_item(message: dict, item_index: int | None, text_only: bool) -> bool:
+    """Adds cache_control to one content item of message (the last one by default)."""
+    content = message.get("content")
+    if isinstance(content, str):
+        if not content:
+            return False
+        message["content"] = content = [{"type": "text", "text": content}]
+    if not isinstance(content, list) or not content:
+        return False
+    candidates = range(len(content)) if item_index is None else range(item_index + 1)
+    for index in reversed(candidates):
+        item = content[index]
+        if isinstance(item, dict) and (not text_only or item.get("type") == "text"):
+            content[index] = {**item, "cache_control": _EPHEMERAL}
+            return True
+    return False
+
+
+def add_cache_breakpoints(messages: list, style: str) -> list:
+    """
+    Returns messages with cache_control on the end of each stable prefix: the system instruction, the
+    turns before the latest user message and, within that message, the parts the history builder marked
+    as stable. Gemini caches whole messages, so it only gets the first two.
+    """
+    if not messages:
+        return messages
+    marked = [dict(message) for message in messages]
+    for message in marked:
+        if isinstance(message.get("content"), list):
+            message["content"] = list(message["content"])
+    text_only = style == "gemini"
+    breakpoints = 0
+
+    system_index = next((i for i, m in enumerate(marked) if m.get("role") in ("system", "developer")), None)
+    if system_index is not None and _mark_item(marked[system_index], None, text_only):
+        breakpoints += 1
+
+    last_user_index = next((i for i in range(len(marked) - 1, -1, -1) if marked[i].get("role") == "user"), None)
+    if last_user_index is not None and last_user_index - 1 > (system_index if system_index is not None else -1):
+        if _mark_item(marked[last_user_index - 1], None, text_only):
+            breakpoints += 1
+
+    stable_parts = _stable_prefix_parts.get()
+    if style == "anthropic" and last_user_index is not None and stable_parts and breakpoints < MAX_BREAKPOINTS:
+        content = marked[last_user_index].get("content")
+        if isinstance(content, list) and stable_parts < len(content):
+            _mark_item(marked[last_user_index], stable_parts - 1, text_only)
+    return marked
+
+
+def record_cached_tokens(response):
+    """Notes the cached prompt tokens a LiteLLM response reports (OpenAI, Anthropic and Gemini alike)."""
+    usage = getattr(response, "usage", None)
+    if usage is None:
+        return
+    details = getattr(usage, "prompt_tokens_details", None)
+    cached = getattr(details, "cached_tokens", None) if details is not None else None
+    if cached is None:
+        cached = getattr(usage, "cache_read_input_tokens", None)
+    _last_cached_tokens.set(cached)
+
+
+class PromptCachingLiteLlm(LiteLlm):
+    """LiteLlm that adds the provider's cached prompt token count to each response's usage metadata."""
+
+    async def generate_content_async(self, llm_request, stream: bool = False):
+        _last_cached_tokens.set(None)
+        async for response in super().generate_content_async(llm_request, stream=stream):
+            cached = _last_cached_tokens.get()
+            if cached and response.usage_metadata is not None:
+                response.usage_metadata.cached_content_token_count = cached
+            yield response
+
+
+__all__ = [
+    'PromptCachingLiteLlm',
+    'mark_stable_prefix',
+    'cache_hint_style',
+    'add_cache_breakpoints',
+    'record_cached_tokens',
+]
@@ -0,0 +1,287 @@
+# functions/common/agents/rate_governor.py
+import asyncio
+import datetime
+import hashlib
+import math
+import random
+import re
+import threading
+import time
+from firebase_admin import firestore
+from google.adk.models.lite_llm import LiteLLMClient
+
+from ..core import db, logger
+from ..clients import get_or_create
+from .prompt_cache import add_cache_breakpoints, record_cached_tokens
+
+# Requests-per-minute and tokens-per-minute budgets for LiteLLM calls, shared by every function instance.
+# providerRateLimits/{provider} sets "rpm", "tpm" and optionally "maxWaitSeconds"; without them a key is only
+# governed once the provider's rate-limit headers report its limits. Budgets apply per provider and API key.
+CONFIG_COLLECTION = "providerRateLimits"
+# providerRateState/{budgetKey} holds limits observed in response headers and a pausedUntil after a 429.
+STATE_COLLECTION = "providerRateState"
+# providerRateWindows/{budgetKey}_{window}_{shard} counts the requests and tokens handed out in one window.
+# Each of SHARD_COUNT shards owns 1/SHARD_COUNT of the budget, so claims spread over documents.
+WINDOWS_COLLECTION = "providerRateWindows"
+SHARD_COUNT = 8
+WINDOW_SECONDS = 60
+# An instance claims this fraction of a shard at a time and spends it locally without further writes.
+CLAIM_FRACTION = 0.25
+CONFIG_REFRESH_SECONDS = 15
+DEFAULT_MAX_WAIT_SECONDS = 60
+# A 429 pauses the key for at least this long, even without a retry-after header.
+MIN_PAUSE_SECONDS = 1.0
+
+_LIMIT_HEADERS = {
+    "rpm": ("x-ratelimit-limit-requests", "llm_provider-anthropic-ratelimit-requests-limit"),
+    "tpm": ("x-ratelimit-limit-tokens", "llm_provider-anthropic-ratelimit-tokens-limit"),
+}
+_REMAINING_HEADERS = (
+    ("x-ratelimit-remaining-requests", "x-ratelimit-reset-requests"),
+    ("x-ratelimit-remaining-tokens", "x-ratelimit-reset-tokens"),
+    ("llm_provider-anthropic-ratelimit-requests-remaining", "llm_provider-anthropic-ratelimit-requests-reset"),
+    ("llm_provider-anthropic-ratelimit-tokens-remaining", "llm_provider-anthropic-ratelimit-tokens-reset"),
+)
+
+
+class RateBudgetExceeded(Exception):
+    """Raised when a call would have to wait longer than maxWaitSeconds for the provider's budget."""
+
+
+def budget_key(provider: str, api_key: str | None) -> str:
+    """Identifies a budget without storing the key: the provider plus a short hash of the API key."""
+    key_hash = hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:12] if api_key else "default"
+    return f"{provider}:{key_hash}"
+
+
+def _parse_reset_seconds(value) -> float | None:
+    """Parses "20ms", "1s", "6m0s" (OpenAI), plain seconds (retry-after) or an RFC 3339 time (Anthropic)."""
+    if value is None:
+        return None
+    text = str(value).strip()
+    try:
+        return float(text)
+    except ValueError:
+        pass
+    units = re.findall(r"([\d.]+)(ms|h|m|s)", text)
+    if units and "".join(number + unit for number, unit in units) == text:
+        scale = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+        return sum(float(number) * scale[unit] for number, unit in units)
+    try:
+        reset_at = datetime.datetime.fromisoformat(text.replace("Z", "+00:00"))
+        return max(0.0, reset_at.timestamp() - time.time())
+    except ValueError:
+        return None
+
+
+def _to_number(value) -> float | None:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class RateGovernor:
+    """
+    Per-process view of one provider key's budget. Calls spend a local allowance; when it runs out the
+    governor claims another slice of the current window from a Firestore shard, and waits for the next
+    window (or the end of a pause) when every shard is spent.
+    """
+
+    def __init__(self, key: str, provider: str):
+        self.key, self.provider = key, provider
+        self._lock = threading.Lock()
+        self._window, self._requests, self._tokens = None, 0, 0
+        self._limits, self._limits_loaded_at = (None, None, DEFAULT_MAX_WAIT_SECONDS), 0.0
+        self._observed = {}
+        self._paused_until = 0.0
+
+    def _state_ref(self):
+        return db.collection(STATE_COLLECTION).document(self.key)
+
+    def _load_limits(self) -> tuple:
+        """(rpm, tpm, maxWaitSeconds): the configured budget, lowered to the limits the provider reports."""
+        if time.monotonic() - self._limits_loaded_at < CONFIG_REFRESH_SECONDS:
+            return self._limits
+        config = db.collection(CONFIG_COLLECTION).document(self.provider).get().to_dict() or {}
+        state = self._state_ref().get().to_dict() or {}
+        self._paused_until = max(self._paused_until, state.get("pausedUntil") or 0.0)
+        observed = {**(state.get("observed") or {}), **self._observed}
+        limits = []
+        for field in ("rpm", "tpm"):
+            candidates = [value for value in (config.get(field), observed.get(field)) if value]
+            limits.append(min(candidates) if candidates else None)
+        self._limits = (*limits, config.get("maxWaitSeconds") or DEFAULT_MAX_WAIT_SECONDS)
+        self._limits_loaded_at = time.monotonic()
+        return self._limits
+
+    def _take_local(self, window: int, tokens: int, rpm, tpm) -> bool:
+        with self._lock:
+            if self._window != window:
+                self._window, self._requests, self._tokens = window, 0, 0
+            if (rpm and self._requests < 1) or (tpm and self._tokens < tokens):
+                return False
+            self._requests -= 1
+            self._tokens -= tokens
+            return True
+
+    def _claim(self, window: int, tokens: int, rpm, tpm) -> bool:
+        """Claims allowance from the window's shards until the local allowance covers one call of tokens."""
+        shard_requests = math.ceil(rpm / SHARD_COUNT) if rpm else None
+        shard_tokens = math.ceil(tpm / SHARD_COUNT) if tpm else None
+        expires_at = datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(seconds=WINDOW_SECONDS * 5)
+
+        @firestore.transactional
+        def _claim_shard(transaction, shard_ref, want_requests, want_tokens):
+            used = shard_ref.get(transaction=transaction).to_dict() or {}
+            granted_requests = min(want_requests, shard_requests - used.get("requests", 0)) if rpm else 0
+            granted_tokens = min(want_tokens, shard_tokens - used.get("tokens", 0)) if tpm else 0
+            granted_requests, granted_tokens = max(0, granted_requests), max(0, granted_tokens)
+            if granted_requests or granted_tokens:
+                transaction.set(shard_ref, {
+                    "requests": used.get("requests", 0) + granted_requests,
+                    "tokens": used.get("tokens", 0) + granted_tokens, "expiresAt": expires_at,
+                })
+            return granted_requests, granted_tokens
+
+        for shard in random.sample(range(SHARD_COUNT), SHARD_COUNT):
+            with self._lock:
+                if self._window != window:
+                    self._window, self._requests, self._tokens = window, 0, 0
+                need_requests = 1 - self._requests if rpm else 0
+                need_tokens = tokens - self._tokens if tpm else 0
+            if need_requests <= 0 and need_tokens <= 0:
+                return True
+            shard_ref = db.collection(WINDOWS_COLLECTION).document(f"{self.key}_{window}_{shard}")
+            want_requests = max(need_requests, math.ceil(shard_requests * CLAIM_FRACTION)) if rpm else 0
+            want_tokens = max(need_tokens, math.ceil(shard_tokens * CLAIM_FRACTION)) if tpm else 0
+            granted_requests, granted_tokens = _claim_shard(db.transaction(), shard_ref, want_requests, want_tokens)
+            with self._lock:
+                if self._window == window:
+                    self._requests += granted_requests
+                    self._tokens += granted_tokens
+        with self._lock:
+            return (not rpm or self._requests >= 1) and (not tpm or self._tokens >= tokens)
+
+    async def acquire(self, tokens: int):
+        """Waits until one call of about `tokens` tokens fits the budget; raises RateBudgetExceeded on timeout."""
+        rpm, tpm, max_wait = await asyncio.to_thread(self._load_limits)
+        if not rpm and not tpm and self._paused_until <= time.time():
+            return
+        if tpm:
+            tokens = min(tokens, tpm)  # A call larger than the whole budget still gets to run once per window.
+        deadline = time.monotonic() + max_wait
+        while True:
+            now = time.time()
+            window = int(now // WINDOW_SECONDS)
+            if self._paused_until > now:
+                wait_seconds = self._paused_until - now
+            elif not rpm and not tpm:
+                return
+            elif self._take_local(window, tokens, rpm, tpm):
+                return
+            elif await asyncio.to_thread(self._claim, window, tokens, rpm, tpm) and self._take_local(window, tokens, rpm, tpm):
+                return
+            else:
+                # Spread the instances that were waiting for this budget over the start of the next window.
+                wait_seconds = (window + 1) * WINDOW_SECONDS - now + random.uniform(0, 2)
+            if time.monotonic() + wait_seconds > deadline:
+                raise RateBudgetExceeded(f"Rate budget for {self.key} is exhausted; the call would wait {wait_seconds:.0f}s.")
+            logger.info(f"Rate budget for {self.key} is spent; waiting {wait_seconds:.1f}s.")
+            await asyncio.sleep(wait_seconds)
+
+    def settle(self, estimated_tokens: int, actual_tokens: int | None):
+        """Charges the difference between a call's estimated and actual token usage to the local allowance."""
+        if actual_tokens is None:
+            return
+        with self._lock:
+            self._tokens -= actual_tokens - estimated_tokens
+
+    def _record_state(self, update: dict):
+        try:
+            self._state_ref().set({**update, "updatedAt": firestore.SERVER_TIMESTAMP}, merge=True)
+        except Exception as e:
+            logger.warn(f"Could not record rate limit state for {self.key}: {e}")
+
+    async def observe_headers(self, headers: dict, rate_limited: bool = False):
+        """Feeds provider rate-limit headers back: reported limits cap the budget, exhausted limits pause the key."""
+        headers = {str(k).lower(): v for k, v in (headers or {}).items()}
+        observed = {}
+        for field, names in _LIMIT_HEADERS.items():
+            value = next((_to_number(headers[name]) for name in names if name in headers), None)
+            if value:
+                observed[field] = int(value)
+
+        pause_seconds = None
+        for remaining_name, reset_name in _REMAINING_HEADERS:
+            if _to_number(headers.get(remaining_name)) == 0:
+                reset = _parse_reset_seconds(headers.get(reset_name))
+                pause_seconds = max(pause_seconds or 0.0, reset if reset is not None else WINDOW_SECONDS)
+        if rate_limited:
+            retry_after = _parse_reset_seconds(headers.get("retry-after") or headers.get("llm_provider-retry-after"))
+            pause_seconds = max(pause_seconds or 0.0, retry_after if retry_after is not None else MIN_PAUSE_SECONDS)
+
+        update = {}
+        if observed and observed != {k: self._observed.get(k) for k in observed}:
+            self._observed.update(observed)
+            self._limits_loaded_at = 0.0
+            update["observed"] = observed
+        if pause_seconds:
+            paused_until = time.time() + max(pause_seconds, MIN_PAUSE_SECONDS)
+            if paused_until > self._paused_until + 1:
+                self._paused_until = paused_until
+                update["pausedUntil"] = paused_until
+                logger.warn(f"Provider key {self.key} hit its rate limit; pausing calls for {pause_seconds:.1f}s.")
+        if update:
+            # The local view is already updated; only sharing it with other instances goes to Firestore.
+            await asyncio.to_thread(self._record_state, update)
+
+
+def get_rate_governor(provider: str, api_key: str | None) -> RateGovernor:
+    """The process-wide governor for a provider key."""
+    key = budget_key(provider, api_key)
+    return get_or_create(f"rate_governor:{key}", lambda: RateGovernor(key, provider))
+
+
+def estimate_tokens(messages: list, max_output_tokens: int | None) -> int:
+    """Rough prompt size (4 characters per token) plus the requested output budget."""
+    prompt_chars = sum(len(str(message.get("content") or "")) for message in messages or [] if isinstance(message, dict))
+    return prompt_chars // 4 + (max_output_tokens or 0)
+
+
+class GovernedLiteLLMClient(LiteLLMClient):
+    """
+    LiteLLM client for LiteLlm that waits for the provider key's rate budget before each call. With
+    cache_hint_style set, it also marks the stable prompt prefix for the provider's prompt cache.
+    """
+
+    def __init__(self, governor: RateGovernor, cache_hint_style: str | None = None):
+        self.governor = governor
+        self.cache_hint_style = cache_hint_style
+
+    async def acompletion(self, model, messages, tools, **kwargs):
+        if self.cache_hint_style:
+            messages = add_cache_breakpoints(messages, self.cache_hint_style)
+        estimated = estimate_tokens(messages, kwargs.get("max_completion_tokens") or kwargs.get("max_tokens"))
+        await self.governor.acquire(estimated)
+        try:
+            response = await super().acompletion(model, messages, tools, **kwargs)
+        except Exception as e:
+            if getattr(e, "status_code", None) == 429:
+                await self.governor.observe_headers(dict(getattr(getattr(e, "response", None), "headers", None) or {}), rate_limited=True)
+            raise
+        record_cached_tokens(response)
+        hidden_params = getattr(response, "_hidden_params", None) or {}
+        await self.governor.observe_headers(hidden_params.get("additional_headers") or {})
+        usage = getattr(response, "usage", None)
+        self.governor.settle(estimated, getattr(usage, "total_tokens", None) if usage else None)
+        return response
+
+
+__all__ = [
+    'RateGovernor',
+    'RateBudgetExceeded',
+    'GovernedLiteLLMClient',
+    'get_rate_governor',
+    'budget_key',
+]
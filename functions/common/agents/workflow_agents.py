@@ -0,0 +1,179 @@
+# functions/common/agents/workflow_agents.py
+# Deployed agents are pickled for Vertex AI, and the admin handler pickles this module by value so the
+# classes below run there too. Keep its imports to the standard library and google-adk: anything from
+# the functions codebase (including its firebase logger) would not be importable in the deployment.
+import asyncio
+import logging
+import time
+from typing import AsyncGenerator, Optional
+
+from google.adk.agents import LoopAgent, ParallelAgent
+from google.adk.agents.invocation_context import InvocationContext
+from google.adk.agents.parallel_agent import _create_branch_ctx_for_sub_agent
+from google.adk.events import Event
+from google.adk.utils.context_utils import Aclosing
+
+logger = logging.getLogger(__name__)
+
+# The executeAgentRunTask timeout in main.py. A loop stops starting iterations that would end within
+# DEADLINE_MARGIN_SECONDS of it, so the run can still record its result.
+TASK_TIMEOUT_SECONDS = 540
+DEADLINE_MARGIN_SECONDS = 30
+
+_BRANCH_DONE = object()
+_UNSET = object()
+
+
+class BoundedParallelAgent(ParallelAgent):
+    """
+    ParallelAgent that runs at most max_parallel_branches sub-agents at a time and gives each branch
+    branch_timeout_seconds from the moment it starts. With return_partial_results, a branch that times out
+    or raises is cancelled and recorded as an event (error_code BRANCH_TIMEOUT or BRANCH_FAILED), and the
+    agent finishes with the other branches' results. Without it, the first such branch fails the run.
+    """
+    max_parallel_branches: Optional[int] = None
+    branch_timeout_seconds: Optional[float] = None
+    return_partial_results: bool = True
+
+    def _branch_event(self, ctx: InvocationContext, branch_ctx: InvocationContext, sub_agent, status: str,
+                      message: str, elapsed_seconds: float) -> Event:
+        return Event(
+            invocation_id=ctx.invocation_id, author=self.name, branch=branch_ctx.branch,
+            error_code="BRANCH_TIMEOUT" if status == "timedOut" else "BRANCH_FAILED", error_message=message,
+            custom_metadata={"parallelBranch": {"agent": sub_agent.name, "status": status,
+                                                "elapsedSeconds": round(elapsed_seconds, 2)}},
+        )
+
+    async def _run_async_impl(self, ctx: InvocationContext) -> AsyncGenerator[Event, None]:
+        if not self.max_parallel_branches and not self.branch_timeout_seconds:
+            async for event in super()._run_async_impl(ctx):
+                yield event
+            return
+
+        queue = asyncio.Queue()
+        slots = asyncio.Semaphore(self.max_parallel_branches or len(self.sub_agents) or 1)
+
+        async def run_branch(sub_agent):
+            branch_ctx = _create_branch_ctx_for_sub_agent(self, sub_agent, ctx)
+            outcome, error, deadline = None, None, None
+            async with slots:
+                started = time.monotonic()
+                try:
+                    async with Aclosing(sub_agent.run_async(branch_ctx)) as events:
+                        async with asyncio.timeout(self.branch_timeout_seconds) as deadline:
+                            async for event in events:
+                                resume_signal = asyncio.Event()
+                                await queue.put((event, resume_signal))
+                                # Wait for the runner to consume the event before the branch continues.
+                                await resume_signal.wait()
+                except TimeoutError as e:
+                    elapsed = time.monotonic() - started
+                    if deadline is None or not deadline.expired():
+                        error = e
+                        message = f"Branch '{sub_agent.name}' failed: {type(e).__name__}: {e}"
+                        outcome = self._branch_event(ctx, branch_ctx, sub_agent, "failed", message, elapsed)
+                    else:
+                        message = f"Branch '{sub_agent.name}' timed out after {self.branch_timeout_seconds}s."
+                        error = TimeoutError(message)
+                        outcome = self._branch_event(ctx, branch_ctx, sub_agent, "timedOut", message, elapsed)
+                except Exception as e:
+                    error = e
+                    message = f"Branch '{sub_agent.name}' failed: {type(e).__name__}: {e}"
+                    outcome = self._branch_event(ctx, branch_ctx, sub_agent, "failed", message, time.monotonic() - started)
+                finally:
+                    await queue.put((_BRANCH_DONE, outcome, error))
+
+        tasks = [asyncio.create_task(run_branch(sub_agent)) for sub_agent in self.sub_agents]
+        try:
+            finished = 0
+            while finished < len(tasks):
+                item = await queue.get()
+                if item[0] is not _BRANCH_DONE:
+                    event, resume_signal = item
+                    yield event
+                    resume_signal.set()
+                    continue
+                finished += 1
+                _, outcome, error = item
+                if outcome is None:
+                    continue
+                if not self.return_partial_results:
+                    raise error
+                logger.warning(outcome.error_message)
+                yield outcome
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+
+class BudgetedLoopAgent(LoopAgent):
+    """
+    LoopAgent that also stops before an iteration that would overrun its wall-clock budget
+    (max_loop_seconds), its token budget (max_loop_tokens) or the task deadline, judged by the average
+    iteration so far. With convergence_key set, it stops once an iteration leaves that state value
+    unchanged. The task deadline counts from the start of the invocation. When the loop ends, an event
+    authored by the loop records the reason in custom_metadata.loopStop.
+    """
+    max_loop_seconds: Optional[float] = None
+    max_loop_tokens: Optional[int] = None
+    convergence_key: Optional[str] = None
+    task_timeout_seconds: Optional[float] = TASK_TIMEOUT_SECONDS
+
+    def _deadline(self, ctx: InvocationContext, loop_started: float) -> float | None:
+        if not self.task_timeout_seconds:
+            return None
+        invocation_started = next((event.timestamp for event in ctx.session.events
+                                   if event.invocation_id == ctx.invocation_id), loop_started)
+        return invocation_started + self.task_timeout_seconds - DEADLINE_MARGIN_SECONDS
+
+    def _budget_stop_reason(self, iterations: int, elapsed: float, tokens: int, remaining: float | None) -> str | None:
+        if self.max_iterations and iterations >= self.max_iterations:
+            return "maxLoops"
+        seconds_per_iteration = elapsed / iterations if iterations else 0
+        tokens_per_iteration = tokens / iterations if iterations else 0
+        if remaining is not None and seconds_per_iteration >= remaining:
+            return "taskDeadline"
+        if self.max_loop_seconds and elapsed + seconds_per_iteration > self.max_loop_seconds:
+            return "timeBudget"
+        if self.max_loop_tokens and tokens + tokens_per_iteration > self.max_loop_tokens:
+            return "tokenBudget"
+        return None
+
+    async def _run_async_impl(self, ctx: InvocationContext) -> AsyncGenerator[Event, None]:
+        started = time.time()
+        deadline = self._deadline(ctx, started)
+        iterations, tokens, reason = 0, 0, None
+        previous_output = _UNSET
+        while True:
+            now = time.time()
+            reason = self._budget_stop_reason(iterations, now - started, tokens, deadline - now if deadline else None)
+            if reason:
+                break
+            for sub_agent in self.sub_agents:
+                async with Aclosing(sub_agent.run_async(ctx)) as events:
+                    async for event in events:
+                        yield event
+                        if event.usage_metadata and not event.partial:
+                            tokens += event.usage_metadata.total_token_count or 0
+                        if event.actions.escalate:
+                            reason = "escalated"
+                if reason:
+                    break
+            if reason:
+                break
+            iterations += 1
+            if self.convergence_key:
+                output = ctx.session.state.get(self.convergence_key, _UNSET)
+                if output is not _UNSET and output == previous_output:
+                    reason = "converged"
+                    break
+                previous_output = output
+
+        stop = {"reason": reason, "iterations": iterations, "elapsedSeconds": round(time.time() - started, 2), "tokens": tokens}
+        logger.info(f"Loop '{self.name}' stopped: {stop}")
+        yield Event(invocation_id=ctx.invocation_id, author=self.name, branch=ctx.branch,
+                    custom_metadata={"loopStop": stop})
+
+
+__all__ = ['BoundedParallelAgent', 'BudgetedLoopAgent']
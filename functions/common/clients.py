@@ -0,0 +1,82 @@
+# functions/common/clients.py
+import os
+import threading
+from .core import logger
+
+# Process-wide registry of SDK clients and resolved configuration. Each entry is built on first use and
+# then shared by every call served by the warm instance, so auth discovery and gRPC/HTTP channel setup
+# happen once per process instead of once per request.
+_registry = {}
+# Guards _key_locks only. Each entry is built under its own lock, so a slow factory does not hold up
+# lookups of other keys, and a factory may itself call get_or_create for a different key.
+_registry_lock = threading.Lock()
+_key_locks = {}
+_registry_pid = os.getpid()
+
+
+def _reset_after_fork():
+    # gRPC channels and HTTP sessions must not be shared across a fork; the child rebuilds its own.
+    global _registry, _registry_lock, _key_locks, _registry_pid
+    _registry, _registry_lock, _key_locks, _registry_pid = {}, threading.Lock(), {}, os.getpid()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def get_or_create(key: str, factory):
+    """Returns the registry entry for key, calling factory() to build it on first use (thread-safe)."""
+    if os.getpid() != _registry_pid:  # Forked without going through os.fork (e.g. some multiprocessing starts).
+        _reset_after_fork()
+    instance = _registry.get(key)
+    if instance is None:
+        with _registry_lock:
+            key_lock = _key_locks.setdefault(key, threading.Lock())
+        with key_lock:
+            instance = _registry.get(key)
+            if instance is None:
+                instance = factory()
+                _registry[key] = instance
+                logger.info(f"Created shared client '{key}'.")
+    return instance
+
+
+def get_storage_client():
+    """Shared google.cloud.storage client."""
+    def _create():
+        from google.cloud import storage
+        return storage.Client()
+    return get_or_create("storage", _create)
+
+
+def get_firestore_client():
+    """Shared google.cloud.firestore client (the same client firebase_admin hands out as common.core.db)."""
+    def _create():
+        from firebase_admin import firestore
+        return firestore.client()
+    return get_or_create("firestore", _create)
+
+
+def get_tasks_client():
+    """Shared Cloud Tasks client."""
+    def _create():
+        from google.cloud import tasks_v2
+        return tasks_v2.CloudTasksClient()
+    return get_or_create("tasks", _create)
+
+
+def get_reasoning_engine_client(location: str):
+    """Shared Vertex AI ReasoningEngineServiceClient for the given region."""
+    def _create():
+        from google.cloud.aiplatform_v1beta1 import ReasoningEngineServiceClient
+        return ReasoningEngineServiceClient(client_options={"api_endpoint": f"{location}-aiplatform.googleapis.com"})
+    return get_or_create(f"reasoning_engine:{location}", _create)
+
+
+__all__ = [
+    'get_or_create',
+    'get_storage_client',
+    'get_firestore_client',
+    'get_tasks_client',
+    'get_reasoning_engine_client',
+]
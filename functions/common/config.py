@@ -1,6 +1,7 @@
 import os
 import firebase_admin # For project_id retrieval
 from .core import logger # Use the central logger
+from .clients import get_or_create
 
 # --- CORS Configuration ---
 CORS_ORIGINS = [
@@ -14,7 +15,11 @@ CORS_ORIGINS = [
 def get_gcp_project_config():
     """
     Determines GCP project ID, location, and staging bucket.
+    Resolved once per process; later calls return the cached tuple.
     """
+    return get_or_create("gcp_project_config", _resolve_gcp_project_config)
+
+def _resolve_gcp_project_config():
     project_id = None
     try:
         project_id = firebase_admin.get_app().project_id
@@ -0,0 +1,169 @@
+# functions/common/event_log.py
+import gzip
+import json
+import os
+
+from .core import logger
+from .clients import get_or_create, get_storage_client
+
+# In compact mode the full event log of a run is one gzipped JSONL object per assistant message, and only
+# the key events are written to its events subcollection.
+EVENT_LOG_PREFIX = "eventLogs"
+# Text and tool payloads longer than this are cut short in the Firestore index; the full log keeps them.
+MAX_INDEXED_TEXT_CHARS = 4_000
+# The web app downloads a full log as soon as it gets the signed link, so the link is short-lived.
+EVENT_LOG_URL_EXPIRATION_MINUTES = 5
+
+
+def get_event_log_bucket(storage_client):
+    """Returns the per-project event log bucket, creating it on first use. Looked up once per process."""
+    from .config import get_gcp_project_config
+    project_id, _, _ = get_gcp_project_config()
+    bucket_name = f"{project_id}-event-logs"
+
+    def _lookup_or_create():
+        bucket = storage_client.lookup_bucket(bucket_name)
+        if bucket is None:
+            logger.warn(f"Storage bucket '{bucket_name}' not found. Creating it with default settings.")
+            bucket = storage_client.create_bucket(bucket_name, location=os.environ.get("FUNCTION_REGION", "us-central1"))
+        return bucket
+    return get_or_create(f"bucket:{bucket_name}", _lookup_or_create)
+
+
+def _parts(event: dict) -> list:
+    return (event.get("content") or {}).get("parts") or []
+
+
+def coalesce_partial_events(events: list) -> list:
+    """
+    Returns (raw index, event) pairs with streaming partials folded away: partial events followed by a
+    complete event from the same author and branch are dropped, since that event carries the whole reply.
+    Partials left over at the end (a cancelled or failed stream) are merged into one partial event.
+    """
+    coalesced, open_partials = [], {}
+    for index, event in enumerate(events):
+        stream_key = (event.get("author"), event.get("branch"))
+        if event.get("partial"):
+            open_partials.setdefault(stream_key, []).append((index, event))
+            continue
+        open_partials.pop(stream_key, None)
+        coalesced.append((index, event))
+    for partials in open_partials.values():
+        last_index, last_event = partials[-1]
+        text = "".join(part.get("text") or "" for _, event in partials for part in _parts(event))
+        merged = {**last_event, "content": {**(last_event.get("content") or {}), "parts": [{"text": text}]}}
+        coalesced.append((last_index, merged))
+    return sorted(coalesced, key=lambda pair: pair[0])
+
+
+def is_key_event(event: dict) -> bool:
+    """Tool calls and results, replies with text, errors and workflow records are indexed in Firestore."""
+    if event.get("error_code") or event.get("error_message") or event.get("custom_metadata"):
+        return True
+    for part in _parts(event):
+        if part.get("function_call") or part.get("function_response") or part.get("text"):
+            return True
+    return False
+
+
+def _truncate(value, limit: int):
+    """Shortens long strings, and JSON-encodes then shortens large structures. Returns (value, truncated)."""
+    if isinstance(value, str):
+        return (value, False) if len(value) <= limit else (value[:limit], True)
+    encoded = json.dumps(value, default=str)
+    return (value, False) if len(encoded) <= limit else (encoded[:limit], True)
+
+
+def index_entry(event: dict) -> dict:
+    """The Firestore copy of a key event: long text and tool payloads are truncated and flagged."""
+    entry, truncated = dict(event), False
+    if parts := _parts(event):
+        indexed_parts = []
+        for part in parts:
+            part = {key: value for key, value in part.items() if value is not None}
+            for key in ("text", "function_response"):
+                if key in part:
+                    part[key], cut = _truncate(part[key], MAX_INDEXED_TEXT_CHARS)
+                    truncated = truncated or cut
+            indexed_parts.append(part)
+        entry["content"] = {**event["content"], "parts": indexed_parts}
+    if truncated:
+        entry["truncated"] = True
+    return entry
+
+
+def event_log_blob_name(message_ref) -> str:
+    return f"{EVENT_LOG_PREFIX}/{message_ref.path}.jsonl.gz"
+
+
+def upload_event_log(message_ref, events: list, storage_client=None) -> str:
+    """Writes the full event log of a message as gzipped JSONL and returns its gs:// URI."""
+    bucket = get_event_log_bucket(storage_client or get_storage_client())
+    blob = bucket.blob(event_log_blob_name(message_ref))
+    jsonl = "".join(json.dumps(event, default=str) + "\n" for event in events)
+    blob.content_encoding = "gzip"
+    blob.upload_from_string(gzip.compress(jsonl.encode("utf-8")), content_type="application/x-ndjson")
+    return f"gs://{bucket.name}/{blob.name}"
+
+
+def download_event_log(event_log_uri: str, storage_client=None) -> list:
+    """Reads a log written by upload_event_log back into a list of event dicts."""
+    bucket_name, blob_name = event_log_uri.split('/', 3)[2:]
+    blob = (storage_client or get_storage_client()).bucket(bucket_name).blob(blob_name)
+    # Ask for the stored bytes as-is; the client would otherwise decompress gzip-encoded objects itself.
+    data = blob.download_as_bytes(raw_download=True)
+    return [json.loads(line) for line in gzip.decompress(data).decode("utf-8").splitlines() if line]
+
+
+def _ensure_bucket_cors_for_downloads(bucket):
+    """Browsers GET logs straight from signed URLs, so the bucket must allow our web origins."""
+    from .config import CORS_ORIGINS
+    if any("GET" in rule.get("method", []) for rule in bucket.cors or []):
+        return
+    bucket.cors = [{
+        "origin": CORS_ORIGINS,
+        "method": ["GET"],
+        "responseHeader": ["Content-Type", "Content-Encoding"],
+        "maxAgeSeconds": 3600
+    }]
+    bucket.patch()
+    logger.info(f"Configured CORS for event log downloads on bucket '{bucket.name}'.")
+
+
+def create_event_log_download_url(event_log_uri: str, storage_client=None) -> str:
+    """
+    Returns a V4 signed GET URL for a log written by upload_event_log. The object is stored with gzip
+    content encoding, so a browser fetching it receives the decompressed JSONL.
+    """
+    import google.auth
+    from datetime import timedelta
+    from google.auth.transport import requests as google_auth_requests
+
+    bucket_name, blob_name = event_log_uri.split('/', 3)[2:]
+    bucket = get_event_log_bucket(storage_client or get_storage_client())
+    if bucket.name != bucket_name:
+        raise ValueError(f"{event_log_uri} is not in the event log bucket '{bucket.name}'.")
+    _ensure_bucket_cors_for_downloads(bucket)
+
+    # Function runtimes use token-based credentials without a private key, so signing goes through IAM signBlob.
+    credentials = get_or_create("signing_credentials", lambda: google.auth.default()[0])
+    if not credentials.valid:
+        credentials.refresh(google_auth_requests.Request())
+    return bucket.blob(blob_name).generate_signed_url(
+        version="v4",
+        expiration=timedelta(minutes=EVENT_LOG_URL_EXPIRATION_MINUTES),
+        method="GET",
+        service_account_email=getattr(credentials, "service_account_email", None),
+        access_token=credentials.token
+    )
+
+
+__all__ = [
+    'get_event_log_bucket',
+    'coalesce_partial_events',
+    'is_key_event',
+    'index_entry',
+    'upload_event_log',
+    'download_event_log',
+    'create_event_log_download_url',
+]
@@ -0,0 +1,270 @@
+# functions/common/firestore_session_service.py
+import asyncio
+import datetime
+import gzip
+import json
+import time
+import uuid
+from typing import Any, Optional
+from firebase_admin import firestore
+from google.adk.events import Event
+from google.adk.sessions import BaseSessionService, Session, State
+from google.adk.sessions.base_session_service import GetSessionConfig, ListSessionsResponse
+
+from .core import db, logger
+from .clients import get_storage_client
+from .event_log import get_event_log_bucket
+from .tracing import span
+
+# adkSessions/{sessionId} holds the compacted session-scoped state; every appended event is its own
+# document in the events subcollection and is never rewritten. app:/user: state lives in adkAppState and
+# adkUserState so it is shared across sessions, as with ADK's other session services.
+SESSIONS_COLLECTION = "adkSessions"
+APP_STATE_COLLECTION = "adkAppState"
+USER_STATE_COLLECTION = "adkUserState"
+
+# A resumed session loads at most this many recent events unless the caller asks for more.
+DEFAULT_MAX_RESUME_EVENTS = 200
+# Firestore caps documents at 1 MiB. Inline media is dropped from the stored copy of larger events, and
+# text parts that still do not fit (e.g. a stuffed git repository) are moved to Cloud Storage.
+MAX_EVENT_BYTES = 900_000
+SESSION_PAYLOAD_PREFIX = "adkSessions"
+# Sessions, their events and offloaded payloads carry expiresAt this long after their last write; a
+# Firestore TTL policy on expiresAt (and a lifecycle rule on the payload prefix) deletes them.
+SESSION_TTL_DAYS = 30
+
+
+def _json_bytes(value: str) -> int:
+    return len(value.encode("utf-8"))
+
+
+def _serialize_event(event: Event, offload_text=None) -> tuple[str, dict]:
+    """
+    Returns (event_json, offloaded_parts). offload_text(part_index, text) stores a text part elsewhere and
+    returns its URI; the largest text parts are offloaded until the event fits, and offloaded_parts maps
+    each part index to its URI so the text can be restored on load.
+    """
+    event_json = event.model_dump_json(exclude_none=True)
+    if _json_bytes(event_json) <= MAX_EVENT_BYTES or not event.content or not event.content.parts:
+        return event_json, {}
+    stored_event = event.model_copy(deep=True)
+    parts = stored_event.content.parts
+    for index, part in enumerate(parts):
+        if part.inline_data:
+            parts[index] = type(part)(text=f"[{part.inline_data.mime_type or 'file'} omitted from stored session]")
+    event_json = stored_event.model_dump_json(exclude_none=True)
+    offloaded_parts = {}
+    if offload_text and _json_bytes(event_json) > MAX_EVENT_BYTES:
+        for index in sorted((i for i, part in enumerate(parts) if part.text), key=lambda i: len(parts[i].text), reverse=True):
+            offloaded_parts[str(index)] = offload_text(index, parts[index].text)
+            parts[index] = type(parts[index])(text="")
+            event_json = stored_event.model_dump_json(exclude_none=True)
+            if _json_bytes(event_json) <= MAX_EVENT_BYTES:
+                break
+    logger.info(f"Event {event.id} is too large to store as is; stored without inline media and with {len(offloaded_parts)} text parts offloaded.")
+    return event_json, offloaded_parts
+
+
+def _expires_at() -> datetime.datetime:
+    return datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(days=SESSION_TTL_DAYS)
+
+
+def _split_state_delta(state_delta: dict) -> tuple[dict, dict, dict]:
+    app_delta, user_delta, session_delta = {}, {}, {}
+    for key, value in state_delta.items():
+        if key.startswith(State.APP_PREFIX):
+            app_delta[key.removeprefix(State.APP_PREFIX)] = value
+        elif key.startswith(State.USER_PREFIX):
+            user_delta[key.removeprefix(State.USER_PREFIX)] = value
+        elif not key.startswith(State.TEMP_PREFIX):
+            session_delta[key] = value
+    return app_delta, user_delta, session_delta
+
+
+def _trim_to_turn_start(events: list[Event]) -> list[Event]:
+    """Drops leading events up to the first user message, so a truncated history never opens mid tool call."""
+    first_user_index = next((i for i, event in enumerate(events) if event.author == "user"), None)
+    return events[first_user_index:] if first_user_index is not None else []
+
+
+class FirestoreSessionService(BaseSessionService):
+    """
+    ADK session service backed by Firestore. Events are appended one document each and the session
+    document keeps a compacted state snapshot, so resuming a session reads one document plus its most
+    recent events instead of replaying the whole conversation. The Firestore client is synchronous, so
+    each async method does its reads and writes in a worker thread instead of blocking the event loop.
+    """
+
+    def __init__(self, max_resume_events: int = DEFAULT_MAX_RESUME_EVENTS):
+        self.max_resume_events = max_resume_events
+
+    def _session_ref(self, session_id: str):
+        return db.collection(SESSIONS_COLLECTION).document(session_id)
+
+    def _app_state_ref(self, app_name: str):
+        return db.collection(APP_STATE_COLLECTION).document(app_name)
+
+    def _user_state_ref(self, app_name: str, user_id: str):
+        return db.collection(USER_STATE_COLLECTION).document(f"{app_name}:{user_id}")
+
+    @staticmethod
+    def _payload_bucket():
+        return get_event_log_bucket(get_storage_client())
+
+    def _offload_text(self, session_id: str, event_doc_id: str, part_index: int, text: str) -> str:
+        blob = self._payload_bucket().blob(f"{SESSION_PAYLOAD_PREFIX}/{session_id}/{event_doc_id}-{part_index}.txt.gz")
+        blob.content_encoding = "gzip"
+        blob.upload_from_string(gzip.compress(text.encode("utf-8")), content_type="text/plain")
+        return f"gs://{blob.bucket.name}/{blob.name}"
+
+    @staticmethod
+    def _load_event(event_doc) -> Event:
+        event = Event.model_validate_json(event_doc.get("event"))
+        for index, uri in (event_doc.get("offloadedParts") or {}).items():
+            bucket_name, blob_name = uri.split('/', 3)[2:]
+            # The stored bytes are gzip; ask for them as-is rather than letting the client decompress.
+            data = get_storage_client().bucket(bucket_name).blob(blob_name).download_as_bytes(raw_download=True)
+            part = event.content.parts[int(index)]
+            event.content.parts[int(index)] = type(part)(text=gzip.decompress(data).decode("utf-8"))
+        return event
+
+    @staticmethod
+    def _read_scoped_state(ref) -> dict:
+        values = (ref.get().to_dict() or {}).get("values") or {}
+        return {key: json.loads(value) for key, value in values.items()}
+
+    @staticmethod
+    def _write_scoped_state(batch, ref, delta: dict):
+        batch.set(ref, {"values": {key: json.dumps(value, default=str) for key, value in delta.items()},
+                        "updatedAt": firestore.SERVER_TIMESTAMP}, merge=True)
+
+    def _merged_state(self, app_name: str, user_id: str, session_state: dict) -> dict:
+        state = dict(session_state)
+        state.update({State.APP_PREFIX + k: v for k, v in self._read_scoped_state(self._app_state_ref(app_name)).items()})
+        state.update({State.USER_PREFIX + k: v for k, v in self._read_scoped_state(self._user_state_ref(app_name, user_id)).items()})
+        return state
+
+    async def create_session(self, *, app_name: str, user_id: str, state: Optional[dict[str, Any]] = None,
+                             session_id: Optional[str] = None) -> Session:
+        return await asyncio.to_thread(self._create_session, app_name, user_id, state, session_id)
+
+    def _create_session(self, app_name: str, user_id: str, state: Optional[dict[str, Any]], session_id: Optional[str]) -> Session:
+        session_id = session_id.strip() if session_id and session_id.strip() else str(uuid.uuid4())
+        app_delta, user_delta, session_state = _split_state_delta(state or {})
+        now = time.time()
+        batch = db.batch()
+        batch.create(self._session_ref(session_id), {
+            "appName": app_name, "userId": user_id, "stateJson": json.dumps(session_state, default=str),
+            "eventCount": 0, "lastUpdateTime": now, "createdAt": firestore.SERVER_TIMESTAMP, "expiresAt": _expires_at(),
+        })
+        if app_delta:
+            self._write_scoped_state(batch, self._app_state_ref(app_name), app_delta)
+        if user_delta:
+            self._write_scoped_state(batch, self._user_state_ref(app_name, user_id), user_delta)
+        batch.commit()
+        return Session(id=session_id, app_name=app_name, user_id=user_id,
+                       state=self._merged_state(app_name, user_id, session_state), last_update_time=now)
+
+    async def get_session(self, *, app_name: str, user_id: str, session_id: str,
+                          config: Optional[GetSessionConfig] = None) -> Optional[Session]:
+        return await asyncio.to_thread(self._get_session, app_name, user_id, session_id, config)
+
+    def _get_session(self, app_name: str, user_id: str, session_id: str, config: Optional[GetSessionConfig]) -> Optional[Session]:
+        session_ref = self._session_ref(session_id)
+        session_doc = session_ref.get().to_dict()
+        if not session_doc or session_doc.get("appName") != app_name or session_doc.get("userId") != user_id:
+            return None
+
+        events_query = session_ref.collection("events")
+        if config and config.after_timestamp:
+            events_query = events_query.where(filter=firestore.FieldFilter("timestamp", ">=", config.after_timestamp))
+        limit = config.num_recent_events if config and config.num_recent_events else None
+        trim = limit is None and self.max_resume_events and session_doc.get("eventCount", 0) > self.max_resume_events
+        if trim:
+            limit = self.max_resume_events
+        if limit:
+            events_query = events_query.order_by("timestamp", direction=firestore.Query.DESCENDING).limit(limit)
+            event_docs = list(reversed(list(events_query.stream())))
+        else:
+            event_docs = list(events_query.order_by("timestamp").stream())
+        events = [self._load_event(doc) for doc in event_docs]
+        # Older events may also have been removed by the TTL policy while the session kept going.
+        if trim or (not config and len(events) < session_doc.get("eventCount", 0)):
+            events = _trim_to_turn_start(events)
+            logger.info(f"Resumed session {session_id} with its last {len(events)} of {session_doc.get('eventCount')} events.")
+
+        return Session(
+            id=session_id, app_name=app_name, user_id=user_id, events=events,
+            state=self._merged_state(app_name, user_id, json.loads(session_doc.get("stateJson") or "{}")),
+            last_update_time=session_doc.get("lastUpdateTime") or 0.0,
+        )
+
+    async def list_sessions(self, *, app_name: str, user_id: str) -> ListSessionsResponse:
+        return await asyncio.to_thread(self._list_sessions, app_name, user_id)
+
+    def _list_sessions(self, app_name: str, user_id: str) -> ListSessionsResponse:
+        query = db.collection(SESSIONS_COLLECTION) \
+            .where(filter=firestore.FieldFilter("appName", "==", app_name)) \
+            .where(filter=firestore.FieldFilter("userId", "==", user_id))
+        sessions = []
+        for doc in query.stream():
+            session_doc = doc.to_dict()
+            sessions.append(Session(id=doc.id, app_name=app_name, user_id=user_id, state={},
+                                    last_update_time=session_doc.get("lastUpdateTime") or 0.0))
+        return ListSessionsResponse(sessions=sessions)
+
+    async def delete_session(self, *, app_name: str, user_id: str, session_id: str) -> None:
+        await asyncio.to_thread(self._delete_session, session_id)
+
+    def _delete_session(self, session_id: str) -> None:
+        session_ref = self._session_ref(session_id)
+        batch, deleted = db.batch(), 0
+        for event_doc in session_ref.collection("events").stream():
+            batch.delete(event_doc.reference)
+            deleted += 1
+            if deleted % 400 == 0:
+                batch.commit()
+                batch = db.batch()
+        batch.delete(session_ref)
+        batch.commit()
+        for blob in self._payload_bucket().list_blobs(prefix=f"{SESSION_PAYLOAD_PREFIX}/{session_id}/"):
+            blob.delete()
+
+    async def append_event(self, session: Session, event: Event) -> Event:
+        if event.partial:
+            return event
+        event = await super().append_event(session=session, event=event)
+        session.last_update_time = event.timestamp
+        await asyncio.to_thread(self._store_event, session, event)
+        return event
+
+    def _store_event(self, session: Session, event: Event) -> None:
+        app_delta, user_delta, _ = _split_state_delta(event.actions.state_delta if event.actions else {})
+        session_state = {k: v for k, v in session.state.items()
+                         if not k.startswith((State.APP_PREFIX, State.USER_PREFIX, State.TEMP_PREFIX))}
+        session_ref = self._session_ref(session.id)
+        event_doc_id = f"{int(event.timestamp * 1_000_000):016d}-{event.id}"
+        event_json, offloaded_parts = _serialize_event(
+            event, offload_text=lambda part_index, text: self._offload_text(session.id, event_doc_id, part_index, text))
+        expires_at = _expires_at()
+        event_doc = {
+            "event": event_json, "timestamp": event.timestamp,
+            "author": event.author, "invocationId": event.invocation_id, "expiresAt": expires_at,
+        }
+        if offloaded_parts:
+            event_doc["offloadedParts"] = offloaded_parts
+        batch = db.batch()
+        batch.set(session_ref.collection("events").document(event_doc_id), event_doc)
+        batch.update(session_ref, {
+            "stateJson": json.dumps(session_state, default=str),
+            "eventCount": firestore.Increment(1), "lastUpdateTime": event.timestamp, "expiresAt": expires_at,
+        })
+        if app_delta:
+            self._write_scoped_state(batch, self._app_state_ref(session.app_name), app_delta)
+        if user_delta:
+            self._write_scoped_state(batch, self._user_state_ref(session.app_name, session.user_id), user_delta)
+        with span("firestore.batch_commit", purpose="append_session_event", author=event.author):
+            batch.commit()
+
+
+__all__ = ['FirestoreSessionService']
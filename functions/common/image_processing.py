@@ -0,0 +1,87 @@
+# functions/common/image_processing.py
+import io
+from PIL import Image, ImageOps
+from .core import logger
+
+# Largest edge stored for the model-facing variant at ingest time.
+INGEST_MAX_IMAGE_DIMENSION = 2048
+THUMBNAIL_MAX_DIMENSION = 512
+NORMALIZED_IMAGE_MIME_TYPE = "image/webp"
+NORMALIZED_IMAGE_QUALITY = 85
+THUMBNAIL_QUALITY = 75
+
+# Longest edge each provider actually uses; larger images are resized server-side by the provider anyway,
+# so sending more pixels only costs upload time and input tokens.
+PROVIDER_MAX_IMAGE_DIMENSION = {
+    "anthropic": 1568,
+    "bedrock": 1568,
+    "openai": 2048,
+    "azure": 2048,
+    "google_ai_studio": 2048,
+}
+
+
+def get_max_image_dimension_for_provider(provider_id: str | None) -> int:
+    """Returns the longest-edge limit to use when sending images to the given provider."""
+    return PROVIDER_MAX_IMAGE_DIMENSION.get(provider_id, INGEST_MAX_IMAGE_DIMENSION)
+
+
+def _encode_image(image: Image.Image, max_dimension: int, quality: int) -> tuple[bytes, tuple[int, int]]:
+    image = image.copy()
+    image.thumbnail((max_dimension, max_dimension), Image.Resampling.LANCZOS)
+    if image.mode not in ("RGB", "RGBA"):
+        image = image.convert("RGBA" if "transparency" in image.info or image.mode in ("LA", "PA") else "RGB")
+    output = io.BytesIO()
+    image.save(output, format="WEBP", quality=quality, method=4)
+    return output.getvalue(), image.size
+
+
+def normalize_image(image_bytes: bytes, max_dimension: int = INGEST_MAX_IMAGE_DIMENSION) -> dict | None:
+    """
+    Produces a downscaled WebP variant for the model and a small WebP thumbnail for previews.
+    Returns None if the image cannot (or should not) be re-encoded, in which case the original should be used.
+    """
+    try:
+        with Image.open(io.BytesIO(image_bytes)) as source:
+            if getattr(source, "is_animated", False):
+                logger.info("Skipping normalization for animated image.")
+                return None
+            source = ImageOps.exif_transpose(source)
+            original_size = source.size
+            normalized_bytes, normalized_size = _encode_image(source, max_dimension, NORMALIZED_IMAGE_QUALITY)
+            thumbnail_bytes, _ = _encode_image(source, THUMBNAIL_MAX_DIMENSION, THUMBNAIL_QUALITY)
+    except Exception as e:
+        logger.warn(f"Could not normalize image, keeping original: {e}")
+        return None
+
+    logger.info(f"Normalized image {original_size} -> {normalized_size}: {len(image_bytes)} -> {len(normalized_bytes)} bytes (thumbnail: {len(thumbnail_bytes)} bytes).")
+    return {
+        "bytes": normalized_bytes,
+        "mimeType": NORMALIZED_IMAGE_MIME_TYPE,
+        "width": normalized_size[0],
+        "height": normalized_size[1],
+        "thumbnailBytes": thumbnail_bytes,
+    }
+
+
+def downscale_image_if_needed(image_bytes: bytes, mime_type: str, max_dimension: int) -> tuple[bytes, str]:
+    """Re-encodes an image only when its longest edge exceeds max_dimension; otherwise returns it untouched."""
+    try:
+        with Image.open(io.BytesIO(image_bytes)) as image:
+            if max(image.size) <= max_dimension or getattr(image, "is_animated", False):
+                return image_bytes, mime_type
+            resized_bytes, resized_size = _encode_image(ImageOps.exif_transpose(image), max_dimension, NORMALIZED_IMAGE_QUALITY)
+    except Exception as e:
+        logger.warn(f"Could not downscale image, sending as stored: {e}")
+        return image_bytes, mime_type
+    logger.info(f"Downscaled image to {resized_size} for a {max_dimension}px provider limit.")
+    return resized_bytes, NORMALIZED_IMAGE_MIME_TYPE
+
+
+__all__ = [
+    'INGEST_MAX_IMAGE_DIMENSION',
+    'PROVIDER_MAX_IMAGE_DIMENSION',
+    'get_max_image_dimension_for_provider',
+    'normalize_image',
+    'downscale_image_if_needed',
+]
@@ -0,0 +1,86 @@
+# functions/common/retrieval.py
+import io
+import re
+import zlib
+import numpy as np
+from .core import logger
+
+# Contexts smaller than this are cheap enough to stuff whole; retrieval only kicks in above it.
+RETRIEVAL_MIN_CHARS = 50_000
+CHUNK_SIZE_CHARS = 2_000
+CHUNK_OVERLAP_CHARS = 200
+EMBEDDING_DIM = 512
+DEFAULT_TOP_K = 8
+INDEX_MIME_TYPE = "application/x-npz"
+
+_TOKEN_PATTERN = re.compile(r"[A-Za-z0-9_]+")
+
+
+def chunk_text(text: str, chunk_size: int = CHUNK_SIZE_CHARS, overlap: int = CHUNK_OVERLAP_CHARS) -> np.ndarray:
+    """
+    Splits text into overlapping windows, preferring to break on newlines.
+    Returns an (n, 2) int64 array of [start, end) character offsets.
+    """
+    offsets, start, text_length = [], 0, len(text)
+    while start < text_length:
+        end = min(start + chunk_size, text_length)
+        if end < text_length:
+            newline_at = text.rfind("\n", start + chunk_size // 2, end)
+            if newline_at != -1:
+                end = newline_at + 1
+        offsets.append((start, end))
+        if end >= text_length:
+            break
+        start = max(end - overlap, start + 1)
+    return np.asarray(offsets, dtype=np.int64).reshape(-1, 2)
+
+
+def embed_texts(texts: list[str], dim: int = EMBEDDING_DIM) -> np.ndarray:
+    """
+    Embeds texts locally with signed feature hashing over unigrams and bigrams.
+    No model call is needed, so ingest and query-time scoring stay fast and deterministic.
+    """
+    matrix = np.zeros((len(texts), dim), dtype=np.float32)
+    for row, text in enumerate(texts):
+        tokens = [t.lower() for t in _TOKEN_PATTERN.findall(text)]
+        features = tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]
+        for feature in features:
+            hashed = zlib.crc32(feature.encode("utf-8"))
+            matrix[row, hashed % dim] += 1.0 if (hashed >> 31) & 1 else -1.0
+    # Sublinear term frequency so long, repetitive chunks don't dominate the similarity scores.
+    matrix = np.sign(matrix) * np.log1p(np.abs(matrix))
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def build_chunk_index(text: str) -> tuple[bytes, int]:
+    """Builds the compressed index (float16 embedding matrix plus chunk offsets) for a text blob."""
+    offsets = chunk_text(text)
+    embeddings = embed_texts([text[start:end] for start, end in offsets])
+    buffer = io.BytesIO()
+    np.savez_compressed(buffer, embeddings=embeddings.astype(np.float16), offsets=offsets)
+    logger.info(f"Built retrieval index with {len(offsets)} chunks ({buffer.tell()} bytes) for {len(text)} characters.")
+    return buffer.getvalue(), len(offsets)
+
+
+def select_relevant_chunks(text: str, index_bytes: bytes, query: str, top_k: int = DEFAULT_TOP_K) -> list[str]:
+    """Returns the top_k chunks most similar to the query, in their original document order."""
+    with np.load(io.BytesIO(index_bytes)) as index:
+        embeddings = index["embeddings"].astype(np.float32)
+        offsets = index["offsets"]
+    if len(offsets) <= top_k:
+        return [text[start:end] for start, end in offsets]
+
+    scores = embeddings @ embed_texts([query])[0]
+    best = np.argpartition(-scores, top_k - 1)[:top_k]
+    return [text[offsets[i][0]:offsets[i][1]] for i in np.sort(best)]
+
+
+__all__ = [
+    'RETRIEVAL_MIN_CHARS',
+    'DEFAULT_TOP_K',
+    'INDEX_MIME_TYPE',
+    'build_chunk_index',
+    'select_relevant_chunks',
+]
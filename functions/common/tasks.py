@@ -0,0 +1,52 @@
+# functions/common/tasks.py
+import datetime
+import json
+from google.cloud import tasks_v2
+from google.protobuf import timestamp_pb2
+from .core import logger
+from .config import get_gcp_project_config
+from .clients import get_tasks_client
+
+
+def enqueue_function_task(function_name: str, payload: dict, delay_seconds: float = 0) -> str:
+    """
+    Enqueues a Cloud Task targeting a task-dispatched Cloud Function.
+    The queue shares the function's name, matching how Firebase provisions task queues.
+    A positive delay_seconds sets the task's schedule_time so it is not delivered before then.
+    Returns the created task's name.
+    """
+    project_id, location, _ = get_gcp_project_config()
+    tasks_client = get_tasks_client()
+    queue_path = tasks_client.queue_path(project_id, location, function_name)
+    task = {
+        "http_request": {
+            "http_method": tasks_v2.HttpMethod.POST,
+            "url": f"https://{location}-{project_id}.cloudfunctions.net/{function_name}",
+            "headers": {"Content-type": "application/json"},
+            "body": json.dumps({"data": payload}).encode(),
+        }
+    }
+    if delay_seconds > 0:
+        schedule_time = timestamp_pb2.Timestamp()
+        schedule_time.FromDatetime(datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(seconds=delay_seconds))
+        task["schedule_time"] = schedule_time
+    created_task = tasks_client.create_task(parent=queue_path, task=task)
+    logger.info(f"Enqueued task {created_task.name} on queue '{function_name}'.")
+    return created_task.name
+
+
+def get_task_retry_count(req) -> int | None:
+    """
+    Returns how many times Cloud Tasks has already retried the task being handled (0 on the first
+    delivery), read from the X-CloudTasks-TaskRetryCount header. None if the header is unavailable.
+    """
+    raw_request = getattr(req, "raw_request", None)
+    value = raw_request.headers.get("X-CloudTasks-TaskRetryCount") if raw_request is not None else None
+    try:
+        return int(value) if value is not None else None
+    except ValueError:
+        logger.warn(f"Ignoring malformed X-CloudTasks-TaskRetryCount header: {value!r}")
+        return None
+
+
+__all__ = ['enqueue_function_task', 'get_task_retry_count', 'get_tasks_client']
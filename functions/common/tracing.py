@@ -0,0 +1,173 @@
+# functions/common/tracing.py
+import contextlib
+import functools
+import json
+import os
+import threading
+from opentelemetry import trace
+from opentelemetry.trace.propagation.tracecontext import TraceContextTextMapPropagator
+
+from .core import logger
+
+# Tracing is OpenTelemetry-based, so our spans share a trace with the ones google.adk emits for each model
+# call (call_llm) and tool call (execute_tool). TRACE_EXPORTER selects where spans go:
+#   unset / "none"  tracing off (the OpenTelemetry API hands out no-op spans; the SDK is never imported)
+#   "gcp"           Cloud Trace, batched
+#   "memory"        kept in process, read back with get_finished_spans() (local analysis, notebooks)
+#   "file"          appended as JSON lines to TRACE_FILE_PATH (default /tmp/agentlab-traces.jsonl)
+#   "console"       printed to stdout
+# Further exporters can be added with register_span_exporter().
+TRACER_NAME = "agentlab"
+DEFAULT_TRACE_FILE_PATH = "/tmp/agentlab-traces.jsonl"
+
+_propagator = TraceContextTextMapPropagator()
+_configure_lock = threading.Lock()
+_provider = None
+_memory_exporter = None
+
+
+def _gcp_exporter():
+    from opentelemetry.exporter.cloud_trace import CloudTraceSpanExporter
+    return CloudTraceSpanExporter(), True
+
+
+def _memory_exporter_factory():
+    global _memory_exporter
+    from opentelemetry.sdk.trace.export.in_memory_span_exporter import InMemorySpanExporter
+    _memory_exporter = InMemorySpanExporter()
+    return _memory_exporter, False
+
+
+def _file_exporter():
+    from opentelemetry.sdk.trace.export import SpanExporter, SpanExportResult
+
+    class JsonLinesFileSpanExporter(SpanExporter):
+        """Appends each finished span as one JSON line, for offline analysis of local runs."""
+
+        def __init__(self, path: str):
+            self.path = path
+            self._lock = threading.Lock()
+
+        def export(self, spans):
+            with self._lock, open(self.path, "a") as f:
+                for finished_span in spans:
+                    f.write(json.dumps(json.loads(finished_span.to_json()), separators=(",", ":")) + "\n")
+            return SpanExportResult.SUCCESS
+
+    return JsonLinesFileSpanExporter(os.environ.get("TRACE_FILE_PATH", DEFAULT_TRACE_FILE_PATH)), False
+
+
+def _console_exporter():
+    from opentelemetry.sdk.trace.export import ConsoleSpanExporter
+    return ConsoleSpanExporter(), False
+
+
+# name -> factory returning (exporter, batched). Batched exporters buffer spans and are flushed at the end of each request.
+_exporter_factories = {
+    "gcp": _gcp_exporter,
+    "memory": _memory_exporter_factory,
+    "file": _file_exporter,
+    "console": _console_exporter,
+}
+
+
+def register_span_exporter(name: str, factory):
+    """Makes an exporter selectable with TRACE_EXPORTER=name. factory() returns (SpanExporter, batched)."""
+    _exporter_factories[name] = factory
+
+
+def configure_tracing():
+    """Installs the tracer provider for the exporter named by TRACE_EXPORTER, once per process."""
+    global _provider
+    exporter_name = os.environ.get("TRACE_EXPORTER", "none").strip().lower()
+    if _provider is not None or exporter_name in ("", "none"):
+        return
+    with _configure_lock:
+        if _provider is not None:
+            return
+        factory = _exporter_factories.get(exporter_name)
+        if factory is None:
+            logger.warn(f"Unknown TRACE_EXPORTER '{exporter_name}'; tracing stays off.")
+            _provider = False
+            return
+        from opentelemetry.sdk.resources import Resource
+        from opentelemetry.sdk.trace import TracerProvider
+        from opentelemetry.sdk.trace.export import BatchSpanProcessor, SimpleSpanProcessor
+        exporter, batched = factory()
+        provider = TracerProvider(resource=Resource.create({"service.name": os.environ.get("K_SERVICE", "agentlab-functions")}))
+        provider.add_span_processor(BatchSpanProcessor(exporter) if batched else SimpleSpanProcessor(exporter))
+        trace.set_tracer_provider(provider)
+        _provider = provider
+        logger.info(f"Tracing enabled with the '{exporter_name}' exporter.")
+
+
+def get_tracer():
+    configure_tracing()
+    return trace.get_tracer(TRACER_NAME)
+
+
+@contextlib.contextmanager
+def span(name: str, parent_context=None, **attributes):
+    """Starts a span as the current span. Attribute values that are None are dropped."""
+    with get_tracer().start_as_current_span(name, context=parent_context) as current_span:
+        set_span_attributes(**attributes)
+        yield current_span
+
+
+def set_span_attributes(**attributes):
+    """Adds attributes to the current span (no-op when tracing is off). None values are dropped."""
+    current_span = trace.get_current_span()
+    for key, value in attributes.items():
+        if value is not None:
+            current_span.set_attribute(key, value)
+
+
+def traced(name: str):
+    """Decorator for function entry points: runs the call in a span named name, then flushes the exporter."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            try:
+                with span(name):
+                    return func(*args, **kwargs)
+            finally:
+                force_flush()
+        return wrapper
+    return decorator
+
+
+def inject_trace_context() -> dict:
+    """W3C trace context of the current span (a {'traceparent': ...} carrier), for task payloads and HTTP headers."""
+    carrier = {}
+    _propagator.inject(carrier)
+    return carrier
+
+
+def extract_trace_context(carrier: dict | None):
+    """Turns a carrier from inject_trace_context() back into a parent context (None when there is none)."""
+    return _propagator.extract(carrier) if carrier else None
+
+
+def force_flush():
+    """Exports buffered spans. Call before a function returns: the instance may be frozen right after."""
+    if _provider:
+        _provider.force_flush()
+
+
+def get_finished_spans() -> list:
+    """Spans captured by the 'memory' exporter."""
+    return list(_memory_exporter.get_finished_spans()) if _memory_exporter else []
+
+
+__all__ = [
+    'configure_tracing',
+    'register_span_exporter',
+    'get_tracer',
+    'span',
+    'set_span_attributes',
+    'traced',
+    'inject_trace_context',
+    'extract_trace_context',
+    'force_flush',
+    'get_finished_spans',
+]
@@ -1,6 +1,5 @@
 import functools
 import traceback
-import vertexai
 from firebase_functions import https_fn # For HttpsError and type hinting
 from .core import logger
 from .config import get_gcp_project_config
@@ -37,6 +36,7 @@ def initialize_vertex_ai():
     """
     Initializes the Vertex AI SDK with project, location, and staging bucket.
     """
+    import vertexai  # Deferred: importing vertexai takes seconds, and most callers of this module never need it.
     project_id, location, staging_bucket = get_gcp_project_config()
     try:
         vertexai.init(project=project_id, location=location, staging_bucket=staging_bucket)
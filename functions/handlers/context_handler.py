@@ -1,38 +1,74 @@
 # functions/handlers/context_handler.py
 import os
+import json
 import base64
 import uuid
 import httpx
 import io
+import threading
+from contextlib import nullcontext
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timedelta, timezone
 from google.cloud import storage
-from google.cloud import firestore as gcf
 from google.cloud.firestore_v1 import SERVER_TIMESTAMP
-from pypdf import PdfReader
 
 from firebase_functions import https_fn
 from common.core import logger
+from common.clients import get_or_create, get_storage_client, get_firestore_client
+from common.tasks import enqueue_function_task
+from common.image_processing import normalize_image
+
+
+# --- Generic GCS Helpers ---
+SIGNED_UPLOAD_URL_EXPIRATION_MINUTES = 15
+SIGNED_UPLOAD_CONTEXT_TYPES = {"pdf", "image"}
+MAX_SIGNED_UPLOAD_BYTES = 10 * 1024 * 1024  # Matches the 10MB limit enforced by the PDF and image modals
+SIGNED_UPLOAD_LENGTH_RANGE = f"0,{MAX_SIGNED_UPLOAD_BYTES}"
+
+
+def _get_context_bucket(storage_client: storage.Client):
+    """Returns the per-project context upload bucket, creating it on first use. Looked up once per process."""
+    from common.config import get_gcp_project_config
+    project_id, _, _ = get_gcp_project_config()
+    bucket_name = f"{project_id}-context-uploads"
+
+    def _lookup_or_create():
+        bucket = storage_client.lookup_bucket(bucket_name)
+        if bucket is None:
+            logger.warn(f"Storage bucket '{bucket_name}' not found. Creating it with default settings.")
+            bucket = storage_client.create_bucket(bucket_name, location=os.environ.get("FUNCTION_REGION", "us-central1"))
+        return bucket
+    return get_or_create(f"bucket:{bucket_name}", _lookup_or_create)
+
+
+def _ensure_bucket_cors_for_uploads(bucket):
+    """Browsers PUT directly to signed URLs, so the bucket must allow our web origins and the signed headers."""
+    from common.config import CORS_ORIGINS
+    if any("x-goog-content-length-range" in rule.get("responseHeader", []) for rule in bucket.cors or []):
+        return
+    bucket.cors = [{
+        "origin": CORS_ORIGINS,
+        "method": ["PUT"],
+        "responseHeader": ["Content-Type", "x-goog-content-length-range"],
+        "maxAgeSeconds": 3600
+    }]
+    bucket.patch()
+    logger.info(f"Configured CORS for direct uploads on bucket '{bucket.name}'.")
 
 
-# --- Generic GCS Uploader Helper ---
 def _upload_bytes_to_gcs(
         user_id: str,
         file_bytes: bytes,
         file_name: str,
         mime_type: str,
         context_type: str,
-        make_public: bool = False
+        make_public: bool = False,
+        storage_client: storage.Client | None = None
 ):
     """Uploads a byte string to GCS and returns a structured response."""
     logger.info(f"Uploading context file for user {user_id} to GCS: {file_name}, type: {context_type}, mimeType: {mime_type}")
-    from common.config import get_gcp_project_config
     try:
-        project_id, _, _ = get_gcp_project_config()
-        bucket_name = f"{project_id}-context-uploads"
-        storage_client = storage.Client()
-        bucket = storage_client.bucket(bucket_name)
-        if not bucket.exists():
-            logger.warn(f"Storage bucket '{bucket_name}' not found. Creating it with default settings.")
-            bucket = storage_client.create_bucket(bucket, location=os.environ.get("FUNCTION_REGION", "us-central1"))
+        bucket = _get_context_bucket(storage_client or get_storage_client())
 
         _, file_extension = os.path.splitext(file_name)
         unique_filename = f"{uuid.uuid4().hex}{file_extension}"
@@ -65,31 +101,79 @@ def _upload_bytes_to_gcs(
         raise https_fn.HttpsError(code=https_fn.FunctionsErrorCode.INTERNAL, message=f"Failed to upload context file: {e}")
 
 
+MAX_RETRIEVAL_TOP_K = 50
+
+
+def _validate_retrieval_options(data: dict):
+    """Rejects a malformed `retrievalTopK` up front, before any fetching or indexing work starts."""
+    top_k = data.get("retrievalTopK")
+    if top_k is None:
+        return
+    if isinstance(top_k, bool) or not isinstance(top_k, int) or not 1 <= top_k <= MAX_RETRIEVAL_TOP_K:
+        raise https_fn.HttpsError(code=https_fn.FunctionsErrorCode.INVALID_ARGUMENT, message=f"retrievalTopK must be an integer between 1 and {MAX_RETRIEVAL_TOP_K}.")
+
+
+def _build_retrieval_index_extras(storage_url: str, text_content: str, data: dict, storage_client: storage.Client | None = None) -> dict | None:
+    """
+    When retrieval mode is requested for a large text context, builds its chunk index and stores it
+    next to the text blob. Returns the part fields that point history building at the index.
+    """
+    if not data.get("useRetrieval"):
+        return None
+    # Imported on demand so ingestion that never uses retrieval does not load numpy.
+    from common.retrieval import RETRIEVAL_MIN_CHARS, DEFAULT_TOP_K, INDEX_MIME_TYPE, build_chunk_index
+    if len(text_content) < RETRIEVAL_MIN_CHARS:
+        return None
+    try:
+        index_bytes, chunk_count = build_chunk_index(text_content)
+        bucket_name, blob_name = storage_url.split('/', 3)[2:]
+        index_blob = (storage_client or get_storage_client()).bucket(bucket_name).blob(f"{blob_name}.index.npz")
+        index_blob.upload_from_string(index_bytes, content_type=INDEX_MIME_TYPE)
+    except Exception as e:
+        logger.warn(f"Failed to build retrieval index for {storage_url}, context will be stuffed whole: {e}")
+        return None
+    top_k = data.get("retrievalTopK") or DEFAULT_TOP_K
+    return {"retrieval": {"index_uri": f"gs://{bucket_name}/{index_blob.name}", "chunk_count": chunk_count, "top_k": top_k}}
+
+
+def _build_context_message_data(
+        user_id: str,
+        parent_message_id: str,
+        file_uri: str,
+        mime_type: str,
+        preview_map: dict,
+        part_extras: dict | None = None
+) -> dict:
+    return {
+        "participant": "context_stuffed",
+        "parts": [{
+            "file_data": {
+                "file_uri": file_uri,
+                "mime_type": mime_type
+            },
+            "preview": preview_map,
+            **(part_extras or {})
+        }],
+        "parentMessageId": parent_message_id,
+        "timestamp": SERVER_TIMESTAMP,
+        "createdBy": f"user:{user_id}"
+    }
+
+
 def _create_context_message(
         user_id: str,
         chat_id: str,
         parent_message_id: str,
         file_uri: str,
         mime_type: str,
-        preview_map: dict
+        preview_map: dict,
+        part_extras: dict | None = None
 ) -> str:
     """Create a 'context_stuffed' message in Firestore and return its ID."""
     try:
-        db = gcf.Client()
+        db = get_firestore_client()
         messages = db.collection("chats").document(chat_id).collection("messages")
-        data = {
-            "participant": "context_stuffed",
-            "parts": [{
-                "file_data": {
-                    "file_uri": file_uri,
-                    "mime_type": mime_type
-                },
-                "preview": preview_map
-            }],
-            "parentMessageId": parent_message_id,
-            "timestamp": SERVER_TIMESTAMP,
-            "createdBy": f"user:{user_id}"
-        }
+        data = _build_context_message_data(user_id, parent_message_id, file_uri, mime_type, preview_map, part_extras)
         doc_ref = messages.document()
         doc_ref.set(data)
         logger.info(f"Created context message {doc_ref.id} in chat {chat_id}")
@@ -100,6 +184,43 @@ def _create_context_message(
 
 
 # --- Web Page Fetching ---
+def _ingest_web_page(user_id: str, url: str, data: dict, http_client: httpx.Client | None = None, storage_client: storage.Client | None = None):
+    """Fetches a web page and stores it as context. Returns (upload_result, preview_map, part_extras)."""
+    headers = {'User-Agent': 'AgentLab-ContextFetcher/1.0'}
+    logger.info(f"[_ingest_web_page] Fetching web page content from URL: {url}")
+    if http_client is None:
+        with httpx.Client(timeout=20.0) as client:
+            response = client.get(url, headers=headers)
+    else:
+        response = http_client.get(url, headers=headers, timeout=20.0)
+    response.raise_for_status()
+    raw_content_bytes = response.content
+    mime_type = response.headers.get('Content-Type', 'text/plain; charset=utf-8').split(';')[0]
+    file_name_from_url = url.split('/')[-1] or "webpage.html"
+    logger.info(f"Fetched web page content from {url}, size: {len(raw_content_bytes)} bytes, mimeType: {mime_type}")
+
+    # Create a text preview (first 1000 chars)
+    try:
+        preview_text = raw_content_bytes.decode('utf-8', errors='ignore')[:1000]
+    except Exception:
+        preview_text = ""
+
+    upload_result = _upload_bytes_to_gcs(
+        user_id=user_id,
+        file_bytes=raw_content_bytes,
+        file_name=file_name_from_url,
+        mime_type=mime_type,
+        context_type='webpage',
+        make_public=False,
+        storage_client=storage_client
+    )
+    part_extras = None
+    if mime_type.startswith("text/"):
+        part_extras = _build_retrieval_index_extras(upload_result["storageUrl"], raw_content_bytes.decode('utf-8', errors='ignore'), data, storage_client)
+
+    return upload_result, {"type": "text", "value": preview_text}, part_extras
+
+
 def _fetch_web_page_content_logic(req: https_fn.CallableRequest):
     logger.info(f"[_fetch_web_page_content_logic] Function called with data keys: {list(req.data.keys()) if isinstance(req.data, dict) else 'Non-dict data'}")
     if not req.auth:
@@ -112,41 +233,18 @@ def _fetch_web_page_content_logic(req: https_fn.CallableRequest):
         raise https_fn.HttpsError(code=https_fn.FunctionsErrorCode.INVALID_ARGUMENT, message="URL is required.")
     if not chat_id:
         raise https_fn.HttpsError(code=https_fn.FunctionsErrorCode.INVALID_ARGUMENT, message="chatId is required.")
+    _validate_retrieval_options(req.data)
 
     try:
-        headers = {'User-Agent': 'AgentLab-ContextFetcher/1.0'}
-        logger.info(f"[_fetch_web_page_content_logic] Fetching web page content from URL: {url}")
-        with httpx.Client(timeout=20.0) as client:
-            response = client.get(url, headers=headers)
-            response.raise_for_status()
-            raw_content_bytes = response.content
-            mime_type = response.headers.get('Content-Type', 'text/plain; charset=utf-8').split(';')[0]
-            file_name_from_url = url.split('/')[-1] or "webpage.html"
-        logger.info(f"Fetched web page content from {url}, size: {len(raw_content_bytes)} bytes, mimeType: {mime_type}")
-
-        # Create a text preview (first 1000 chars)
-        try:
-            preview_text = raw_content_bytes.decode('utf-8', errors='ignore')[:1000]
-        except Exception:
-            preview_text = ""
-
-        upload_result = _upload_bytes_to_gcs(
-            user_id=req.auth.uid,
-            file_bytes=raw_content_bytes,
-            file_name=file_name_from_url,
-            mime_type=mime_type,
-            context_type='webpage',
-            make_public=False
-        )
-
-        preview_map = {"type": "text", "value": preview_text}
+        upload_result, preview_map, part_extras = _ingest_web_page(req.auth.uid, url, req.data)
         message_id = _create_context_message(
             user_id=req.auth.uid,
             chat_id=chat_id,
             parent_message_id=parent_message_id,
             file_uri=upload_result["storageUrl"],
             mime_type=upload_result["mimeType"],
-            preview_map=preview_map
+            preview_map=preview_map,
+            part_extras=part_extras
         )
 
         return {
@@ -161,6 +259,7 @@ def _fetch_web_page_content_logic(req: https_fn.CallableRequest):
 
 
 # --- Git Repository Fetching ---
+PROGRESS_BATCH_SIZE = 25
 GITHUB_API_BASE = "https://api.github.com"
 NEW_FILE_SEPARATOR = "\n\n---<newfile>--\n\n"
 
@@ -213,23 +312,21 @@ def list_repo_files_recursive(session: httpx.Client, owner, repo, path, token, i
             return
         raise
 
-def _fetch_git_repo_contents_logic(req: https_fn.CallableRequest):
-    if not req.auth:
-        raise https_fn.HttpsError(code=https_fn.FunctionsErrorCode.UNAUTHENTICATED, message="Authentication required.")
-    data = req.data
+def _ingest_git_repo(user_id: str, data: dict, http_client: httpx.Client | None = None, storage_client: storage.Client | None = None, fetched_files: dict | None = None, on_progress=None):
+    """
+    Fetches matching repository files into one text blob. Returns (upload_result, preview_map, part_extras).
+    Listing and file fetches reuse http_client when one is given. Files already present in fetched_files are not fetched again; newly fetched files are reported to
+    on_progress(entries, done, total) in batches so background jobs can checkpoint them.
+    """
     org_user, repo_name = data.get("orgUser"), data.get("repoName")
-    chat_id = data.get("chatId")
-    parent_message_id = data.get("parentMessageId")
     branch = data.get("branch") or "main"
     if not org_user or not repo_name:
         raise https_fn.HttpsError(code=https_fn.FunctionsErrorCode.INVALID_ARGUMENT, message="Organization/User and Repository Name are required.")
-    if not chat_id:
-        raise https_fn.HttpsError(code=https_fn.FunctionsErrorCode.INVALID_ARGUMENT, message="chatId is required.")
 
     auth_token = data.get("gitToken") or get_github_token()
     files_to_fetch_meta, processed_paths = [], set()
     try:
-        with httpx.Client() as session:
+        with (httpx.Client() if http_client is None else nullcontext(http_client)) as session:
             directory = data.get('directory', "")
             list_repo_files_recursive(session, org_user, repo_name, directory, auth_token, data.get("includeExt", []), data.get("excludeExt", []), files_to_fetch_meta, processed_paths, branch)
     except Exception as e_list:
@@ -241,11 +338,22 @@ def _fetch_git_repo_contents_logic(req: https_fn.CallableRequest):
 
     content_chunks = []
     total_content_size, MAX_TOTAL_CONTENT_SIZE = 0, 5 * 1024 * 1024
-    with httpx.Client() as session:
-        fetched_contents = []
+    fetched_files = fetched_files or {}
+    with (httpx.Client() if http_client is None else nullcontext(http_client)) as session:
+        fetched_contents, pending_progress = [], {}
         for file_meta in files_to_fetch_meta:
+            if file_meta["path"] in fetched_files:
+                fetched_contents.append(fetched_files[file_meta["path"]])
+                continue
             content = fetch_repo_file_content(session, org_user, repo_name, file_meta["path"], auth_token, branch)
             fetched_contents.append(content)
+            if on_progress and content is not None:
+                pending_progress[file_meta["path"]] = content
+                if len(pending_progress) >= PROGRESS_BATCH_SIZE:
+                    on_progress(pending_progress, len(fetched_contents), len(files_to_fetch_meta))
+                    pending_progress = {}
+        if on_progress and pending_progress:
+            on_progress(pending_progress, len(fetched_contents), len(files_to_fetch_meta))
 
     for i, content in enumerate(fetched_contents):
         file_meta = files_to_fetch_meta[i]
@@ -263,13 +371,15 @@ def _fetch_git_repo_contents_logic(req: https_fn.CallableRequest):
     logger.info(f"Fetched {len(files_to_fetch_meta)} files from {org_user}/{repo_name} branch {branch}, total content size: {total_content_size} bytes.")
 
     upload_result = _upload_bytes_to_gcs(
-        user_id=req.auth.uid,
+        user_id=user_id,
         file_bytes=monolithic_content.encode('utf-8'),
         file_name=file_name,
         mime_type='text/plain',
         context_type='git_repo',
-        make_public=False
+        make_public=False,
+        storage_client=storage_client
     )
+    part_extras = _build_retrieval_index_extras(upload_result["storageUrl"], monolithic_content, data, storage_client)
 
     # Preview: if files count exceeds MAX_FILES_PER_REPO, show count only, else list all files
     MAX_FILES_PER_REPO = 100
@@ -277,7 +387,24 @@ def _fetch_git_repo_contents_logic(req: https_fn.CallableRequest):
         preview_value = f"{len(files_to_fetch_meta)} files loaded from repository."
     else:
         preview_value = "\n".join([meta["path"] for meta in files_to_fetch_meta])
-    preview_map = {"type": "file_list", "value": preview_value}
+    return upload_result, {"type": "file_list", "value": preview_value}, part_extras
+
+
+def _fetch_git_repo_contents_logic(req: https_fn.CallableRequest):
+    if not req.auth:
+        raise https_fn.HttpsError(code=https_fn.FunctionsErrorCode.UNAUTHENTICATED, message="Authentication required.")
+    data = req.data
+    chat_id = data.get("chatId")
+    parent_message_id = data.get("parentMessageId")
+    if not data.get("orgUser") or not data.get("repoName"):
+        raise https_fn.HttpsError(code=https_fn.FunctionsErrorCode.INVALID_ARGUMENT, message="Organization/User and Repository Name are required.")
+    if not chat_id:
+        raise https_fn.HttpsError(code=https_fn.FunctionsErrorCode.INVALID_ARGUMENT, message="chatId is required.")
+    _validate_retrieval_options(data)
+    if data.get("background"):
+        return _enqueue_context_ingest_job(req.auth.uid, "gitrepo", data)
+
+    upload_result, preview_map, part_extras = _ingest_git_repo(req.auth.uid, data)
 
     message_id = _create_context_message(
         user_id=req.auth.uid,
@@ -285,7 +412,8 @@ def _fetch_git_repo_contents_logic(req: https_fn.CallableRequest):
         parent_message_id=parent_message_id,
         file_uri=upload_result["storageUrl"],
         mime_type=upload_result["mimeType"],
-        preview_map=preview_map
+        preview_map=preview_map,
+        part_extras=part_extras
     )
 
     return {
@@ -296,6 +424,79 @@ def _fetch_git_repo_contents_logic(req: https_fn.CallableRequest):
     }
 
 # --- PDF Processing ---
+MAX_PDF_CONTENT_LENGTH = 2 * 1024 * 1024
+
+def _extract_pdf_text(pdf_stream, pdf_source_name: str, extracted_pages: dict | None = None, on_progress=None) -> str:
+    """
+    Extracts text page by page from a seekable PDF stream, truncating at MAX_PDF_CONTENT_LENGTH.
+    Pages already present in extracted_pages (keyed by page index) are reused, and newly extracted
+    pages are reported to on_progress(entries, done, total) in batches.
+    """
+    from pypdf import PdfReader  # Only PDF ingestion needs it, so it is not imported with the module.
+    reader = PdfReader(pdf_stream)
+    extracted_pages = extracted_pages or {}
+    page_count = len(reader.pages)
+    text_chunks, text_length, pending_progress = [], 0, {}
+    for page_index, page in enumerate(reader.pages):
+        page_key = str(page_index)
+        if page_key in extracted_pages:
+            page_text = extracted_pages[page_key]
+        else:
+            page_text = page.extract_text() or ""
+            pending_progress[page_key] = page_text
+        text_chunks.append(page_text)
+        text_length += len(page_text)
+        if on_progress and len(pending_progress) >= PROGRESS_BATCH_SIZE:
+            on_progress(pending_progress, page_index + 1, page_count)
+            pending_progress = {}
+        if text_length > MAX_PDF_CONTENT_LENGTH:
+            break
+    if on_progress and pending_progress:
+        on_progress(pending_progress, len(text_chunks), page_count)
+    text_content = "".join(text_chunks)
+    if len(text_content) > MAX_PDF_CONTENT_LENGTH:
+        text_content = text_content[:MAX_PDF_CONTENT_LENGTH] + "\n... [PDF CONTENT TRUNCATED]"
+    logger.info(f"Extracted {len(text_content)} characters from PDF: {pdf_source_name}")
+    return text_content
+
+def _fetch_pdf_bytes_from_url(url: str, http_client: httpx.Client | None = None) -> bytes:
+    headers = {'User-Agent': 'AgentLab-ContextFetcher/1.0'}
+    try:
+        if http_client is None:
+            with httpx.Client() as client:
+                response = client.get(url, headers=headers, timeout=30)
+        else:
+            response = http_client.get(url, headers=headers, timeout=30)
+        response.raise_for_status()
+        return response.content
+    except httpx.RequestError as e:
+        raise https_fn.HttpsError(code=https_fn.FunctionsErrorCode.INTERNAL, message=f"Failed to fetch PDF from URL: {str(e)}")
+
+
+def _ingest_pdf(user_id: str, pdf_stream, pdf_source_name: str, data: dict, storage_client: storage.Client | None = None, extracted_pages: dict | None = None, on_progress=None):
+    """Extracts text from a PDF stream and stores it as context. Returns (upload_result, preview_map, part_extras)."""
+    try:
+        text_content = _extract_pdf_text(pdf_stream, pdf_source_name, extracted_pages, on_progress)
+
+        upload_result = _upload_bytes_to_gcs(
+            user_id=user_id,
+            file_bytes=text_content.encode('utf-8'),
+            file_name=f"{os.path.splitext(pdf_source_name)[0]}.txt",
+            mime_type='text/plain',
+            context_type='pdf',
+            make_public=False,
+            storage_client=storage_client
+        )
+        part_extras = _build_retrieval_index_extras(upload_result["storageUrl"], text_content, data, storage_client)
+    except Exception as e:
+        if "encrypted" in str(e).lower():
+            raise https_fn.HttpsError(code=https_fn.FunctionsErrorCode.FAILED_PRECONDITION, message="PDF is encrypted and cannot be processed.")
+        raise https_fn.HttpsError(code=https_fn.FunctionsErrorCode.INTERNAL, message=f"Failed to process PDF: {str(e)}")
+
+    # Preview is first 1000 characters of extracted text
+    return upload_result, {"type": "text", "value": (text_content or "")[:1000]}, part_extras
+
+
 def _process_pdf_content_logic(req: https_fn.CallableRequest):
     if not req.auth:
         raise https_fn.HttpsError(code=https_fn.FunctionsErrorCode.UNAUTHENTICATED, message="Authentication required.")
@@ -304,17 +505,15 @@ def _process_pdf_content_logic(req: https_fn.CallableRequest):
     parent_message_id = req.data.get("parentMessageId")
     if not chat_id:
         raise https_fn.HttpsError(code=https_fn.FunctionsErrorCode.INVALID_ARGUMENT, message="chatId is required.")
+    _validate_retrieval_options(req.data)
+
+    if url and req.data.get("background"):
+        return _enqueue_context_ingest_job(req.auth.uid, "pdf", req.data)
 
     pdf_bytes, pdf_source_name = None, "Uploaded PDF"
     if url:
         pdf_source_name = url.split('/')[-1]
-        try:
-            with httpx.Client() as client:
-                response = client.get(url, headers={'User-Agent': 'AgentLab-ContextFetcher/1.0'}, timeout=30)
-                response.raise_for_status()
-                pdf_bytes = response.content
-        except httpx.RequestError as e:
-            raise https_fn.HttpsError(code=https_fn.FunctionsErrorCode.INTERNAL, message=f"Failed to fetch PDF from URL: {str(e)}")
+        pdf_bytes = _fetch_pdf_bytes_from_url(url)
     elif file_data_base64:
         pdf_source_name = file_name_from_client or "Uploaded PDF"
         try:
@@ -327,48 +526,90 @@ def _process_pdf_content_logic(req: https_fn.CallableRequest):
     if not pdf_bytes:
         raise https_fn.HttpsError(code=https_fn.FunctionsErrorCode.INTERNAL, message="Could not load PDF data.")
 
-    try:
-        reader = PdfReader(io.BytesIO(pdf_bytes))
-        text_content = "".join(page.extract_text() or "" for page in reader.pages)
-        MAX_PDF_CONTENT_LENGTH = 2 * 1024 * 1024
-        if len(text_content) > MAX_PDF_CONTENT_LENGTH:
-            text_content = text_content[:MAX_PDF_CONTENT_LENGTH] + "\n... [PDF CONTENT TRUNCATED]"
-        logger.info(f"Extracted {len(text_content)} characters from PDF: {pdf_source_name}")
+    upload_result, preview_map, part_extras = _ingest_pdf(req.auth.uid, io.BytesIO(pdf_bytes), pdf_source_name, req.data)
+    message_id = _create_context_message(
+        user_id=req.auth.uid,
+        chat_id=chat_id,
+        parent_message_id=parent_message_id,
+        file_uri=upload_result["storageUrl"],
+        mime_type=upload_result["mimeType"],
+        preview_map=preview_map,
+        part_extras=part_extras
+    )
 
-        # Preview is first 1000 characters of extracted text
-        preview_text = (text_content or "")[:1000]
+    return {
+        **upload_result,
+        "success": True,
+        "messageId": message_id,
+        "preview": preview_map
+    }
 
-        upload_result = _upload_bytes_to_gcs(
-            user_id=req.auth.uid,
-            file_bytes=text_content.encode('utf-8'),
-            file_name=f"{os.path.splitext(pdf_source_name)[0]}.txt",
-            mime_type='text/plain',
-            context_type='pdf',
-            make_public=False
-        )
+# --- Image Upload ---
+def _publish_uploaded_blob(blob: storage.Blob, file_name: str, mime_type: str, context_type: str):
+    """Makes an already-uploaded object public and returns the same structure as _upload_bytes_to_gcs."""
+    public_url = None
+    try:
+        blob.make_public()
+        public_url = blob.public_url
+    except Exception as e:
+        logger.warn(f"Failed to make blob public: {e}")
+    return {
+        "success": True,
+        "name": file_name,
+        "storageUrl": f"gs://{blob.bucket.name}/{blob.name}",
+        "type": context_type,
+        "mimeType": mime_type,
+        "publicUrl": public_url
+    }
 
-        preview_map = {"type": "text", "value": preview_text}
-        message_id = _create_context_message(
-            user_id=req.auth.uid,
-            chat_id=chat_id,
-            parent_message_id=parent_message_id,
-            file_uri=upload_result["storageUrl"],
-            mime_type=upload_result["mimeType"],
-            preview_map=preview_map
-        )
+def _ingest_image(user_id: str, image_bytes: bytes, file_name: str, mime_type: str, original_blob: storage.Blob | None = None, storage_client: storage.Client | None = None):
+    """
+    Normalizes an uploaded image into a downscaled WebP variant (referenced by the chat history)
+    and a small public thumbnail (used for previews). The original is kept private.
+    `original_blob` is the already-uploaded original for direct uploads; it is reused instead of
+    uploading the same bytes again.
+    Returns (upload_result, preview_map, part_extras).
+    """
+    normalized = normalize_image(image_bytes)
+    if normalized is None:
+        # Fall back to storing the image as uploaded, as before.
+        if original_blob is not None:
+            upload_result = _publish_uploaded_blob(original_blob, file_name, mime_type, 'image')
+        else:
+            upload_result = _upload_bytes_to_gcs(user_id, image_bytes, file_name, mime_type, 'image', make_public=True, storage_client=storage_client)
+        return upload_result, {"type": "image_url", "value": upload_result.get("publicUrl")}, {}
 
-        return {
-            **upload_result,
-            "success": True,
-            "messageId": message_id,
-            "preview": preview_map
-        }
-    except Exception as e:
-        if "encrypted" in str(e).lower():
-            raise https_fn.HttpsError(code=https_fn.FunctionsErrorCode.FAILED_PRECONDITION, message="PDF is encrypted and cannot be processed.")
-        raise https_fn.HttpsError(code=https_fn.FunctionsErrorCode.INTERNAL, message=f"Failed to process PDF: {str(e)}")
+    if original_blob is not None:
+        original_storage_url = f"gs://{original_blob.bucket.name}/{original_blob.name}"
+    else:
+        original_storage_url = _upload_bytes_to_gcs(user_id, image_bytes, file_name, mime_type, 'image', storage_client=storage_client)["storageUrl"]
+
+    base_name = os.path.splitext(file_name)[0]
+    upload_result = _upload_bytes_to_gcs(
+        user_id=user_id,
+        file_bytes=normalized["bytes"],
+        file_name=f"{base_name}.webp",
+        mime_type=normalized["mimeType"],
+        context_type='image',
+        storage_client=storage_client
+    )
+    thumbnail_result = _upload_bytes_to_gcs(
+        user_id=user_id,
+        file_bytes=normalized["thumbnailBytes"],
+        file_name=f"{base_name}_thumb.webp",
+        mime_type=normalized["mimeType"],
+        context_type='image',
+        make_public=True,  # Only the thumbnail is public, for preview
+        storage_client=storage_client
+    )
+    upload_result = {**upload_result, "name": file_name, "publicUrl": thumbnail_result.get("publicUrl")}
+    preview_map = {"type": "image_url", "value": thumbnail_result.get("publicUrl")}
+    part_extras = {
+        "original": {"file_uri": original_storage_url, "mime_type": mime_type},
+        "dimensions": {"width": normalized["width"], "height": normalized["height"]}
+    }
+    return upload_result, preview_map, part_extras
 
-# --- Image Upload ---
 def _upload_image_and_get_uri_logic(req: https_fn.CallableRequest):
     if not req.auth:
         raise https_fn.HttpsError(code=https_fn.FunctionsErrorCode.UNAUTHENTICATED, message="Authentication required.")
@@ -383,23 +624,15 @@ def _upload_image_and_get_uri_logic(req: https_fn.CallableRequest):
         raise https_fn.HttpsError(code=https_fn.FunctionsErrorCode.INVALID_ARGUMENT, message="chatId is required.")
     try:
         image_bytes = base64.b64decode(file_data_base64)
-        upload_result = _upload_bytes_to_gcs(
-            user_id=user_id,
-            file_bytes=image_bytes,
-            file_name=file_name,
-            mime_type=mime_type,
-            context_type='image',
-            make_public=True  # Make image public for preview
-        )
-        # Preview should be the public URL of the image
-        preview_map = {"type": "image_url", "value": upload_result.get("publicUrl")}
+        upload_result, preview_map, part_extras = _ingest_image(user_id, image_bytes, file_name, mime_type)
         message_id = _create_context_message(
             user_id=user_id,
             chat_id=chat_id,
             parent_message_id=parent_message_id,
             file_uri=upload_result["storageUrl"],
             mime_type=upload_result["mimeType"],
-            preview_map=preview_map
+            preview_map=preview_map,
+            part_extras=part_extras
         )
 
         return {
@@ -413,10 +646,424 @@ def _upload_image_and_get_uri_logic(req: https_fn.CallableRequest):
         # The helper will raise the HttpsError as needed
         raise
 
+# --- Direct-to-GCS Uploads (Signed URLs) ---
+def _create_signed_upload_url_logic(req: https_fn.CallableRequest):
+    """
+    Step 1 of the direct upload flow: returns a V4 signed PUT URL so the browser can upload
+    a PDF or image straight to GCS instead of sending it base64-encoded through the callable.
+    """
+    if not req.auth:
+        raise https_fn.HttpsError(code=https_fn.FunctionsErrorCode.UNAUTHENTICATED, message="Authentication required.")
+    data = req.data
+    file_name, mime_type, context_type = data.get("fileName"), data.get("mimeType"), data.get("contextType")
+    if not all([file_name, mime_type, context_type]):
+        raise https_fn.HttpsError(code=https_fn.FunctionsErrorCode.INVALID_ARGUMENT, message="Missing required fields: fileName, mimeType, contextType.")
+    if context_type not in SIGNED_UPLOAD_CONTEXT_TYPES:
+        raise https_fn.HttpsError(code=https_fn.FunctionsErrorCode.INVALID_ARGUMENT, message=f"Unsupported contextType for direct upload: {context_type}.")
+    if context_type == "pdf" and mime_type != "application/pdf":
+        raise https_fn.HttpsError(code=https_fn.FunctionsErrorCode.INVALID_ARGUMENT, message="PDF uploads must use mimeType 'application/pdf'.")
+    if context_type == "image" and not mime_type.startswith("image/"):
+        raise https_fn.HttpsError(code=https_fn.FunctionsErrorCode.INVALID_ARGUMENT, message="Image uploads must use an image/* mimeType.")
+
+    user_id = req.auth.uid
+    try:
+        import google.auth
+        from google.auth.transport import requests as google_auth_requests
+
+        bucket = _get_context_bucket(get_storage_client())
+        _ensure_bucket_cors_for_uploads(bucket)
+
+        _, file_extension = os.path.splitext(file_name)
+        blob_path = f"users/{user_id}/uploads/{uuid.uuid4().hex}{file_extension}"
+        blob = bucket.blob(blob_path)
+
+        # Function runtimes use token-based credentials without a private key, so signing goes through IAM signBlob.
+        credentials = get_or_create("signing_credentials", lambda: google.auth.default()[0])
+        if not credentials.valid:
+            credentials.refresh(google_auth_requests.Request())
+        signed_url = blob.generate_signed_url(
+            version="v4",
+            expiration=timedelta(minutes=SIGNED_UPLOAD_URL_EXPIRATION_MINUTES),
+            method="PUT",
+            content_type=mime_type,
+            # GCS rejects the PUT unless the client sends this exact header and the body fits the range.
+            headers={"x-goog-content-length-range": SIGNED_UPLOAD_LENGTH_RANGE},
+            service_account_email=getattr(credentials, "service_account_email", None),
+            access_token=credentials.token
+        )
+        logger.info(f"Issued signed upload URL for user {user_id}: {blob_path} ({context_type}, {mime_type})")
+        return {
+            "success": True,
+            "uploadUrl": signed_url,
+            "uploadPath": blob_path,
+            "mimeType": mime_type,
+            "uploadHeaders": {"Content-Type": mime_type, "x-goog-content-length-range": SIGNED_UPLOAD_LENGTH_RANGE},
+            "maxBytes": MAX_SIGNED_UPLOAD_BYTES,
+            "expiresInSeconds": SIGNED_UPLOAD_URL_EXPIRATION_MINUTES * 60
+        }
+    except Exception as e:
+        logger.error(f"Failed to create signed upload URL for user {user_id}: {e}", exc_info=True)
+        raise https_fn.HttpsError(code=https_fn.FunctionsErrorCode.INTERNAL, message=f"Failed to create upload URL: {e}")
+
+
+def _ingest_uploaded_file(user_id: str, data: dict, storage_client: storage.Client | None = None, extracted_pages: dict | None = None, on_progress=None):
+    """Processes an object uploaded through a signed URL. Returns (upload_result, preview_map, part_extras)."""
+    upload_path, file_name, context_type = data.get("uploadPath"), data.get("fileName"), data.get("contextType")
+    if not all([upload_path, file_name, context_type]):
+        raise https_fn.HttpsError(code=https_fn.FunctionsErrorCode.INVALID_ARGUMENT, message="Missing required fields: uploadPath, fileName, contextType.")
+    if context_type not in SIGNED_UPLOAD_CONTEXT_TYPES:
+        raise https_fn.HttpsError(code=https_fn.FunctionsErrorCode.INVALID_ARGUMENT, message=f"Unsupported contextType for direct upload: {context_type}.")
+    if not upload_path.startswith(f"users/{user_id}/uploads/") or ".." in upload_path:
+        raise https_fn.HttpsError(code=https_fn.FunctionsErrorCode.PERMISSION_DENIED, message="Upload path does not belong to the current user.")
+
+    storage_client = storage_client or get_storage_client()
+    bucket = _get_context_bucket(storage_client)
+    blob = bucket.get_blob(upload_path)
+    if blob is None:
+        raise https_fn.HttpsError(code=https_fn.FunctionsErrorCode.NOT_FOUND, message="Uploaded file not found. The upload may not have completed.")
+    if blob.size is not None and blob.size > MAX_SIGNED_UPLOAD_BYTES:
+        try:
+            blob.delete()
+        except Exception as e:
+            logger.warn(f"Failed to delete oversized upload {upload_path}: {e}")
+        raise https_fn.HttpsError(code=https_fn.FunctionsErrorCode.INVALID_ARGUMENT, message=f"Uploaded file is {blob.size} bytes; the limit is {MAX_SIGNED_UPLOAD_BYTES} bytes.")
+    mime_type = blob.content_type or data.get("mimeType") or "application/octet-stream"
+    logger.info(f"Finalizing direct upload for user {user_id}: {upload_path}, size: {blob.size} bytes, mimeType: {mime_type}")
+
+    if context_type == "image":
+        return _ingest_image(
+            user_id, blob.download_as_bytes(), file_name, mime_type,
+            original_blob=blob,
+            storage_client=storage_client
+        )
+
+    with blob.open("rb") as pdf_stream:
+        ingest_result = _ingest_pdf(user_id, pdf_stream, file_name, data, storage_client, extracted_pages, on_progress)
+    try:
+        blob.delete()  # Only the extracted text is referenced by the chat.
+    except Exception as e:
+        logger.warn(f"Failed to delete raw PDF upload {upload_path}: {e}")
+    return ingest_result
+
+
+def _finalize_context_upload_logic(req: https_fn.CallableRequest):
+    """
+    Step 2 of the direct upload flow: processes an object the client uploaded through a signed URL
+    and creates the matching context message. PDFs are read from GCS as a stream.
+    """
+    if not req.auth:
+        raise https_fn.HttpsError(code=https_fn.FunctionsErrorCode.UNAUTHENTICATED, message="Authentication required.")
+    chat_id = req.data.get("chatId")
+    parent_message_id = req.data.get("parentMessageId")
+    if not chat_id:
+        raise https_fn.HttpsError(code=https_fn.FunctionsErrorCode.INVALID_ARGUMENT, message="chatId is required.")
+    _validate_retrieval_options(req.data)
+    if req.data.get("background") and req.data.get("contextType") == "pdf":
+        return _enqueue_context_ingest_job(req.auth.uid, "pdf", req.data)
+
+    upload_result, preview_map, part_extras = _ingest_uploaded_file(req.auth.uid, req.data)
+    message_id = _create_context_message(
+        user_id=req.auth.uid,
+        chat_id=chat_id,
+        parent_message_id=parent_message_id,
+        file_uri=upload_result["storageUrl"],
+        mime_type=upload_result["mimeType"],
+        preview_map=preview_map,
+        part_extras=part_extras
+    )
+
+    return {
+        **upload_result,
+        "success": True,
+        "messageId": message_id,
+        "preview": preview_map
+    }
+
+
+# --- Bulk Ingestion ---
+MAX_BULK_SOURCES = 20
+MAX_BULK_WORKERS = 8
+
+
+def _ingest_context_source(user_id: str, source: dict, http_client: httpx.Client, storage_client: storage.Client):
+    """Dispatches one bulk source to its ingest function using the shared clients."""
+    source_type = source.get("type")
+    _validate_retrieval_options(source)
+    if source_type == "webpage":
+        if not source.get("url"):
+            raise https_fn.HttpsError(code=https_fn.FunctionsErrorCode.INVALID_ARGUMENT, message="URL is required.")
+        return _ingest_web_page(user_id, source["url"], source, http_client, storage_client)
+    if source_type == "gitrepo":
+        return _ingest_git_repo(user_id, source, http_client, storage_client)
+    if source_type == "pdf" and source.get("url"):
+        url = source["url"]
+        pdf_bytes = _fetch_pdf_bytes_from_url(url, http_client)
+        return _ingest_pdf(user_id, io.BytesIO(pdf_bytes), url.split('/')[-1], source, storage_client)
+    if source_type in SIGNED_UPLOAD_CONTEXT_TYPES:
+        return _ingest_uploaded_file(user_id, {**source, "contextType": source_type}, storage_client)
+    raise https_fn.HttpsError(code=https_fn.FunctionsErrorCode.INVALID_ARGUMENT, message=f"Unsupported source type: {source_type}.")
+
+
+def _ingest_context_sources_logic(req: https_fn.CallableRequest):
+    """
+    Ingests several heterogeneous context sources in one call. Sources are processed concurrently
+    with shared HTTP and storage clients, failures are reported per item, and all resulting context
+    messages are written in a single Firestore batch.
+    """
+    if not req.auth:
+        raise https_fn.HttpsError(code=https_fn.FunctionsErrorCode.UNAUTHENTICATED, message="Authentication required.")
+    sources = req.data.get("sources")
+    chat_id = req.data.get("chatId")
+    parent_message_id = req.data.get("parentMessageId")
+    user_id = req.auth.uid
+    if not chat_id:
+        raise https_fn.HttpsError(code=https_fn.FunctionsErrorCode.INVALID_ARGUMENT, message="chatId is required.")
+    if not isinstance(sources, list) or not sources:
+        raise https_fn.HttpsError(code=https_fn.FunctionsErrorCode.INVALID_ARGUMENT, message="sources must be a non-empty list.")
+    if len(sources) > MAX_BULK_SOURCES:
+        raise https_fn.HttpsError(code=https_fn.FunctionsErrorCode.INVALID_ARGUMENT, message=f"At most {MAX_BULK_SOURCES} sources can be ingested per call.")
+
+    logger.info(f"[_ingest_context_sources_logic] Ingesting {len(sources)} sources for user {user_id} into chat {chat_id}.")
+    storage_client = get_storage_client()
+    results = [None] * len(sources)
+    with httpx.Client(timeout=30.0) as http_client, ThreadPoolExecutor(max_workers=min(MAX_BULK_WORKERS, len(sources))) as executor:
+        futures = {
+            executor.submit(_ingest_context_source, user_id, source if isinstance(source, dict) else {}, http_client, storage_client): index
+            for index, source in enumerate(sources)
+        }
+        for future in as_completed(futures):
+            index = futures[future]
+            try:
+                results[index] = future.result()
+            except https_fn.HttpsError as e:
+                logger.warn(f"Bulk source {index} failed: {e.message}")
+                results[index] = {"success": False, "index": index, "error": e.message}
+            except Exception as e:
+                logger.error(f"Bulk source {index} failed unexpectedly: {e}", exc_info=True)
+                results[index] = {"success": False, "index": index, "error": f"Failed to ingest source: {e}"}
+
+    db = get_firestore_client()
+    messages = db.collection("chats").document(chat_id).collection("messages")
+    batch = db.batch()
+    response_items = []
+    for index, result in enumerate(results):
+        if isinstance(result, dict):
+            response_items.append(result)
+            continue
+        upload_result, preview_map, part_extras = result
+        doc_ref = messages.document()
+        batch.set(doc_ref, _build_context_message_data(
+            user_id, parent_message_id, upload_result["storageUrl"], upload_result["mimeType"], preview_map, part_extras
+        ))
+        response_items.append({**upload_result, "success": True, "index": index, "messageId": doc_ref.id, "preview": preview_map})
+
+    succeeded = sum(1 for item in response_items if item["success"])
+    if succeeded:
+        try:
+            batch.commit()
+        except Exception as e:
+            logger.error(f"Failed to write bulk context messages to Firestore: {e}", exc_info=True)
+            raise https_fn.HttpsError(code=https_fn.FunctionsErrorCode.INTERNAL, message=f"Failed to create context messages: {e}")
+    logger.info(f"Bulk ingestion for chat {chat_id} finished: {succeeded}/{len(sources)} sources succeeded.")
+
+    return {"success": succeeded > 0, "results": response_items}
+
+# --- Background Ingestion Jobs ---
+CONTEXT_INGEST_TASK_FUNCTION = "executeContextIngestTask"
+MAX_INGEST_ATTEMPTS = 3  # Keep in sync with the RetryConfig of executeContextIngestTask in main.py
+INGEST_TASK_TIMEOUT_SECONDS = 540  # Keep in sync with timeout_sec of executeContextIngestTask in main.py
+# The last attempt records its own timeout this long before the platform kills it.
+INGEST_TIMEOUT_MARGIN_SECONDS = 20
+# Credentials are kept out of the Cloud Tasks payload and parked in a server-only collection instead.
+INGEST_SECRET_PARAMS = ("gitToken",)
+INGEST_SECRETS_COLLECTION = "ingestSecrets"
+NON_RETRYABLE_INGEST_ERRORS = {
+    https_fn.FunctionsErrorCode.INVALID_ARGUMENT,
+    https_fn.FunctionsErrorCode.NOT_FOUND,
+    https_fn.FunctionsErrorCode.PERMISSION_DENIED,
+    https_fn.FunctionsErrorCode.FAILED_PRECONDITION,
+}
+
+
+def _enqueue_context_ingest_job(user_id: str, job_type: str, data: dict) -> dict:
+    """
+    Creates a placeholder context message and hands the actual fetch/processing to a Cloud Task,
+    so the callable returns immediately. The worker fills in the message when done.
+    """
+    chat_id = data.get("chatId")
+    db = get_firestore_client()
+    message_ref = db.collection("chats").document(chat_id).collection("messages").document()
+    try:
+        message_ref.set({
+            "participant": "context_stuffed",
+            "parts": [],
+            "parentMessageId": data.get("parentMessageId"),
+            "timestamp": SERVER_TIMESTAMP,
+            "createdBy": f"user:{user_id}",
+            "ingestJob": {"type": job_type, "status": "queued", "attempts": 0, "maxAttempts": MAX_INGEST_ATTEMPTS, "progress": {}}
+        })
+    except Exception as e:
+        logger.error(f"Failed to create placeholder context message in Firestore: {e}", exc_info=True)
+        raise https_fn.HttpsError(code=https_fn.FunctionsErrorCode.INTERNAL, message=f"Failed to create context message: {e}")
+
+    job_params = {k: v for k, v in data.items() if k not in ("chatId", "parentMessageId", "background", "fileData", *INGEST_SECRET_PARAMS)}
+    job_secrets = {k: data[k] for k in INGEST_SECRET_PARAMS if data.get(k)}
+    try:
+        if job_secrets:
+            db.collection(INGEST_SECRETS_COLLECTION).document(message_ref.id).set({**job_secrets, "userId": user_id, "createdAt": SERVER_TIMESTAMP})
+        enqueue_function_task(CONTEXT_INGEST_TASK_FUNCTION, {
+            "chatId": chat_id,
+            "messageId": message_ref.id,
+            "userId": user_id,
+            "jobType": job_type,
+            "params": job_params
+        })
+    except Exception as e:
+        logger.error(f"Failed to enqueue context ingest job for message {message_ref.id}: {e}")
+        message_ref.update({"ingestJob.status": "error", "ingestJob.error": f"Failed to start background ingestion: {e}"})
+        _delete_ingest_secrets(db, message_ref.id)
+        raise https_fn.HttpsError(code=https_fn.FunctionsErrorCode.INTERNAL, message="Failed to start background ingestion.")
+
+    logger.info(f"Queued background '{job_type}' ingestion for message {message_ref.id} in chat {chat_id}.")
+    return {"success": True, "background": True, "status": "queued", "messageId": message_ref.id}
+
+
+def _load_ingest_secrets(db, message_id: str) -> dict:
+    snapshot = db.collection(INGEST_SECRETS_COLLECTION).document(message_id).get()
+    secrets = snapshot.to_dict() if snapshot.exists else {}
+    return {k: secrets[k] for k in INGEST_SECRET_PARAMS if secrets.get(k)}
+
+
+def _delete_ingest_secrets(db, message_id: str):
+    try:
+        db.collection(INGEST_SECRETS_COLLECTION).document(message_id).delete()
+    except Exception as e:
+        logger.warn(f"Failed to delete ingest credentials for message {message_id}: {e}")
+
+
+def _load_ingest_checkpoint(bucket, checkpoint_prefix: str) -> dict:
+    """Merges all checkpoint parts written by earlier attempts of the same job."""
+    completed_units = {}
+    for blob in bucket.list_blobs(prefix=checkpoint_prefix):
+        try:
+            completed_units.update(json.loads(blob.download_as_text()))
+        except Exception as e:
+            logger.warn(f"Ignoring unreadable checkpoint part {blob.name}: {e}")
+    return completed_units
+
+
+def _clear_ingest_checkpoint(bucket, checkpoint_prefix: str):
+    for blob in bucket.list_blobs(prefix=checkpoint_prefix):
+        try:
+            blob.delete()
+        except Exception as e:
+            logger.warn(f"Failed to delete checkpoint part {blob.name}: {e}")
+
+
+def run_context_ingest_task(data: dict, retry_count: int | None = None):
+    """
+    Worker for executeContextIngestTask. Completed units of work (repository files, PDF pages) are
+    checkpointed to GCS as they finish, so a Cloud Tasks retry resumes instead of starting over.
+    retry_count is the task's X-CloudTasks-TaskRetryCount; it decides whether this is the final attempt,
+    since an attempt killed by the timeout never gets to record itself on the job.
+    """
+    chat_id, message_id, user_id, job_type = data.get("chatId"), data.get("messageId"), data.get("userId"), data.get("jobType")
+    params = data.get("params") or {}
+    db = get_firestore_client()
+    message_ref = db.collection("chats").document(chat_id).collection("messages").document(message_id)
+    snapshot = message_ref.get()
+    if not snapshot.exists:
+        logger.warn(f"Context ingest job for missing message {message_id} in chat {chat_id}. Dropping.")
+        return
+    message = snapshot.to_dict()
+    job = message.get("ingestJob") or {}
+    if job.get("status") in ("completed", "error"):
+        logger.info(f"Context ingest job for message {message_id} already finished with status '{job.get('status')}'. Skipping.")
+        return
+
+    storage_client = get_storage_client()
+    bucket = _get_context_bucket(storage_client)
+    checkpoint_prefix = f"users/{user_id}/jobs/{message_id}/"
+
+    attempts = retry_count + 1 if retry_count is not None else job.get("attempts", 0) + 1
+    is_final_attempt = attempts >= MAX_INGEST_ATTEMPTS
+    message_ref.update({
+        "ingestJob.status": "running",
+        "ingestJob.attempts": attempts,
+        "ingestJob.startedAt": SERVER_TIMESTAMP,
+        # Past this time the attempt has been killed. If it was the last one, readers treat the job as failed.
+        "ingestJob.deadlineAt": datetime.now(timezone.utc) + timedelta(seconds=INGEST_TASK_TIMEOUT_SECONDS)
+    })
+    params = {**params, **_load_ingest_secrets(db, message_id)}
+    completed_units = _load_ingest_checkpoint(bucket, checkpoint_prefix)
+    if completed_units:
+        logger.info(f"Resuming context ingest job {message_id} with {len(completed_units)} checkpointed units.")
+
+    def on_progress(entries: dict, done: int, total: int):
+        bucket.blob(f"{checkpoint_prefix}{uuid.uuid4().hex}.json").upload_from_string(json.dumps(entries), content_type="application/json")
+        message_ref.update({"ingestJob.progress": {"done": done, "total": total}})
+
+    def on_final_timeout():
+        logger.error(f"Context ingest job {message_id} is about to hit the task timeout on its final attempt. Marking it failed.")
+        message_ref.update({
+            "ingestJob.status": "error",
+            "ingestJob.error": f"Background ingestion timed out after {attempts} attempts."
+        })
+        _delete_ingest_secrets(db, message_id)
+
+    timeout_watchdog = None
+    if is_final_attempt:
+        timeout_watchdog = threading.Timer(INGEST_TASK_TIMEOUT_SECONDS - INGEST_TIMEOUT_MARGIN_SECONDS, on_final_timeout)
+        timeout_watchdog.daemon = True
+        timeout_watchdog.start()
+
+    try:
+        if job_type == "gitrepo":
+            result = _ingest_git_repo(user_id, params, storage_client=storage_client, fetched_files=completed_units, on_progress=on_progress)
+        elif job_type == "pdf" and params.get("uploadPath"):
+            result = _ingest_uploaded_file(user_id, {**params, "contextType": "pdf"}, storage_client, extracted_pages=completed_units, on_progress=on_progress)
+        elif job_type == "pdf" and params.get("url"):
+            url = params["url"]
+            pdf_bytes = _fetch_pdf_bytes_from_url(url)
+            result = _ingest_pdf(user_id, io.BytesIO(pdf_bytes), url.split('/')[-1], params, storage_client, extracted_pages=completed_units, on_progress=on_progress)
+        else:
+            raise https_fn.HttpsError(code=https_fn.FunctionsErrorCode.INVALID_ARGUMENT, message=f"Unsupported background ingest job: {job_type}.")
+    except Exception as e:
+        error_message = e.message if isinstance(e, https_fn.HttpsError) else str(e)
+        is_final = is_final_attempt or (isinstance(e, https_fn.HttpsError) and e.code in NON_RETRYABLE_INGEST_ERRORS)
+        logger.error(f"Context ingest job {message_id} failed on attempt {attempts} (final: {is_final}): {error_message}")
+        message_ref.update({"ingestJob.status": "error" if is_final else "retrying", "ingestJob.error": error_message})
+        if is_final:
+            _clear_ingest_checkpoint(bucket, checkpoint_prefix)
+            _delete_ingest_secrets(db, message_id)
+            return
+        raise  # Let Cloud Tasks retry; checkpointed work is reused on the next attempt.
+    finally:
+        if timeout_watchdog:
+            timeout_watchdog.cancel()
+
+    upload_result, preview_map, part_extras = result
+    message_data = _build_context_message_data(
+        user_id, message.get("parentMessageId"), upload_result["storageUrl"], upload_result["mimeType"], preview_map, part_extras
+    )
+    message_ref.update({
+        "parts": message_data["parts"],
+        "ingestJob.status": "completed",
+        "ingestJob.completedAt": SERVER_TIMESTAMP
+    })
+    _clear_ingest_checkpoint(bucket, checkpoint_prefix)
+    _delete_ingest_secrets(db, message_id)
+    logger.info(f"Context ingest job {message_id} ({job_type}) completed: {upload_result['storageUrl']}")
+
+
 # This __all__ list makes the functions importable by main.py
 __all__ = [
     '_fetch_web_page_content_logic',
     '_fetch_git_repo_contents_logic',
     '_process_pdf_content_logic',
-    '_upload_image_and_get_uri_logic'
+    '_upload_image_and_get_uri_logic',
+    '_create_signed_upload_url_logic',
+    '_finalize_context_upload_logic',
+    '_ingest_context_sources_logic',
+    'run_context_ingest_task'
 ]
\ No newline at end of file
@@ -9,18 +9,37 @@ from google.cloud.aiplatform_v1beta1 import ReasoningEngineServiceClient
 from google.cloud.aiplatform_v1beta1.types import ReasoningEngine as ReasoningEngineProto
 from vertexai import agent_engines as deployed_agent_engines
 import os
+import cloudpickle
 
 from common.core import db, logger
 from common.config import get_gcp_project_config
+from common.clients import get_reasoning_engine_client
 from common.utils import initialize_vertex_ai
 from common.adk_helpers import generate_vertex_deployment_display_name
 # UPDATED IMPORT: Pointing to the new refactored agent builder
 from common.agents import instantiate_adk_agent_from_config
-from common.agents.llm_config import BACKEND_LITELLM_PROVIDER_CONFIG
+from common.agents.llm_config import BACKEND_LITELLM_PROVIDER_CONFIG, prepare_models_for_deployment
+from common.agents.failover_llm import unwrap_failover_models
+from common.agents import workflow_agents
+
+# Vertex AI pickles the agent with cloudpickle. Our workflow agent classes are not installed in the
+# deployment, so they are pickled along with the agent instead of being imported by name.
+cloudpickle.register_pickle_by_value(workflow_agents)
 
 
 # --- Deployment Logic ---
 
+async def _build_agent_for_deployment(agent_config_data: dict, agent_doc_id: str):
+    """Builds the agent tree and removes the model wrappers that only work inside the functions, ready for pickling."""
+    adk_agent = await instantiate_adk_agent_from_config(
+        agent_config_data,
+        parent_adk_name_for_context=f"root_{agent_doc_id[:4]}"
+    )
+    unwrap_failover_models(adk_agent)
+    prepare_models_for_deployment(adk_agent)
+    return adk_agent
+
+
 def _deploy_agent_to_vertex_logic(req: https_fn.CallableRequest):
     agent_config_data = req.data.get("agentConfig")
     agent_doc_id = req.data.get("agentDocId")
@@ -45,10 +64,7 @@ def _deploy_agent_to_vertex_logic(req: https_fn.CallableRequest):
     initialize_vertex_ai()
 
     try:
-        adk_agent = asyncio.run(instantiate_adk_agent_from_config(
-            agent_config_data,
-            parent_adk_name_for_context=f"root_{agent_doc_id[:4]}"
-        ))
+        adk_agent = asyncio.run(_build_agent_for_deployment(agent_config_data, agent_doc_id))
         logger.info(f"Root ADK Agent object '{adk_agent.name}' of type {type(adk_agent).__name__} prepared for deployment.")
     except ValueError as e_instantiate:
         error_msg = f"Failed to instantiate agent hierarchy for '{agent_doc_id}' (Original Name: '{original_config_name}'): {str(e_instantiate)}"
@@ -173,8 +189,7 @@ def _check_vertex_agent_deployment_status_logic(req: https_fn.CallableRequest):
     initialize_vertex_ai()
 
     project_id, location, _ = get_gcp_project_config()
-    client_options = {"api_endpoint": f"{location}-aiplatform.googleapis.com"}
-    reasoning_engine_client = ReasoningEngineServiceClient(client_options=client_options)
+    reasoning_engine_client = get_reasoning_engine_client(location)
     parent_path = f"projects/{project_id}/locations/{location}"
 
     try:
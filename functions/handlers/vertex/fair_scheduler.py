@@ -0,0 +1,119 @@
+# functions/handlers/vertex/fair_scheduler.py
+import os
+import time
+from firebase_admin import firestore
+
+from common.core import db, logger
+
+# Per-user concurrency quota for agent runs. A user's document in SCHEDULER_COLLECTION may set
+# "maxConcurrentRuns" to override the project-wide default for that user.
+DEFAULT_MAX_CONCURRENT_RUNS_PER_USER = int(os.environ.get("MAX_CONCURRENT_RUNS_PER_USER", "3"))
+SCHEDULER_COLLECTION = "agentRunScheduler"
+# Over-quota runs are re-delivered by Cloud Tasks after this many seconds per position in the user's queue.
+DEFER_SECONDS_PER_POSITION = 15
+MAX_DEFER_SECONDS = 120
+# Slots older than the task timeout belong to crashed workers and are reclaimed.
+RUN_SLOT_LEASE_SECONDS = 600
+WAITING_ENTRY_TTL_SECONDS = 3600
+
+
+def _scheduler_ref(user_id: str):
+    return db.collection(SCHEDULER_COLLECTION).document(user_id)
+
+
+def _load_state(snapshot) -> tuple[dict, dict, int]:
+    """Returns (running, waiting, quota) with expired entries dropped."""
+    state = snapshot.to_dict() or {}
+    now_ms = int(time.time() * 1000)
+    running = {k: v for k, v in (state.get("running") or {}).items() if now_ms - v < RUN_SLOT_LEASE_SECONDS * 1000}
+    waiting = {k: v for k, v in (state.get("waiting") or {}).items() if now_ms - v < WAITING_ENTRY_TTL_SECONDS * 1000}
+    quota = state.get("maxConcurrentRuns") or DEFAULT_MAX_CONCURRENT_RUNS_PER_USER
+    return running, waiting, quota
+
+
+def _queue_position(message_id: str, running: dict, waiting: dict, quota: int) -> int:
+    """0 when the run may start now, otherwise the number of runs that must start before it."""
+    ahead = sum(1 for k, v in waiting.items() if (v, k) < (waiting[message_id], message_id))
+    return max(0, len(running) + ahead - quota + 1)
+
+
+def _transact(user_id: str, update_fn):
+    transaction = db.transaction()
+
+    @firestore.transactional
+    def _run(transaction):
+        ref = _scheduler_ref(user_id)
+        running, waiting, quota = _load_state(ref.get(transaction=transaction))
+        result = update_fn(running, waiting, quota)
+        # Replace the maps wholesale (a plain merge would keep removed keys) but leave any quota override alone.
+        transaction.set(ref, {"running": running, "waiting": waiting, "updatedAt": firestore.SERVER_TIMESTAMP},
+                        merge=["running", "waiting", "updatedAt"])
+        return result
+
+    return _run(transaction)
+
+
+def register_pending_run(user_id: str, message_id: str) -> int:
+    """
+    Adds a run to the user's waiting list and returns its queue position (0 = can start immediately).
+    While the user's running and waiting runs still fit the quota the position is 0 whatever the order, so
+    the entry is added with a plain merge write instead of a transaction. The position is only a hint here;
+    try_acquire_run_slot decides in a transaction when the task runs.
+    """
+    ref = _scheduler_ref(user_id)
+    running, waiting, quota = _load_state(ref.get())
+    if message_id not in waiting and len(running) + len(waiting) < quota:
+        ref.set({"waiting": {message_id: int(time.time() * 1000)}, "updatedAt": firestore.SERVER_TIMESTAMP}, merge=True)
+        return 0
+
+    def _register(running, waiting, quota):
+        waiting.setdefault(message_id, int(time.time() * 1000))
+        return _queue_position(message_id, running, waiting, quota)
+    position = _transact(user_id, _register)
+    if position:
+        logger.info(f"[Scheduler] User {user_id} is over quota; run {message_id} is at queue position {position}.")
+    return position
+
+
+def try_acquire_run_slot(user_id: str, message_id: str) -> int:
+    """
+    Moves a run from waiting to running if the user has a free slot and no earlier run is waiting.
+    Returns 0 on success (including when the run already holds a slot, e.g. on a task retry),
+    otherwise the run's current queue position.
+    """
+    def _acquire(running, waiting, quota):
+        if message_id in running:
+            running[message_id] = int(time.time() * 1000)
+            return 0
+        waiting.setdefault(message_id, int(time.time() * 1000))
+        position = _queue_position(message_id, running, waiting, quota)
+        if position == 0:
+            del waiting[message_id]
+            running[message_id] = int(time.time() * 1000)
+        return position
+    return _transact(user_id, _acquire)
+
+
+def release_run_slot(user_id: str, message_id: str):
+    """Frees the run's slot (or waiting entry). Safe to call more than once."""
+    def _release(running, waiting, quota):
+        running.pop(message_id, None)
+        waiting.pop(message_id, None)
+    try:
+        _transact(user_id, _release)
+    except Exception as e:
+        # The lease expiry reclaims the slot eventually, so a failed release must not fail the run.
+        logger.warn(f"[Scheduler] Could not release run slot {message_id} for user {user_id}: {e}")
+
+
+def get_defer_seconds(queue_position: int) -> int:
+    """How long Cloud Tasks should hold back a run at the given queue position."""
+    return min(MAX_DEFER_SECONDS, DEFER_SECONDS_PER_POSITION * max(1, queue_position))
+
+
+__all__ = [
+    'register_pending_run',
+    'try_acquire_run_slot',
+    'release_run_slot',
+    'get_defer_seconds',
+]
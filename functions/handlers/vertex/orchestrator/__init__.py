@@ -1,19 +1,26 @@
 # functions/handlers/vertex/orchestrator/__init__.py
-import json
-from google.cloud import tasks_v2
-
+import time
 from firebase_admin import firestore
 from firebase_functions import https_fn
 
 from common.core import db, logger
-from common.config import get_gcp_project_config
-from common.utils import initialize_vertex_ai
+from common.tasks import enqueue_function_task
+from common.tracing import traced, span, set_span_attributes, inject_trace_context
+from handlers.vertex.fair_scheduler import register_pending_run, release_run_slot, get_defer_seconds
+
+# Keep in sync with the executeQuery timeout in main.py. Inline runs stop early enough to still enqueue.
+EXECUTE_QUERY_TIMEOUT_SECONDS = 180
+INLINE_DEADLINE_MARGIN_SECONDS = 30
+INLINE_MAX_RUN_SECONDS = 90
 
+@traced("executeQuery")
 def query_deployed_agent_orchestrator_logic(req: https_fn.CallableRequest):
     """
     IMMEDIATE RESPONSE: Validates request, creates a placeholder message in Firestore (and a user message if content is provided),
     enqueues a Cloud Task, and returns the new assistant messageId.
+    Nothing here needs Vertex AI, so it is not initialized on this path; the task worker does any setup it needs.
     """
+    dispatch_started_at = time.perf_counter()
     data = req.data
     agent_id = data.get("agentId")
     model_id = data.get("modelId")
@@ -26,6 +33,7 @@ def query_deployed_agent_orchestrator_logic(req: https_fn.CallableRequest):
     stuffed_context_items = data.get("stuffedContextItems")
 
     firebase_auth_uid = req.auth.uid if req.auth else "unknown_firebase_auth_uid"
+    set_span_attributes(chatId=chat_id, agentId=agent_id, modelId=model_id)
 
     if not chat_id or not adk_user_id:
         logger.error(f"Invalid arguments received. chatId: {chat_id}, adkUserId: {adk_user_id}")
@@ -33,9 +41,6 @@ def query_deployed_agent_orchestrator_logic(req: https_fn.CallableRequest):
     if not agent_id and not model_id:
         raise https_fn.HttpsError(code=https_fn.FunctionsErrorCode.INVALID_ARGUMENT, message="Either agentId or modelId must be provided.")
 
-    initialize_vertex_ai()
-    project_id, location, _ = get_gcp_project_config()
-
     batch = db.batch()
     chat_ref = db.collection("chats").document(chat_id)
     messages_col_ref = chat_ref.collection("messages")
@@ -90,6 +95,11 @@ def query_deployed_agent_orchestrator_logic(req: https_fn.CallableRequest):
         "parts": [],
         "timestamp": firestore.SERVER_TIMESTAMP,
     }
+    # Fair share: runs beyond the user's concurrency quota are held back in Cloud Tasks instead of
+    # competing with other users' runs for the queue's dispatch slots.
+    queue_position = register_pending_run(firebase_auth_uid, assistant_message_id)
+    if queue_position:
+        assistant_message_data.update({"status": "queued", "queuePosition": queue_position})
     batch.set(assistant_message_ref, assistant_message_data)
 
     if effective_parent_id:
@@ -97,39 +107,118 @@ def query_deployed_agent_orchestrator_logic(req: https_fn.CallableRequest):
         batch.update(effective_parent_ref, {"childMessageIds": firestore.ArrayUnion([assistant_message_id])})
 
     batch.update(chat_ref, {"lastInteractedAt": firestore.SERVER_TIMESTAMP})
-    batch.commit()
+    batch_started_at = time.perf_counter()
+    with span("firestore.batch_commit", purpose="create_messages"):
+        batch.commit()
+    firestore_batch_ms = round((time.perf_counter() - batch_started_at) * 1000, 1)
     logger.info(f"[Orchestrator] Created placeholder assistant message {assistant_message_id} for chat {chat_id}.")
+    set_span_attributes(assistantMessageId=assistant_message_id, queuePosition=queue_position)
+
+    task_payload = {
+        "chatId": chat_id,
+        "assistantMessageId": assistant_message_id,
+        "agentId": agent_id,
+        "modelId": model_id,
+        "adkUserId": adk_user_id,
+        "firebaseAuthUid": firebase_auth_uid,
+        # Lets the worker record dispatch cost and queue wait without an extra write here.
+        "dispatchMetrics": {"firestoreBatchMs": firestore_batch_ms, "enqueuedAtMs": int(time.time() * 1000)},
+        # W3C trace context, so the worker's spans join this request's trace.
+        "traceContext": inject_trace_context(),
+    }
 
-    try:
-        tasks_client = tasks_v2.CloudTasksClient()
-        queue_path = tasks_client.queue_path(project_id, location, "executeAgentRunTask") # lowercase for queue name
-
-        task_payload = {
-            "chatId": chat_id,
-            "assistantMessageId": assistant_message_id,
-            "agentId": agent_id,
-            "modelId": model_id,
-            "adkUserId": adk_user_id,
-            "firebaseAuthUid": firebase_auth_uid,
-        }
+    # Opt-in fast path: short model-only runs execute right here, skipping the queue and a second cold start.
+    if data.get("inline") and model_id and not agent_id and not queue_position:
+        # Imported here: the task package pulls in google.adk and litellm, which the plain dispatch path never needs.
+        from handlers.vertex.task import run_agent_task_inline
+        inline_budget = EXECUTE_QUERY_TIMEOUT_SECONDS - INLINE_DEADLINE_MARGIN_SECONDS - (time.perf_counter() - dispatch_started_at)
+        if inline_budget > 0 and run_agent_task_inline(task_payload, min(inline_budget, INLINE_MAX_RUN_SECONDS)):
+            return {"success": True, "assistantMessageId": assistant_message_id, "inline": True}
+        task_payload["dispatchMetrics"]["enqueuedAtMs"] = int(time.time() * 1000)
 
-        task = {
-            "http_request": {
-                "http_method": tasks_v2.HttpMethod.POST,
-                "url": f"https://{location}-{project_id}.cloudfunctions.net/executeAgentRunTask",
-                "headers": {"Content-type": "application/json"},
-                "body": json.dumps({"data": task_payload}).encode(),
-            }
-        }
-        tasks_client.create_task(parent=queue_path, task=task)
+    try:
+        enqueue_started_at = time.perf_counter()
+        with span("tasks.enqueue", function="executeAgentRunTask"):
+            enqueue_function_task("executeAgentRunTask", task_payload, delay_seconds=get_defer_seconds(queue_position) if queue_position else 0)
+        enqueue_ms = round((time.perf_counter() - enqueue_started_at) * 1000, 1)
         logger.info(f"[Orchestrator] Enqueued task for assistantMessageId: {assistant_message_id}")
 
     except Exception as e:
         logger.error(f"[Orchestrator] CRITICAL: Failed to enqueue task for message {assistant_message_id}: {e}")
+        release_run_slot(firebase_auth_uid, assistant_message_id)
         assistant_message_ref.update({
             "run.status": "error",
             "run.queryErrorDetails": [f"Failed to start agent run (task enqueue error): {e}"]
         })
         raise https_fn.HttpsError(code=https_fn.FunctionsErrorCode.INTERNAL, message="Failed to start the agent run.")
 
-    return {"success": True, "assistantMessageId": assistant_message_id}
\ No newline at end of file
+    dispatch_latency = {
+        "firestoreBatchMs": firestore_batch_ms,
+        "enqueueMs": enqueue_ms,
+        "totalMs": round((time.perf_counter() - dispatch_started_at) * 1000, 1),
+    }
+    logger.info(f"[Orchestrator] Dispatch latency for {assistant_message_id}: {dispatch_latency}")
+    return {"success": True, "assistantMessageId": assistant_message_id, "queuePosition": queue_position, "dispatchLatency": dispatch_latency}
+
+def _cancel_agent_run_logic(req: https_fn.CallableRequest):
+    """
+    Flags an assistant message for cancellation. A worker running it is listening for the flag and stops
+    the run, keeping any partial output; a run that has not started yet is marked cancelled right away.
+    """
+    chat_id = req.data.get("chatId")
+    message_id = req.data.get("messageId")
+    if not chat_id or not message_id:
+        raise https_fn.HttpsError(code=https_fn.FunctionsErrorCode.INVALID_ARGUMENT, message="chatId and messageId are required.")
+
+    message_ref = db.collection("chats").document(chat_id).collection("messages").document(message_id)
+    message = message_ref.get().to_dict()
+    if not message:
+        raise https_fn.HttpsError(code=https_fn.FunctionsErrorCode.NOT_FOUND, message=f"Message {message_id} not found.")
+    if not message.get("participant", "").startswith(("agent:", "model:")):
+        raise https_fn.HttpsError(code=https_fn.FunctionsErrorCode.INVALID_ARGUMENT, message="Only agent or model runs can be cancelled.")
+
+    status = message.get("status")
+    if status in ("completed", "error", "cancelled"):
+        return {"success": True, "status": status, "message": "Run already finished."}
+
+    cancel_update = {
+        "cancelRequested": True,
+        "cancelRequestedBy": req.auth.uid,
+        "cancelRequestedAt": firestore.SERVER_TIMESTAMP,
+    }
+    if status != "running":
+        # Nothing is executing yet; the worker skips cancelled messages when the task is delivered.
+        cancel_update.update({"status": "cancelled", "completedTimestamp": firestore.SERVER_TIMESTAMP})
+    message_ref.update(cancel_update)
+    logger.info(f"[Orchestrator] Cancellation requested for message {message_id} in chat {chat_id} (status: {status}).")
+    return {"success": True, "status": cancel_update.get("status", status)}
+
+def _get_event_log_logic(req: https_fn.CallableRequest):
+    """
+    Returns a signed download URL for the full event log of an assistant message whose events were compacted:
+    the message's events subcollection only indexes the key events, and the complete log is a gzipped JSONL
+    object in Cloud Storage. The browser fetches it directly, so large logs never pass through the callable.
+    """
+    from common.event_log import create_event_log_download_url, EVENT_LOG_URL_EXPIRATION_MINUTES
+    chat_id = req.data.get("chatId")
+    message_id = req.data.get("messageId")
+    if not chat_id or not message_id:
+        raise https_fn.HttpsError(code=https_fn.FunctionsErrorCode.INVALID_ARGUMENT, message="chatId and messageId are required.")
+
+    message = db.collection("chats").document(chat_id).collection("messages").document(message_id).get().to_dict()
+    if not message:
+        raise https_fn.HttpsError(code=https_fn.FunctionsErrorCode.NOT_FOUND, message=f"Message {message_id} not found.")
+    event_log_uri = (message.get("eventLog") or {}).get("uri")
+    if not event_log_uri:
+        raise https_fn.HttpsError(code=https_fn.FunctionsErrorCode.FAILED_PRECONDITION, message=f"Message {message_id} has no compacted event log.")
+    try:
+        download_url = create_event_log_download_url(event_log_uri)
+    except Exception as e:
+        logger.error(f"[Orchestrator] Failed to sign event log URL for message {message_id}: {e}", exc_info=True)
+        raise https_fn.HttpsError(code=https_fn.FunctionsErrorCode.INTERNAL, message="Failed to create the event log download URL.")
+    return {
+        "success": True,
+        "downloadUrl": download_url,
+        "eventCount": (message.get("eventLog") or {}).get("eventCount"),
+        "expiresInSeconds": EVENT_LOG_URL_EXPIRATION_MINUTES * 60
+    }
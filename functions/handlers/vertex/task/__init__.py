@@ -1,16 +1,38 @@
 # functions/handlers/vertex/task/__init__.py
 import asyncio
+import time
 import traceback
 from firebase_admin import firestore
 
 from common.core import db, logger
-from common.agents import instantiate_adk_agent_from_config
-from .history_builder import get_full_message_history, _build_adk_content_from_history
-from .agent_runner import _run_adk_agent, _run_vertex_agent, _run_a2a_agent
+from common.tasks import enqueue_function_task
+from common.utils import initialize_vertex_ai
+from common.agents import instantiate_adk_agent_from_config, sanitize_adk_agent_name
+from common.image_processing import get_max_image_dimension_for_provider
+from .history_builder import (get_full_message_history, _build_adk_content_from_history, _count_history_chars,
+                              _find_pending_ingest_message_ids, _with_carried_retrieval_contexts)
+from .agent_runner import _run_adk_agent, _run_vertex_agent, _run_a2a_agent, _find_final_response_from_events
+from .checkpoints import begin_run_attempt, clear_superseded_events
+from .branch_sessions import claim_branch_session, register_branch_session
+from .cancellation import watch_for_cancellation, load_partial_events
+from .run_metrics import RunMetrics, record_daily_run_metrics
+from .response_cache import attach_response_cache, summarize_response_cache, DEFAULT_TTL_HOURS
+from common.tracing import span, extract_trace_context, force_flush
+from ..fair_scheduler import try_acquire_run_slot, release_run_slot, get_defer_seconds
 
 
-async def _execute_agent_run(chat_id: str, assistant_message_id: str, agent_id: str | None, model_id: str | None, adk_user_id: str):
-    """The core logic that runs in the background task, now acting as an orchestrator."""
+# Inline (in-callable) runs are limited to model-only runs with a small prompt.
+INLINE_MAX_INPUT_CHARS = 20_000
+
+
+async def _execute_agent_run(chat_id: str, assistant_message_id: str, agent_id: str | None, model_id: str | None, adk_user_id: str, attempt_id: str,
+                             metrics: RunMetrics | None = None, history: list[dict] | None = None):
+    """
+    The core logic that runs in the background task, now acting as an orchestrator.
+    history may be passed in when the caller already loaded it (inline runs check its size first).
+    Phase timings are recorded into metrics.
+    """
+    metrics = metrics or RunMetrics()
     logger.info(f"Starting execution for message {assistant_message_id} in chat {chat_id}.")
     messages_ref = db.collection("chats").document(chat_id).collection("messages")
     assistant_message_ref = messages_ref.document(assistant_message_id)
@@ -19,61 +41,237 @@ async def _execute_agent_run(chat_id: str, assistant_message_id: str, agent_id:
     assistant_message = assistant_message_ref.get().to_dict()
     if not assistant_message: raise ValueError(f"Assistant message {assistant_message_id} not found.")
 
-    parent_id = assistant_message.get("parentMessageId")
-    history = await get_full_message_history(chat_id, parent_id)
-    adk_content, char_count = await _build_adk_content_from_history(history)
-    assistant_message_ref.update({"inputCharacterCount": char_count})
-
     participant_ref = db.collection("agents").document(agent_id) if agent_id else db.collection("models").document(model_id)
     participant_config = participant_ref.get().to_dict()
     if not participant_config: raise ValueError(f"Participant config not found for ID: {agent_id or model_id}")
 
+    # Model runs know their provider up front, so images can be sized to its limit.
+    max_image_dimension = get_max_image_dimension_for_provider(participant_config.get("provider")) if model_id else None
+
     agent_platform = participant_config.get("platform")
+    # Opt-in per agent or model: the full event log goes to Cloud Storage and Firestore keeps an index.
+    compact_event_log = bool(participant_config.get("compactEventLog"))
+    participant = assistant_message.get("participant")
+
+    if history is None:
+        with metrics.phase("historyMs"):
+            history = await get_full_message_history(chat_id, assistant_message.get("parentMessageId"))
+
+    # Running now would silently answer without a context the user just added, so the run stops before any model call.
+    if pending_ingest_ids := _find_pending_ingest_message_ids(history):
+        return {"finalParts": [], "errorDetails": [
+            f"Context is still being ingested (messages: {', '.join(pending_ingest_ids)}). Wait for it to finish, then run the query again."
+        ]}
+
+    # Deployed Vertex agents and local model runs keep a session per chat branch; a resumed session only needs the new messages.
+    branch_session, session_fields = None, None
+    if agent_id and agent_platform == 'google_vertex':
+        session_fields = {"kind": "vertex", "userId": adk_user_id, "resourceName": participant_config.get("vertexAiResourceName")}
+    elif model_id and not agent_id:
+        session_fields = {"kind": "adk", "userId": adk_user_id, "modelId": model_id}
+    if session_fields:
+        with metrics.phase("branchSessionMs"):
+            branch_session, new_history = claim_branch_session(chat_id, participant, history, assistant_message_id, match=session_fields)
+        if branch_session:
+            history = _with_carried_retrieval_contexts(history, new_history)
+
+    with metrics.phase("contentBuildMs"):
+        adk_content, char_count = await _build_adk_content_from_history(history, max_image_dimension=max_image_dimension)
+    assistant_message_ref.update({"inputCharacterCount": char_count})
 
     if agent_id and agent_platform == 'a2a':
-        return await _run_a2a_agent(participant_config, adk_content, events_collection_ref)
+        return await _run_a2a_agent(participant_config, adk_content, events_collection_ref, attempt_id, metrics)
 
     if agent_id and agent_platform == 'google_vertex':
         resource_name = participant_config.get("vertexAiResourceName")
         if not resource_name or participant_config.get("deploymentStatus") != "deployed":
             raise ValueError(f"Agent {agent_id} is not successfully deployed.")
-        return await _run_vertex_agent(resource_name, adk_content, adk_user_id, events_collection_ref)
+        with metrics.phase("instantiateMs"):
+            initialize_vertex_ai()  # Only the Vertex path needs the SDK; the dispatcher no longer initializes it.
+        result = await _run_vertex_agent(resource_name, adk_content, adk_user_id, events_collection_ref, attempt_id,
+                                         session_id=branch_session.get("sessionId") if branch_session else None, metrics=metrics,
+                                         compact_event_log=compact_event_log)
+        if not branch_session and result.get("sessionId"):
+            register_branch_session(chat_id, participant, result["sessionId"], assistant_message_id, session_fields)
+        return result
 
     if model_id:
         model_agent_config = {"name": f"model_run_{model_id[:6]}", "agentType": "Agent", "modelId": model_id, "tools": []}
-        local_adk_agent = await instantiate_adk_agent_from_config(model_agent_config)
-        return await _run_adk_agent(local_adk_agent, adk_content, adk_user_id, events_collection_ref)
+        with metrics.phase("instantiateMs"):
+            local_adk_agent = await instantiate_adk_agent_from_config(model_agent_config)
+        # The builder appends a random suffix to agent names. A resumed session is looked up by app name and
+        # its earlier replies are attributed by author, so model runs need a name that is the same every turn.
+        local_adk_agent.name = sanitize_adk_agent_name(f"model_run_{model_id}")
+        # Opt-in per model: identical temperature-0 requests are answered from the response cache.
+        cache_state = None
+        if participant_config.get("responseCache"):
+            cache_state = attach_response_cache(local_adk_agent, ttl_hours=participant_config.get("responseCacheTtlHours") or DEFAULT_TTL_HOURS)
+        result = await _run_adk_agent(local_adk_agent, adk_content, adk_user_id, events_collection_ref, attempt_id,
+                                      session_id=branch_session.get("sessionId") if branch_session else None, metrics=metrics,
+                                      compact_event_log=compact_event_log)
+        if cache_state:
+            result["responseCache"] = summarize_response_cache(cache_state)
+        if not branch_session and result.get("sessionId"):
+            register_branch_session(chat_id, participant, result["sessionId"], assistant_message_id, session_fields)
+        return result
 
     return {"finalParts": [], "errorDetails": [f"No valid execution path for agentId: {agent_id}, modelId: {model_id}"]}
 
 
-async def _run_agent_task_logic(data: dict):
+async def _run_agent_task_logic(data: dict, history: list[dict] | None = None):
     """Async logic for the task, with error handling."""
     chat_id, assistant_message_id = data.get("chatId"), data.get("assistantMessageId")
     assistant_message_ref = db.collection("chats").document(chat_id).collection("messages").document(assistant_message_id)
+    participant = f"agent:{data['agentId']}" if data.get("agentId") else f"model:{data.get('modelId')}"
+    metrics = RunMetrics()
     try:
-        assistant_message_ref.update({"status": "running"})
-        result = await _execute_agent_run(
+        running_update = {"status": "running", "queuePosition": firestore.DELETE_FIELD}
+        if dispatch_metrics := data.get("dispatchMetrics"):
+            enqueued_at_ms = dispatch_metrics.get("enqueuedAtMs")
+            running_update["dispatchMetrics"] = {
+                "firestoreBatchMs": dispatch_metrics.get("firestoreBatchMs"),
+                "queueWaitMs": int(time.time() * 1000) - enqueued_at_ms if enqueued_at_ms else None,
+            }
+            if running_update["dispatchMetrics"]["queueWaitMs"] is not None:
+                metrics.add("queueWaitMs", running_update["dispatchMetrics"]["queueWaitMs"])
+        handoff_attempt_id = data.get("handoffAttemptId")
+        attempt_id = begin_run_attempt(assistant_message_ref, running_update, handoff_attempt_id=handoff_attempt_id)
+        if attempt_id is None:
+            logger.info(f"Message {assistant_message_id} already finished or was cancelled; skipping task delivery.")
+            return
+        if attempt_id == handoff_attempt_id:
+            # The inline run's partial log belongs to this attempt but is replaced by the restarted run.
+            clear_superseded_events(assistant_message_ref.collection("events"), None)
+        elif attempt_id != "attempt-01":
+            clear_superseded_events(assistant_message_ref.collection("events"), attempt_id)
+        run_task = asyncio.create_task(_execute_agent_run(
             chat_id=chat_id, assistant_message_id=assistant_message_id,
             agent_id=data.get("agentId"), model_id=data.get("modelId"),
-            adk_user_id=data.get("adkUserId")
-        )
+            adk_user_id=data.get("adkUserId"), attempt_id=attempt_id, metrics=metrics, history=history
+        ))
+        cancel_watch, cancel_state = watch_for_cancellation(assistant_message_ref, run_task)
+        try:
+            result = await run_task
+        except asyncio.CancelledError:
+            if not cancel_state["requested"]:
+                raise
+            event_log = (assistant_message_ref.get().to_dict() or {}).get("eventLog")
+            partial_parts = _find_final_response_from_events(load_partial_events(assistant_message_ref.collection("events"), attempt_id, event_log))
+            run_metrics = metrics.to_dict()
+            assistant_message_ref.update({
+                "parts": partial_parts, "status": "cancelled", "metrics": run_metrics, "completedTimestamp": firestore.SERVER_TIMESTAMP
+            })
+            record_daily_run_metrics(participant, "cancelled", run_metrics)
+            logger.info(f"Message {assistant_message_id} cancelled by the user.")
+            return
+        finally:
+            cancel_watch.unsubscribe()
         final_update = {
             "parts": result.get("finalParts", []),
             "status": "error" if result.get("errorDetails") else "completed",
             "errorDetails": result.get("errorDetails"),
+            "metrics": metrics.to_dict(),
             "completedTimestamp": firestore.SERVER_TIMESTAMP
         }
+        if result.get("responseCache"):
+            final_update["responseCache"] = result["responseCache"]
         assistant_message_ref.update(final_update)
-        logger.info(f"Message {assistant_message_id} completed with status: {final_update['status']}")
+        record_daily_run_metrics(participant, final_update["status"], final_update["metrics"])
+        logger.info(f"Message {assistant_message_id} completed with status: {final_update['status']} in {final_update['metrics']['totalMs']}ms")
     except Exception as e:
         error_msg = f"Task handler exception for message {assistant_message_id}: {type(e).__name__} - {e}"
         logger.error(f"{error_msg}\n{traceback.format_exc()}")
+        run_metrics = metrics.to_dict()
         assistant_message_ref.update({
             "status": "error", "errorDetails": firestore.ArrayUnion([error_msg]),
-            "completedTimestamp": firestore.SERVER_TIMESTAMP
+            "metrics": run_metrics, "completedTimestamp": firestore.SERVER_TIMESTAMP
         })
+        record_daily_run_metrics(participant, "error", run_metrics)
+
+def _defer_agent_task(data: dict, queue_position: int):
+    """Re-enqueues an over-quota run with a schedule_time so other users' runs go first."""
+    chat_id, assistant_message_id = data.get("chatId"), data.get("assistantMessageId")
+    assistant_message_ref = db.collection("chats").document(chat_id).collection("messages").document(assistant_message_id)
+    if (assistant_message_ref.get().to_dict() or {}).get("status") == "cancelled":
+        release_run_slot(data.get("firebaseAuthUid"), assistant_message_id)
+        logger.info(f"Message {assistant_message_id} was cancelled while queued; not deferring it.")
+        return
+    defer_seconds = get_defer_seconds(queue_position)
+    enqueue_function_task("executeAgentRunTask", data, delay_seconds=defer_seconds)
+    assistant_message_ref.update({
+        "status": "queued", "queuePosition": queue_position
+    })
+    logger.info(f"Deferred message {assistant_message_id} by {defer_seconds}s at queue position {queue_position}.")
+
 
 def run_agent_task_wrapper(data: dict):
     """Synchronous wrapper to be called by the Cloud Task entry point."""
-    asyncio.run(_run_agent_task_logic(data))
\ No newline at end of file
+    user_id, assistant_message_id = data.get("firebaseAuthUid"), data.get("assistantMessageId")
+    try:
+        with span("executeAgentRunTask", parent_context=extract_trace_context(data.get("traceContext")),
+                  chatId=data.get("chatId"), assistantMessageId=assistant_message_id,
+                  agentId=data.get("agentId"), modelId=data.get("modelId")) as task_span:
+            queue_position = try_acquire_run_slot(user_id, assistant_message_id)
+            if queue_position:
+                task_span.set_attribute("deferredAtQueuePosition", queue_position)
+                _defer_agent_task(data, queue_position)
+                return
+            try:
+                asyncio.run(_run_agent_task_logic(data))
+            finally:
+                release_run_slot(user_id, assistant_message_id)
+    finally:
+        force_flush()
+
+
+def run_agent_task_inline(data: dict, timeout_seconds: float) -> bool:
+    """
+    Runs a model-only task directly inside the calling function instead of through Cloud Tasks.
+    Returns False without writing a result if the run is not eligible or would not finish within
+    timeout_seconds; the caller should then enqueue the task as usual.
+    Eligibility is checked before the run slot, the run attempt or the branch session is claimed,
+    so a declined run leaves nothing for the queued task to undo. A run that times out keeps its slot and
+    hands its attempt to the queued task (data["handoffAttemptId"]), so the fallback is neither a second
+    attempt nor a trip to the back of the user's queue.
+    """
+    if data.get("agentId") or not data.get("modelId"):
+        return False
+
+    async def _run_inline(history: list[dict]) -> str | None:
+        try:
+            await asyncio.wait_for(_run_agent_task_logic(data, history=history), timeout=timeout_seconds)
+            return None
+        except asyncio.TimeoutError:
+            return f"did not finish within {timeout_seconds:.0f}s"
+
+    chat_id, user_id, assistant_message_id = data.get("chatId"), data.get("firebaseAuthUid"), data.get("assistantMessageId")
+    assistant_message_ref = db.collection("chats").document(chat_id).collection("messages").document(assistant_message_id)
+    assistant_message = assistant_message_ref.get().to_dict() or {}
+    history = asyncio.run(get_full_message_history(chat_id, assistant_message.get("parentMessageId")))
+    # A resumed session still puts the whole branch in front of the model, so the full history is what is counted.
+    char_count = _count_history_chars(history)
+    fallback_update = {}
+    if char_count > INLINE_MAX_INPUT_CHARS:
+        fallback_reason = f"input of {char_count} characters exceeds the inline limit of {INLINE_MAX_INPUT_CHARS}"
+    elif try_acquire_run_slot(user_id, assistant_message_id):
+        fallback_reason = "user is at the concurrent run quota"
+    else:
+        keep_slot = False
+        try:
+            fallback_reason = asyncio.run(_run_inline(history))
+            attempt_id = (assistant_message_ref.get().to_dict() or {}).get("runAttemptId") if fallback_reason else None
+            if attempt_id:
+                # The queued task continues this attempt in the slot it already holds.
+                keep_slot = True
+                data["handoffAttemptId"] = attempt_id
+                fallback_update["handoffAttemptId"] = attempt_id
+        finally:
+            if not keep_slot:
+                release_run_slot(user_id, assistant_message_id)
+    if fallback_reason is None:
+        logger.info(f"Message {assistant_message_id} ran inline.")
+        return True
+
+    logger.info(f"Inline run for message {assistant_message_id} falling back to the task queue: {fallback_reason}")
+    assistant_message_ref.update({"status": "queued", "inlineFallbackReason": fallback_reason, **fallback_update})
+    return False
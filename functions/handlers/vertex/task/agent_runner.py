@@ -1,55 +1,163 @@
 # functions/handlers/vertex/task/agent_runner.py
+import asyncio
 import json
+import threading
+import time
 import traceback
 import uuid
 import httpx
 from a2a.types import Message as A2AMessage, TextPart
 from firebase_admin import firestore
 from google.adk.runners import Runner
-from google.adk.sessions import InMemorySessionService
 from google.adk.memory import InMemoryMemoryService
 from google.adk.artifacts import InMemoryArtifactService
 from vertexai import agent_engines
 import collections.abc
 from common.core import db, logger
+from common.clients import get_or_create
+from common.tracing import inject_trace_context
+from common.firestore_session_service import FirestoreSessionService
+from common.event_log import coalesce_partial_events, is_key_event, index_entry, upload_event_log
+from .checkpoints import event_document_id
+from .run_metrics import RunMetrics
 
 
-async def _run_agent_and_collect_events(agent_run_coroutine, events_collection_ref) -> tuple[list, list]:
-    """Generic runner that executes an agent, collects all events, and stores them in Firestore."""
+_STREAM_END = object()
+
+
+async def _iterate_in_daemon_thread(iterable):
+    """
+    Yields the items of a blocking iterator (e.g. a deployed agent's stream_query) advanced on its own daemon
+    thread. Unlike asyncio.to_thread, a cancelled run does not wait for the blocked next() call before the
+    event loop can shut down: the thread is abandoned and closes the iterator once that call returns.
+    """
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue()
+    abandoned = threading.Event()
+
+    def _deliver(item):
+        try:
+            loop.call_soon_threadsafe(queue.put_nowait, item)
+        except RuntimeError:  # The event loop has already been closed.
+            abandoned.set()
+
+    def _pump():
+        iterator = iter(iterable)
+        try:
+            for item in iterator:
+                if abandoned.is_set():
+                    break
+                _deliver((item, None))
+        except Exception as e:
+            _deliver((_STREAM_END, e))
+            return
+        finally:
+            if abandoned.is_set() and hasattr(iterator, "close"):
+                iterator.close()
+        _deliver((_STREAM_END, None))
+
+    threading.Thread(target=_pump, name="agent-stream", daemon=True).start()
+    try:
+        while True:
+            item, error = await queue.get()
+            if item is _STREAM_END:
+                if error:
+                    raise error
+                return
+            yield item
+    finally:
+        abandoned.set()
+
+
+async def _run_agent_and_collect_events(agent_run_coroutine, events_collection_ref, attempt_id: str,
+                                       metrics: RunMetrics | None = None, compact_event_log: bool = False) -> tuple[list, list]:
+    """
+    Generic runner that executes an agent, collects all events, and stores them in Firestore.
+    Event document IDs derive from the attempt and event index, so a rewrite never duplicates events.
+    Records time to first event, run and event-write time, and token/tool stats into metrics.
+    With compact_event_log, the full log goes to Cloud Storage and Firestore only gets the key events.
+    """
+    metrics = metrics or RunMetrics()
     all_events, errors = [], []
+    run_started = time.monotonic()
     try:
-        if isinstance(agent_run_coroutine, collections.abc.AsyncIterable):
-            async for event_obj in agent_run_coroutine:
-                event_dict = event_obj.model_dump() if hasattr(event_obj, 'model_dump') else event_obj
-                all_events.append(event_dict)
-        else:
-            for event_obj in agent_run_coroutine:
+        with metrics.phase("agentRunMs"):
+            # Blocking streams are pulled on their own thread so the event loop stays free to process a cancellation.
+            events = agent_run_coroutine if isinstance(agent_run_coroutine, collections.abc.AsyncIterable) \
+                else _iterate_in_daemon_thread(agent_run_coroutine)
+            async for event_obj in events:
+                metrics.mark_once("firstEventMs", run_started)
                 event_dict = event_obj.model_dump() if hasattr(event_obj, 'model_dump') else event_obj
                 all_events.append(event_dict)
+    except asyncio.CancelledError:
+        # Keep what the agent produced before it was cancelled, then let the cancellation propagate.
+        logger.info(f"Agent run cancelled after {len(all_events)} events.")
+        metrics.add_event_stats(all_events)
+        with metrics.phase("eventWriteMs"):
+            metrics.add("eventDocsWritten", _write_events(all_events, events_collection_ref, attempt_id, compact_event_log))
+        raise
     except Exception as e_run:
         logger.error(f"Error during agent run: {e_run}\n{traceback.format_exc()}")
         errors.append(f"Agent run failed: {str(e_run)}")
 
-    if all_events:
+    metrics.add_event_stats(all_events)
+    with metrics.phase("eventWriteMs"):
+        metrics.add("eventDocsWritten", _write_events(all_events, events_collection_ref, attempt_id, compact_event_log))
+    return all_events, errors
+
+
+# Firestore allows 500 writes per batch.
+WRITE_BATCH_SIZE = 400
+
+
+def _write_events(all_events: list, events_collection_ref, attempt_id: str, compact: bool = False) -> int:
+    """
+    Stores the run's events under the assistant message and returns the number of event documents written.
+    In compact mode the full log (partials included) is uploaded as gzipped JSONL, its location is recorded
+    as eventLog on the message, and only key events are written, with partial deltas folded into their
+    final event. Each document keeps the event's index in the full log.
+    """
+    if not all_events:
+        return 0
+    sanitized_events = []
+    for index, event_dict in enumerate(all_events):
+        try:
+            sanitized_events.append((index, json.loads(json.dumps(event_dict, default=str))))
+        except Exception as e_json:
+            logger.error(f"Could not sanitize event at index {index}. Error: {e_json}. Skipping.")
+
+    entries = sanitized_events
+    if compact:
+        message_ref = events_collection_ref.parent
+        try:
+            event_log_uri = upload_event_log(message_ref, [{**event, "eventIndex": index} for index, event in sanitized_events])
+            raw_indexes = [index for index, _ in sanitized_events]
+            entries = [(raw_indexes[position], index_entry(event))
+                       for position, event in coalesce_partial_events([event for _, event in sanitized_events]) if is_key_event(event)]
+            message_ref.update({"eventLog": {"uri": event_log_uri, "eventCount": len(all_events), "indexedCount": len(entries), "attemptId": attempt_id}})
+        except Exception as e_upload:
+            logger.warn(f"Could not store the compacted event log; writing every event instead: {e_upload}")
+            entries = sanitized_events
+
+    for start in range(0, len(entries), WRITE_BATCH_SIZE):
         batch = db.batch()
-        for index, event_dict in enumerate(all_events):
-            try:
-                sanitized_event_dict = json.loads(json.dumps(event_dict, default=str))
-                event_with_meta = {**sanitized_event_dict, "eventIndex": index, "timestamp": firestore.SERVER_TIMESTAMP}
-                batch.set(events_collection_ref.document(), event_with_meta)
-            except Exception as e_json:
-                logger.error(f"Could not sanitize event at index {index}. Error: {e_json}. Skipping.")
+        for index, event in entries[start:start + WRITE_BATCH_SIZE]:
+            event_with_meta = {**event, "eventIndex": index, "attemptId": attempt_id, "timestamp": firestore.SERVER_TIMESTAMP}
+            batch.set(events_collection_ref.document(event_document_id(attempt_id, index)), event_with_meta)
         batch.commit()
-    return all_events, errors
+    return len(entries)
 
 
 def _find_final_response_from_events(all_events: list) -> list:
-    """Parses a list of events to find the last complete model response."""
+    """
+    Parses a list of events to find the last complete model response. Events without content, such as the
+    branch and loop records of the workflow agents, are skipped.
+    """
     final_model_event = next(
         (event for event in reversed(all_events) if
-         event.get('content', {}).get('role') == 'model' and
+         (event.get('content') or {}).get('role') == 'model' and
          not event.get("partial", False) and
-         not any('function_call' in part for part in event.get('content', {}).get('parts', []))),
+         not any('function_call' in part for part in (event.get('content') or {}).get('parts') or [])),
         None
     )
     if final_model_event and final_model_event.get("content", {}).get("parts"):
@@ -57,38 +165,67 @@ def _find_final_response_from_events(all_events: list) -> list:
     return []
 
 
-async def _run_adk_agent(local_adk_agent, adk_content_for_run, adk_user_id, events_collection_ref):
-    """Runs a locally instantiated ADK agent."""
+async def _run_adk_agent(local_adk_agent, adk_content_for_run, adk_user_id, events_collection_ref, attempt_id, session_id=None,
+                         metrics: RunMetrics | None = None, compact_event_log: bool = False):
+    """
+    Runs a locally instantiated ADK agent.
+    Sessions are stored in Firestore: with session_id, the turn resumes that session and adk_content_for_run
+    only needs the new messages; without it, a session is created and its id is returned as "sessionId".
+    """
     runner = Runner(
         agent=local_adk_agent, app_name=local_adk_agent.name,
-        session_service=InMemorySessionService(),
+        session_service=get_or_create("adk_session_service", FirestoreSessionService),
         artifact_service=InMemoryArtifactService(),
         memory_service=InMemoryMemoryService()
     )
-    session = await runner.session_service.create_session(app_name=runner.app_name, user_id=adk_user_id)
+    metrics = metrics or RunMetrics()
+    session = None
+    with metrics.phase("sessionSetupMs"):
+        if session_id:
+            session = await runner.session_service.get_session(app_name=runner.app_name, user_id=adk_user_id, session_id=session_id)
+            if session is None:
+                logger.warn(f"ADK session {session_id} not found; starting a new one with only the new messages.")
+        if session is None:
+            session = await runner.session_service.create_session(app_name=runner.app_name, user_id=adk_user_id)
     run_coro = runner.run_async(user_id=adk_user_id, session_id=session.id, new_message=adk_content_for_run)
 
-    all_events, errors = await _run_agent_and_collect_events(run_coro, events_collection_ref)
+    all_events, errors = await _run_agent_and_collect_events(run_coro, events_collection_ref, attempt_id, metrics, compact_event_log)
     final_parts = _find_final_response_from_events(all_events)
-    return {"finalParts": final_parts, "errorDetails": errors}
-
-
-async def _run_vertex_agent(resource_name, adk_content_for_run, adk_user_id, events_collection_ref):
-    """Runs a deployed Vertex AI Reasoning Engine."""
-    remote_app = agent_engines.get(resource_name)
+    return {"finalParts": final_parts, "errorDetails": errors, "sessionId": session.id}
+
+
+def _get_remote_app(resource_name: str):
+    """Returns the deployed agent handle, fetched once per resource name per process."""
+    return get_or_create(f"agent_engine:{resource_name}", lambda: agent_engines.get(resource_name))
+
+
+async def _run_vertex_agent(resource_name, adk_content_for_run, adk_user_id, events_collection_ref, attempt_id, session_id=None,
+                            metrics: RunMetrics | None = None, compact_event_log: bool = False):
+    """
+    Runs a deployed Vertex AI Reasoning Engine. With session_id, the turn continues that remote session and
+    adk_content_for_run only needs the new messages; without it, a session is created and its id is returned
+    as "sessionId" so the caller can reuse it for the next turn.
+    """
+    metrics = metrics or RunMetrics()
+    with metrics.phase("sessionSetupMs"):
+        remote_app = _get_remote_app(resource_name)
+        if not session_id:
+            created_session = await asyncio.to_thread(remote_app.create_session, user_id=adk_user_id)
+            session_id = created_session.get("id") if isinstance(created_session, dict) else getattr(created_session, "id", None)
     message_text_for_vertex = "\n".join([p.text for p in adk_content_for_run.parts if hasattr(p, 'text') and p.text])
     if not message_text_for_vertex: # Handle image-only case
         image_count = sum(1 for p in adk_content_for_run.parts if hasattr(p, 'file_data'))
         if image_count > 0: message_text_for_vertex = f"[Image Content Provided ({image_count})]"
 
-    run_coro = remote_app.stream_query(message=message_text_for_vertex, user_id=adk_user_id)
-    all_events, errors = await _run_agent_and_collect_events(run_coro, events_collection_ref)
+    run_coro = remote_app.stream_query(message=message_text_for_vertex, user_id=adk_user_id, session_id=session_id)
+    all_events, errors = await _run_agent_and_collect_events(run_coro, events_collection_ref, attempt_id, metrics, compact_event_log)
     final_parts = _find_final_response_from_events(all_events)
-    return {"finalParts": final_parts, "errorDetails": errors}
+    return {"finalParts": final_parts, "errorDetails": errors, "sessionId": session_id}
 
 
-async def _run_a2a_agent(participant_config, adk_content_for_run, events_collection_ref):
-    """Runs an A2A agent (unary)."""
+async def _run_a2a_agent(participant_config, adk_content_for_run, events_collection_ref, attempt_id, metrics: RunMetrics | None = None):
+    """Runs an A2A agent (unary). The single request/response round trip is timed as agentRunMs."""
+    metrics = metrics or RunMetrics()
     endpoint_url = participant_config.get("endpointUrl")
     if not endpoint_url: raise ValueError("A2A agent config is missing 'endpointUrl'.")
 
@@ -99,12 +236,13 @@ async def _run_a2a_agent(participant_config, adk_content_for_run, events_collect
     async with httpx.AsyncClient(timeout=120.0) as client:
         try:
             rpc_payload = {"jsonrpc": "2.0", "method": "message/send", "id": str(uuid.uuid4()), "params": {"message": a2a_message.model_dump(exclude_none=True)}}
-            response = await client.post(endpoint_url.rstrip('/'), json=rpc_payload)
+            with metrics.phase("agentRunMs"):
+                response = await client.post(endpoint_url.rstrip('/'), json=rpc_payload, headers=inject_trace_context())
             response.raise_for_status()
             rpc_response = response.json()
 
             if task_result := rpc_response.get("result"):
-                events_collection_ref.document().set({"type": "a2a_unary_result", "result": task_result, "eventIndex": 0, "timestamp": firestore.SERVER_TIMESTAMP})
+                events_collection_ref.document(event_document_id(attempt_id, 0)).set({"type": "a2a_unary_result", "result": task_result, "eventIndex": 0, "attemptId": attempt_id, "timestamp": firestore.SERVER_TIMESTAMP})
                 final_text = "".join(part.get("text", "") or part.get("text-delta", "") for artifact in task_result.get("artifacts", []) for part in artifact.get("parts", []))
                 if final_text: final_parts.append({"text": final_text})
             elif error := rpc_response.get("error"):
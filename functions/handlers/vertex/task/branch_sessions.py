@@ -0,0 +1,65 @@
+# functions/handlers/vertex/task/branch_sessions.py
+from firebase_admin import firestore
+
+from common.core import db, logger
+
+# chats/{chatId}/agentSessions/{participant}:{headMessageId} maps the tip of a chat branch to the agent
+# session that has seen exactly the conversation up to that message. A session is handed on to the next
+# assistant message on the same branch; forking from an earlier point finds the session already moved on
+# and starts a fresh one, so a session never mixes turns from two branches.
+SESSIONS_SUBCOLLECTION = "agentSessions"
+
+
+def _session_ref(chat_id: str, participant: str, head_message_id: str):
+    return db.collection("chats").document(chat_id).collection(SESSIONS_SUBCOLLECTION).document(f"{participant}:{head_message_id}")
+
+
+def claim_branch_session(chat_id: str, participant: str, history: list[dict], assistant_message_id: str,
+                         match: dict) -> tuple[dict | None, list[dict]]:
+    """
+    Looks for a reusable session for this branch: the one left by the participant's previous turn on the
+    same branch, provided its fields equal those in match (e.g. kind, userId, the deployed resource). If found, it is handed on to assistant_message_id and (session, new_messages) is returned,
+    where new_messages are the history entries after that turn. Otherwise returns (None, history).
+    A retried attempt finds its session already handed on and gets (None, history): the earlier attempt
+    may have left a partial turn in it, so the retry starts clean and re-registers.
+    """
+    previous_index = next((i for i in range(len(history) - 1, -1, -1) if history[i].get("participant") == participant), None)
+    if previous_index is None or not history[previous_index].get("id"):
+        return None, history
+    next_ref = _session_ref(chat_id, participant, assistant_message_id)
+    previous_ref = _session_ref(chat_id, participant, history[previous_index]["id"])
+    transaction = db.transaction()
+
+    @firestore.transactional
+    def _hand_on(transaction):
+        snapshot = previous_ref.get(transaction=transaction)
+        session = snapshot.to_dict() if snapshot.exists else None
+        if not session or session.get("advancedTo") or any(session.get(k) != v for k, v in match.items()):
+            return None
+        transaction.update(previous_ref, {"advancedTo": assistant_message_id})
+        transaction.set(next_ref, {**session, "headMessageId": assistant_message_id, "turns": session.get("turns", 1) + 1,
+                                    "updatedAt": firestore.SERVER_TIMESTAMP})
+        return session
+
+    session = _hand_on(transaction)
+    if session is None:
+        logger.info(f"No reusable session for {participant} on this branch of chat {chat_id}; starting a new one.")
+        return None, history
+    logger.info(f"Resuming session {session.get('sessionId')} for {participant}; sending {len(history) - previous_index - 1} new messages.")
+    return session, history[previous_index + 1:]
+
+
+def register_branch_session(chat_id: str, participant: str, session_id: str, assistant_message_id: str, fields: dict):
+    """Records a newly created session as the one holding the branch up to assistant_message_id."""
+    _session_ref(chat_id, participant, assistant_message_id).set({
+        **fields,
+        "participant": participant,
+        "sessionId": session_id,
+        "headMessageId": assistant_message_id,
+        "turns": 1,
+        "createdAt": firestore.SERVER_TIMESTAMP,
+        "updatedAt": firestore.SERVER_TIMESTAMP,
+    })
+
+
+__all__ = ['claim_branch_session', 'register_branch_session']
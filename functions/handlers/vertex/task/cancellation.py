@@ -0,0 +1,43 @@
+# functions/handlers/vertex/task/cancellation.py
+import asyncio
+
+from common.core import logger
+from common.event_log import download_event_log
+
+
+def watch_for_cancellation(assistant_message_ref, run_task: asyncio.Task) -> tuple:
+    """
+    Listens to the assistant message and cancels run_task as soon as cancelRequested is set on it.
+    Returns (watch, cancel_state); call watch.unsubscribe() once the run is over. cancel_state["requested"]
+    tells a user cancellation apart from any other cancellation of the task (e.g. an inline-run timeout).
+    """
+    loop = asyncio.get_running_loop()
+    cancel_state = {"requested": False}
+
+    def _on_snapshot(doc_snapshots, changes, read_time):
+        # Runs on the listener's thread, so the task is cancelled through the event loop.
+        for doc_snapshot in doc_snapshots:
+            if (doc_snapshot.to_dict() or {}).get("cancelRequested") and not cancel_state["requested"]:
+                cancel_state["requested"] = True
+                logger.info(f"Cancellation requested for message {assistant_message_ref.id}.")
+                loop.call_soon_threadsafe(run_task.cancel)
+
+    return assistant_message_ref.on_snapshot(_on_snapshot), cancel_state
+
+
+def load_partial_events(events_collection_ref, attempt_id: str, event_log: dict | None = None) -> list:
+    """
+    Returns the events the given attempt persisted before it was cancelled, in order. When the attempt
+    wrote a compacted log (the message's eventLog), the full log is read back, since the Firestore index
+    truncates long text.
+    """
+    if event_log and event_log.get("uri") and event_log.get("attemptId") == attempt_id:
+        try:
+            return download_event_log(event_log["uri"])
+        except Exception as e:
+            logger.warn(f"Could not read the full event log {event_log['uri']}; using the indexed events: {e}")
+    event_docs = events_collection_ref.where("attemptId", "==", attempt_id).stream()
+    return sorted((doc.to_dict() for doc in event_docs), key=lambda event: event.get("eventIndex", 0))
+
+
+__all__ = ['watch_for_cancellation', 'load_partial_events']
@@ -0,0 +1,63 @@
+# functions/handlers/vertex/task/checkpoints.py
+from firebase_admin import firestore
+
+from common.core import db, logger
+
+
+def begin_run_attempt(assistant_message_ref, running_update: dict, handoff_attempt_id: str | None = None) -> str | None:
+    """
+    Records a new run attempt on the assistant message and marks it running.
+    handoff_attempt_id continues an attempt an inline run handed to the task queue instead of starting a new one;
+    the handoff is consumed, so a later redelivery of the same task starts a new attempt as usual.
+    Returns the attempt ID, or None if the run already finished (e.g. a duplicate task delivery) or was cancelled.
+    """
+    transaction = db.transaction()
+
+    @firestore.transactional
+    def _begin(transaction):
+        message = assistant_message_ref.get(transaction=transaction).to_dict() or {}
+        if message.get("status") in ("completed", "cancelled"):
+            return None
+        if message.get("cancelRequested"):
+            transaction.update(assistant_message_ref, {"status": "cancelled", "completedTimestamp": firestore.SERVER_TIMESTAMP})
+            return None
+        if handoff_attempt_id and message.get("handoffAttemptId") == handoff_attempt_id:
+            transaction.update(assistant_message_ref, {**running_update, "handoffAttemptId": firestore.DELETE_FIELD})
+            return handoff_attempt_id
+        attempt_number = (message.get("runAttempts") or 0) + 1
+        attempt_id = f"attempt-{attempt_number:02d}"
+        transaction.update(assistant_message_ref, {**running_update, "runAttempts": attempt_number, "runAttemptId": attempt_id})
+        return attempt_id
+
+    return _begin(transaction)
+
+
+def clear_superseded_events(events_collection_ref, attempt_id: str | None):
+    """
+    Deletes events written by earlier attempts so the message only shows the current attempt's log.
+    With attempt_id None every event is deleted (a handed-off attempt restarts its own log).
+    """
+    batch, deleted = db.batch(), 0
+    for event_doc in events_collection_ref.stream():
+        if attempt_id and (event_doc.to_dict() or {}).get("attemptId") == attempt_id:
+            continue
+        batch.delete(event_doc.reference)
+        deleted += 1
+        if deleted % 400 == 0:
+            batch.commit()
+            batch = db.batch()
+    if deleted:
+        batch.commit()
+        logger.info(f"Removed {deleted} superseded events before running {attempt_id or 'the handed-off attempt'}.")
+
+
+def event_document_id(attempt_id: str, event_index: int) -> str:
+    """Deterministic event ID, so re-writing an attempt's events overwrites instead of duplicating them."""
+    return f"{attempt_id}-{event_index:05d}"
+
+
+__all__ = [
+    'begin_run_attempt',
+    'clear_superseded_events',
+    'event_document_id',
+]
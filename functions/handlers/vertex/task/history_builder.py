@@ -1,14 +1,17 @@
 # functions/handlers/vertex/task/history_builder.py
-from google.cloud import storage
 from google.genai.types import Content, Part
 from common.core import db, logger
+from common.clients import get_storage_client
+from common.image_processing import downscale_image_if_needed
+from common.retrieval import DEFAULT_TOP_K, select_relevant_chunks
+from common.agents.prompt_cache import mark_stable_prefix
 
 
 async def get_full_message_history(chat_id: str, leaf_message_id: str | None) -> list[dict]:
     """Reconstructs the conversation history leading up to a specific message."""
     if not leaf_message_id: return []
     messages_collection = db.collection("chats").document(chat_id).collection("messages")
-    all_docs = {doc.id: doc.to_dict() for doc in messages_collection.stream()}
+    all_docs = {doc.id: {**doc.to_dict(), "id": doc.id} for doc in messages_collection.stream()}
     history = []
     current_id = leaf_message_id
     while current_id and current_id in all_docs:
@@ -18,12 +21,79 @@ async def get_full_message_history(chat_id: str, leaf_message_id: str | None) ->
     return history
 
 
-async def _build_adk_content_from_history(conversation_history: list[dict]) -> tuple[Content, int]:
-    """Constructs a multi-part ADK Content object from the conversation history."""
-    adk_parts, total_char_count = [], 0
-    storage_client = storage.Client()
+def _get_latest_user_text(conversation_history: list[dict]) -> str:
+    """Returns the text of the most recent user message, used as the query for retrieval-mode contexts."""
+    for message in reversed(conversation_history):
+        if message.get("participant", "").startswith("user:"):
+            texts = [p.get("text", "") for p in message.get("parts", []) if "text" in p]
+            if any(texts):
+                return "\n".join(texts).strip()
+    return ""
+
+
+def _with_carried_retrieval_contexts(full_history: list[dict], new_history: list[dict]) -> list[dict]:
+    """
+    A resumed session only receives the new messages, so the excerpts a retrieval-mode context contributed
+    were chosen for an earlier question. Earlier retrieval parts are carried into the new turn, stripped of
+    everything else, so _build_adk_content_from_history selects excerpts again for the latest query.
+    """
+    if not _get_latest_user_text(new_history):
+        return new_history  # Without a query, carried contexts would be re-sent whole.
+    earlier_messages = full_history[:len(full_history) - len(new_history)]
+    carried = []
+    for message in earlier_messages:
+        retrieval_parts = [part for part in message.get("parts", []) if part.get("retrieval") and part.get("file_data")]
+        if retrieval_parts:
+            carried.append({**message, "parts": retrieval_parts})
+    return carried + new_history
+
 
+def _find_pending_ingest_message_ids(conversation_history: list[dict]) -> list[str]:
+    """Returns context messages whose background ingestion has not finished; their parts are still empty."""
+    return [message.get("id") for message in conversation_history
+            if (message.get("ingestJob") or {}).get("status") in ("queued", "running", "retrying")]
+
+
+def _count_history_chars(conversation_history: list[dict]) -> int:
+    """Counts message text the same way _build_adk_content_from_history does, without loading any files."""
+    total_char_count = 0
     for message in conversation_history:
+        message_texts = [p.get("text", "") for p in message.get("parts", []) if "text" in p]
+        total_char_count += len("\n".join(message_texts).strip())
+    return total_char_count
+
+
+def _build_retrieved_excerpt_text(storage_client, role: str, blob_name: str, text_content: str, retrieval: dict, query: str) -> str:
+    """Selects only the top-k chunks of a large context that are relevant to the query."""
+    index_uri = retrieval.get("index_uri", "")
+    try:
+        index_bucket, index_blob = index_uri.split('/', 3)[2:]
+        index_bytes = storage_client.bucket(index_bucket).blob(index_blob).download_as_bytes()
+        chunks = select_relevant_chunks(text_content, index_bytes, query, top_k=retrieval.get("top_k") or DEFAULT_TOP_K)
+    except Exception as e:
+        logger.warn(f"Retrieval failed for '{blob_name}' using index {index_uri}, including full content: {e}")
+        return f"{role} uploaded file '{blob_name}':\n{text_content}"
+    logger.info(f"Retrieved {len(chunks)} of {retrieval.get('chunk_count', '?')} chunks from '{blob_name}'.")
+    excerpts = "\n[...]\n".join(chunks)
+    return f"{role} uploaded file '{blob_name}' (showing {len(chunks)} most relevant excerpts of {retrieval.get('chunk_count', '?')}):\n{excerpts}"
+
+
+async def _build_adk_content_from_history(conversation_history: list[dict], max_image_dimension: int | None = None) -> tuple[Content, int]:
+    """
+    Constructs a multi-part ADK Content object from the conversation history.
+    Images larger than max_image_dimension (the target provider's limit) are downscaled before sending.
+    The parts before the latest user message (earlier turns and pinned context) are marked as the stable
+    prefix for provider prompt caching.
+    """
+    adk_parts, total_char_count = [], 0
+    storage_client = get_storage_client()
+    retrieval_query = _get_latest_user_text(conversation_history)
+    latest_user_index = next((i for i in range(len(conversation_history) - 1, -1, -1)
+                              if conversation_history[i].get("participant", "").startswith("user:")), None)
+
+    for index, message in enumerate(conversation_history):
+        if index == latest_user_index:
+            mark_stable_prefix(len(adk_parts))
         role = "model" if message.get("participant", "").startswith("assistant:") else "user"
         message_texts = [p.get("text", "") for p in message.get("parts", []) if "text" in p]
         if message_texts:
@@ -41,10 +111,18 @@ async def _build_adk_content_from_history(conversation_history: list[dict]) -> t
                     blob = storage_client.bucket(bucket_name).blob(blob_name)
                     if mime_type.startswith("image/"):
                         image_bytes = blob.download_as_bytes()
+                        if max_image_dimension:
+                            image_bytes, mime_type = downscale_image_if_needed(image_bytes, mime_type, max_image_dimension)
                         adk_parts.append(Part.from_bytes(data=image_bytes, mime_type=mime_type))
                     elif mime_type.startswith("text/"):
                         text_content = blob.download_as_text()
-                        adk_parts.append(Part.from_text(text=f"{role} uploaded file '{blob_name}':\n{text_content}"))
+                        retrieval = part_data.get("retrieval")
+                        if retrieval and retrieval_query:
+                            adk_parts.append(Part.from_text(text=_build_retrieved_excerpt_text(
+                                storage_client, role, blob_name, text_content, retrieval, retrieval_query
+                            )))
+                        else:
+                            adk_parts.append(Part.from_text(text=f"{role} uploaded file '{blob_name}':\n{text_content}"))
                     else:
                         adk_parts.append(Part.from_uri(file_uri=uri, mime_type=mime_type))
                 except Exception as e:
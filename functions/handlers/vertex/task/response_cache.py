@@ -0,0 +1,138 @@
+# functions/handlers/vertex/task/response_cache.py
+import asyncio
+import datetime
+import hashlib
+import json
+from firebase_admin import firestore
+from google.adk.models import LlmResponse
+
+from common.core import db, logger
+
+# responseCache/{key} stores one model response per request hash. Entries carry an expiresAt timestamp:
+# reads ignore expired entries, and a Firestore TTL policy on expiresAt deletes them.
+CACHE_COLLECTION = "responseCache"
+DEFAULT_TTL_HOURS = 24
+# Firestore caps documents at 1 MiB; larger responses are not cached.
+MAX_CACHED_RESPONSE_BYTES = 900_000
+
+
+def response_cache_key(llm_request, api_base: str | None = None) -> str:
+    """
+    Hashes everything that determines a deterministic reply: the resolved model string (and API base, which
+    selects the deployment for self-hosted providers), the generation config including the system
+    instruction, and the compiled history ADK is about to send.
+    """
+    config = llm_request.config.model_dump(mode="json", exclude_none=True) if llm_request.config else {}
+    canonical = json.dumps({
+        "model": llm_request.model,
+        "apiBase": api_base,
+        "config": config,
+        "contents": [content.model_dump(mode="json", exclude_none=True) for content in llm_request.contents],
+    }, sort_keys=True, default=str)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+def _bypass_reason(llm_request) -> str | None:
+    config = llm_request.config
+    if llm_request.tools_dict or (config and config.tools):
+        return "tools"
+    temperature = config.temperature if config else None
+    if temperature is None:
+        return "temperature not set"
+    if temperature > 0:
+        return "temperature > 0"
+    return None
+
+
+def attach_response_cache(root_agent, ttl_hours: float = DEFAULT_TTL_HOURS) -> dict:
+    """
+    Installs model callbacks on every LlmAgent in the tree that serve repeated requests from the cache.
+    Requests with tools or a non-zero (or unset) temperature always go to the model. The callbacks are async
+    and do their Firestore reads and writes in a worker thread, so a cache lookup never blocks the event loop.
+    Returns the run's cache state; pass it to summarize_response_cache once the run has finished.
+    """
+    cache_ref = db.collection(CACHE_COLLECTION)
+    state = {"hits": 0, "misses": 0, "bypassed": 0, "bypassReason": None}
+    pending_keys, api_bases = {}, {}
+
+    async def before_model(callback_context, llm_request):
+        reason = _bypass_reason(llm_request)
+        if reason:
+            state["bypassed"] += 1
+            state["bypassReason"] = reason
+            return None
+        key = response_cache_key(llm_request, api_bases.get(callback_context.agent_name))
+        try:
+            entry = (await asyncio.to_thread(cache_ref.document(key).get)).to_dict()
+        except Exception as e:
+            logger.warn(f"Response cache lookup failed; calling the model: {e}")
+            entry = None
+        expires_at = entry.get("expiresAt") if entry else None
+        if entry and expires_at and expires_at > datetime.datetime.now(datetime.timezone.utc):
+            state["hits"] += 1
+            await asyncio.to_thread(cache_ref.document(key).update, {"hits": firestore.Increment(1), "lastHitAt": firestore.SERVER_TIMESTAMP})
+            logger.info(f"Serving agent '{callback_context.agent_name}' from response cache entry {key[:12]}.")
+            # The tokens were spent by the run that filled the entry, not this one.
+            return LlmResponse.model_validate_json(entry["response"]).model_copy(update={"usage_metadata": None})
+        state["misses"] += 1
+        pending_keys[(callback_context.invocation_id, callback_context.agent_name)] = (key, llm_request.model)
+        return None
+
+    async def after_model(callback_context, llm_response):
+        if llm_response.partial or llm_response.error_code or not llm_response.content:
+            return None
+        pending = pending_keys.pop((callback_context.invocation_id, callback_context.agent_name), None)
+        if not pending:
+            return None
+        key, model = pending
+        try:
+            response_json = llm_response.model_dump_json(exclude_none=True)
+            if len(response_json) > MAX_CACHED_RESPONSE_BYTES:
+                logger.info(f"Response for cache entry {key[:12]} is too large to cache.")
+                return None
+            now = datetime.datetime.now(datetime.timezone.utc)
+            await asyncio.to_thread(cache_ref.document(key).set, {
+                "response": response_json, "model": model, "hits": 0,
+                "createdAt": firestore.SERVER_TIMESTAMP, "expiresAt": now + datetime.timedelta(hours=ttl_hours),
+            })
+        except Exception as e:
+            logger.warn(f"Could not store response cache entry {key[:12]}: {e}")
+        return None
+
+    def _attach(agent):
+        if hasattr(agent, "before_model_callback"):
+            if agent.before_model_callback or agent.after_model_callback:
+                logger.warn(f"Agent '{agent.name}' already has model callbacks; not caching its responses.")
+            else:
+                agent.before_model_callback = before_model
+                agent.after_model_callback = after_model
+                api_bases[agent.name] = (getattr(agent.model, "_additional_args", None) or {}).get("api_base")
+        for sub_agent in getattr(agent, "sub_agents", None) or []:
+            _attach(sub_agent)
+
+    _attach(root_agent)
+    return state
+
+
+def summarize_response_cache(state: dict) -> dict:
+    """
+    The cache outcome recorded on the assistant message: "hit" when every model call was served from the
+    cache, "bypassed" when no call was eligible, otherwise "miss".
+    """
+    if state["hits"] and not state["misses"] and not state["bypassed"]:
+        status = "hit"
+    elif state["bypassed"] and not state["hits"] and not state["misses"]:
+        status = "bypassed"
+    else:
+        status = "miss"
+    summary = {"status": status, "hits": state["hits"], "misses": state["misses"], "bypassed": state["bypassed"]}
+    if state["bypassReason"]:
+        summary["bypassReason"] = state["bypassReason"]
+    return summary
+
+
+__all__ = [
+    'attach_response_cache',
+    'summarize_response_cache',
+    'response_cache_key',
+]
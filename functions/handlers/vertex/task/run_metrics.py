@@ -0,0 +1,109 @@
+# functions/handlers/vertex/task/run_metrics.py
+import contextlib
+import time
+from datetime import datetime, timezone
+from firebase_admin import firestore
+
+from common.core import db, logger
+from common.tracing import span
+
+# runMetricsDaily/{yyyy-mm-dd}_{participant} accumulates counters and latency histograms per agent/model per
+# UTC day. Sums give averages; p50/p95 are read off the cumulative bucket counts.
+DAILY_COLLECTION = "runMetricsDaily"
+# Upper bounds (ms) of the latency histogram buckets; bucket "le_inf" catches the rest.
+LATENCY_BUCKETS_MS = [250, 500, 1_000, 2_000, 4_000, 8_000, 15_000, 30_000, 60_000, 120_000, 300_000]
+HISTOGRAM_FIELDS = ["totalMs", "firstEventMs", "queueWaitMs"]
+USAGE_FIELDS = {
+    "prompt_token_count": "promptTokens",
+    "candidates_token_count": "outputTokens",
+    "thoughts_token_count": "thoughtsTokens",
+    "cached_content_token_count": "cachedTokens",
+    "total_token_count": "totalTokens",
+}
+
+
+class RunMetrics:
+    """Collects phase timings (ms) and counters for one agent run."""
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.values = {}
+
+    @contextlib.contextmanager
+    def phase(self, name: str):
+        """
+        Times the enclosed block and adds it to the phase's total (phases may repeat).
+        The block also runs in a tracing span named after the phase ("historyMs" -> "history").
+        """
+        phase_started = time.monotonic()
+        try:
+            with span(name.removesuffix("Ms")):
+                yield
+        finally:
+            self.add(name, (time.monotonic() - phase_started) * 1000)
+
+    def add(self, name: str, amount):
+        self.values[name] = self.values.get(name, 0) + amount
+
+    def mark_once(self, name: str, since: float):
+        """Records the ms elapsed from since (a time.monotonic() value) unless name is already set."""
+        if name not in self.values:
+            self.values[name] = (time.monotonic() - since) * 1000
+
+    def add_event_stats(self, all_events: list):
+        """Adds token usage, model/tool call counts and tool time derived from the collected event dicts."""
+        call_timestamps = {}
+        for event in all_events:
+            if event.get("partial"):
+                continue
+            if usage := event.get("usage_metadata"):
+                self.add("modelCalls", 1)
+                for source_key, metric_key in USAGE_FIELDS.items():
+                    if usage.get(source_key):
+                        self.add(metric_key, usage[source_key])
+            parts = (event.get("content") or {}).get("parts") or []
+            response_wait_ms = 0
+            for part in parts:
+                if call := part.get("function_call"):
+                    call_timestamps[call.get("id")] = event.get("timestamp")
+                elif response := part.get("function_response"):
+                    self.add("toolCalls", 1)
+                    called_at, responded_at = call_timestamps.get(response.get("id")), event.get("timestamp")
+                    if isinstance(called_at, (int, float)) and isinstance(responded_at, (int, float)):
+                        # Parallel calls answered in one event overlap, so count the slowest once.
+                        response_wait_ms = max(response_wait_ms, (responded_at - called_at) * 1000)
+            if response_wait_ms:
+                self.add("toolMs", response_wait_ms)
+
+    def to_dict(self) -> dict:
+        """The compact map written to the message: ms rounded to integers, totalMs measured up to now."""
+        metrics = {name: int(round(value)) for name, value in self.values.items() if value is not None}
+        metrics["totalMs"] = int((time.monotonic() - self.started) * 1000)
+        return metrics
+
+
+def _latency_bucket(ms: int) -> str:
+    return next((f"le_{bound}" for bound in LATENCY_BUCKETS_MS if ms <= bound), "le_inf")
+
+
+def record_daily_run_metrics(participant: str | None, status: str, metrics: dict):
+    """Folds one run's metrics into the participant's daily aggregate. Failures are logged, never raised."""
+    if not participant:
+        return
+    try:
+        day = datetime.now(timezone.utc).strftime("%Y-%m-%d")
+        aggregate = {
+            "participant": participant, "date": day,
+            "runs": firestore.Increment(1),
+            "statusCounts": {status: firestore.Increment(1)},
+            "sums": {name: firestore.Increment(value) for name, value in metrics.items()},
+            "histograms": {name: {_latency_bucket(metrics[name]): firestore.Increment(1)}
+                           for name in HISTOGRAM_FIELDS if metrics.get(name) is not None},
+            "updatedAt": firestore.SERVER_TIMESTAMP,
+        }
+        db.collection(DAILY_COLLECTION).document(f"{day}_{participant.replace('/', '_')}").set(aggregate, merge=True)
+    except Exception as e:
+        logger.warn(f"Could not record daily run metrics for {participant}: {e}")
+
+
+__all__ = ['RunMetrics', 'record_daily_run_metrics', 'LATENCY_BUCKETS_MS']
@@ -1,11 +1,12 @@
 # functions/handlers/vertex_agent_handler.py
 
-from .vertex.orchestrator import query_deployed_agent_orchestrator_logic
+from .vertex.orchestrator import query_deployed_agent_orchestrator_logic, _cancel_agent_run_logic
 from .vertex.admin import _deploy_agent_to_vertex_logic, _delete_vertex_agent_logic, _check_vertex_agent_deployment_status_logic
 
 __all__ = [
     '_deploy_agent_to_vertex_logic',
     '_delete_vertex_agent_logic',
     'query_deployed_agent_orchestrator_logic',
+    '_cancel_agent_run_logic',
     '_check_vertex_agent_deployment_status_logic'
 ]
\ No newline at end of file
@@ -7,22 +7,11 @@ from firebase_functions.options import RateLimits, RetryConfig
 from common.utils import handle_exceptions_and_log
 import asyncio
 
-from handlers.vertex_agent_handler import (
-    _deploy_agent_to_vertex_logic,
-    _delete_vertex_agent_logic,
-    query_deployed_agent_orchestrator_logic as _execute_query_logic,
-    _check_vertex_agent_deployment_status_logic
-)
-
-from handlers.vertex.task import run_agent_task_wrapper
-from handlers.context_handler import (
-    _fetch_web_page_content_logic,
-    _fetch_git_repo_contents_logic,
-    _process_pdf_content_logic,
-    _upload_image_and_get_uri_logic
-)
-from handlers.mcp_handler import _list_mcp_server_tools_logic_async
-from handlers.a2a_handler import _fetch_a2a_agent_card_logic_async
+# Handler modules are imported inside each function on first call rather than here. Every function
+# instance loads this file, so a module-level import would make lightweight functions such as
+# fetchA2AAgentCard pay for google.adk, vertexai, litellm, pypdf and numpy on every cold start.
+# Python caches the modules, so only the first call on an instance pays for its own dependencies.
+# See .github/scripts/profile_function_imports.py for the per-function import profile.
 
 # --- Cloud Function Definitions ---
 
@@ -31,6 +20,7 @@ from handlers.a2a_handler import _fetch_a2a_agent_card_logic_async
 def deploy_agent_to_vertex(req: https_fn.CallableRequest):
     if not req.auth:
         raise https_fn.HttpsError(code=https_fn.FunctionsErrorCode.UNAUTHENTICATED, message="Authentication required to deploy agents.")
+    from handlers.vertex.admin import _deploy_agent_to_vertex_logic
     return _deploy_agent_to_vertex_logic(req)
 
 
@@ -39,6 +29,7 @@ def deploy_agent_to_vertex(req: https_fn.CallableRequest):
 def delete_vertex_agent(req: https_fn.CallableRequest):
     if not req.auth:
         raise https_fn.HttpsError(code=https_fn.FunctionsErrorCode.UNAUTHENTICATED, message="Authentication required to delete agent deployments.")
+    from handlers.vertex.admin import _delete_vertex_agent_logic
     return _delete_vertex_agent_logic(req)
 
 
@@ -47,45 +38,92 @@ def delete_vertex_agent(req: https_fn.CallableRequest):
 def executeQuery(req: https_fn.CallableRequest): # Renamed from query_deployed_agent
     if not req.auth:
         raise https_fn.HttpsError(code=https_fn.FunctionsErrorCode.UNAUTHENTICATED, message="Authentication required to query.")
+    from handlers.vertex.orchestrator import query_deployed_agent_orchestrator_logic as _execute_query_logic
     return _execute_query_logic(req)
 
 
+@https_fn.on_call(memory=options.MemoryOption.MB_512, timeout_sec=60)
+@handle_exceptions_and_log
+def cancelAgentRun(req: https_fn.CallableRequest):
+    if not req.auth:
+        raise https_fn.HttpsError(code=https_fn.FunctionsErrorCode.UNAUTHENTICATED, message="Authentication required to cancel a run.")
+    from handlers.vertex.orchestrator import _cancel_agent_run_logic
+    return _cancel_agent_run_logic(req)
+
+
+@https_fn.on_call(memory=options.MemoryOption.MB_512, timeout_sec=60)
+@handle_exceptions_and_log
+def getEventLog(req: https_fn.CallableRequest):
+    if not req.auth:
+        raise https_fn.HttpsError(code=https_fn.FunctionsErrorCode.UNAUTHENTICATED, message="Authentication required to read an event log.")
+    from handlers.vertex.orchestrator import _get_event_log_logic
+    return _get_event_log_logic(req)
+
+
 @https_fn.on_call(memory=options.MemoryOption.GB_1)
 @handle_exceptions_and_log
 def check_vertex_agent_deployment_status(req: https_fn.CallableRequest):
     if not req.auth:
         raise https_fn.HttpsError(code=https_fn.FunctionsErrorCode.UNAUTHENTICATED, message="Authentication required to check agent status.")
+    from handlers.vertex.admin import _check_vertex_agent_deployment_status_logic
     return _check_vertex_agent_deployment_status_logic(req)
 
 @https_fn.on_call(memory=options.MemoryOption.GB_1, timeout_sec=60)
 @handle_exceptions_and_log
 def fetch_web_page_content(req: https_fn.CallableRequest):
+    from handlers.context_handler import _fetch_web_page_content_logic
     return _fetch_web_page_content_logic(req)
 
 @https_fn.on_call(memory=options.MemoryOption.GB_1, timeout_sec=300)
 @handle_exceptions_and_log
 def fetch_git_repo_contents(req: https_fn.CallableRequest):
+    from handlers.context_handler import _fetch_git_repo_contents_logic
     return _fetch_git_repo_contents_logic(req)
 
 @https_fn.on_call(memory=options.MemoryOption.GB_1, timeout_sec=120)
 @handle_exceptions_and_log
 def process_pdf_content(req: https_fn.CallableRequest):
+    from handlers.context_handler import _process_pdf_content_logic
     return _process_pdf_content_logic(req)
 
 @https_fn.on_call(memory=options.MemoryOption.GB_1, timeout_sec=120)
 @handle_exceptions_and_log
 def uploadImageForContext(req: https_fn.CallableRequest):
     # This now returns an object with a 'type' key to be consistent
+    from handlers.context_handler import _upload_image_and_get_uri_logic
     return _upload_image_and_get_uri_logic(req)
 
+@https_fn.on_call(memory=options.MemoryOption.MB_512, timeout_sec=60)
+@handle_exceptions_and_log
+def createContextUploadUrl(req: https_fn.CallableRequest):
+    # Step 1 of the direct upload flow: the browser PUTs the file to the returned signed URL
+    from handlers.context_handler import _create_signed_upload_url_logic
+    return _create_signed_upload_url_logic(req)
+
+@https_fn.on_call(memory=options.MemoryOption.GB_1, timeout_sec=300)
+@handle_exceptions_and_log
+def finalizeContextUpload(req: https_fn.CallableRequest):
+    # Step 2 of the direct upload flow: processes the uploaded object from GCS
+    from handlers.context_handler import _finalize_context_upload_logic
+    return _finalize_context_upload_logic(req)
+
+@https_fn.on_call(memory=options.MemoryOption.GB_2, timeout_sec=300)
+@handle_exceptions_and_log
+def ingestContextSources(req: https_fn.CallableRequest):
+    # Bulk variant of the context callables above: one call, one Firestore batch
+    from handlers.context_handler import _ingest_context_sources_logic
+    return _ingest_context_sources_logic(req)
+
 @https_fn.on_call(memory=options.MemoryOption.GB_1, timeout_sec=120)
 @handle_exceptions_and_log
 def list_mcp_server_tools(req: https_fn.CallableRequest):
+    from handlers.mcp_handler import _list_mcp_server_tools_logic_async
     return asyncio.run(_list_mcp_server_tools_logic_async(req))
 
 @https_fn.on_call(memory=options.MemoryOption.GB_1, timeout_sec=60)
 @handle_exceptions_and_log
 def fetchA2AAgentCard(req: https_fn.CallableRequest):
+    from handlers.a2a_handler import _fetch_a2a_agent_card_logic_async
     return asyncio.run(_fetch_a2a_agent_card_logic_async(req))
 
 # Task handler for executing queries in the background
@@ -98,4 +136,19 @@ def fetchA2AAgentCard(req: https_fn.CallableRequest):
 )
 def executeAgentRunTask(req: tasks_fn.CallableRequest):
     """Background worker function triggered by Cloud Tasks."""
-    run_agent_task_wrapper(req.data)
\ No newline at end of file
+    from handlers.vertex.task import run_agent_task_wrapper
+    run_agent_task_wrapper(req.data)
+
+# Task handler for long-running context ingestion (git repos, large PDFs)
+@tasks_fn.on_task_dispatched(
+    rate_limits=RateLimits(max_concurrent_dispatches=10),
+    retry_config=RetryConfig(max_attempts=3, min_backoff_seconds=10),
+    timeout_sec=540,
+    memory=options.MemoryOption.GB_2,
+    cpu=1
+)
+def executeContextIngestTask(req: tasks_fn.CallableRequest):
+    """Background worker that fills in a placeholder context message."""
+    from handlers.context_handler import run_context_ingest_task
+    from common.tasks import get_task_retry_count
+    run_context_ingest_task(req.data, retry_count=get_task_retry_count(req))
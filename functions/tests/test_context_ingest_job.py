@@ -0,0 +1,184 @@
+# functions/tests/test_context_ingest_job.py
+"""
+Background context ingestion moves a placeholder message through queued -> running -> retrying/completed/error
+across Cloud Tasks attempts. These tests drive run_context_ingest_task the way the task queue would, with the
+X-CloudTasks-TaskRetryCount value passed in as retry_count.
+
+    cd functions && python -m pytest tests
+"""
+import os
+import sys
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+
+FUNCTIONS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, FUNCTIONS_DIR)
+
+from benchmarks.fakes import install_fakes  # noqa: E402  Must run before anything imports common.core.
+
+db, storage_client = install_fakes(fake_llm=False)
+
+from common import config  # noqa: E402
+from common.tasks import get_task_retry_count  # noqa: E402
+from firebase_functions import https_fn  # noqa: E402
+from handlers import context_handler  # noqa: E402
+from handlers.vertex.task.history_builder import _find_pending_ingest_message_ids  # noqa: E402
+
+CHAT_ID = "ingest-chat"
+USER_ID = "ingest-user"
+
+
+@pytest.fixture(autouse=True)
+def task_queue(monkeypatch):
+    monkeypatch.setattr(config, "get_gcp_project_config", lambda: ("proj", "us-central1", "gs://proj-bucket"))
+    enqueued = []
+    monkeypatch.setattr(context_handler, "enqueue_function_task", lambda name, payload: enqueued.append(payload))
+    return enqueued
+
+
+def _enqueue_git_job(task_queue) -> dict:
+    context_handler._enqueue_context_ingest_job(USER_ID, "gitrepo", {
+        "chatId": CHAT_ID, "parentMessageId": None, "background": True,
+        "orgUser": "octo", "repoName": "repo", "gitToken": "ghp_secret",
+    })
+    return task_queue[-1]
+
+
+def _job(payload: dict) -> dict:
+    return db.collection("chats").document(CHAT_ID).collection("messages").document(payload["messageId"]).get().to_dict()["ingestJob"]
+
+
+def _secret_exists(payload: dict) -> bool:
+    return db.collection(context_handler.INGEST_SECRETS_COLLECTION).document(payload["messageId"]).get().exists
+
+
+def _ingest_result():
+    upload_result = {"storageUrl": "gs://proj-context-uploads/users/u/files/repo.txt", "mimeType": "text/plain"}
+    return upload_result, {"type": "text", "value": "repo"}, {}
+
+
+def test_enqueue_keeps_the_git_token_out_of_the_task_payload(task_queue):
+    payload = _enqueue_git_job(task_queue)
+
+    assert "gitToken" not in payload["params"]
+    assert _secret_exists(payload)
+    assert _job(payload)["status"] == "queued"
+
+
+def test_retryable_failure_before_the_last_attempt_is_left_for_cloud_tasks(task_queue, monkeypatch):
+    payload = _enqueue_git_job(task_queue)
+    monkeypatch.setattr(context_handler, "_ingest_git_repo", lambda *args, **kwargs: (_ for _ in ()).throw(RuntimeError("GitHub 502")))
+
+    with pytest.raises(RuntimeError):
+        context_handler.run_context_ingest_task(payload, retry_count=0)
+
+    job = _job(payload)
+    assert (job["status"], job["attempts"], job["error"]) == ("retrying", 1, "GitHub 502")
+    assert _secret_exists(payload)
+
+
+def test_failure_on_the_last_attempt_closes_the_job(task_queue, monkeypatch):
+    payload = _enqueue_git_job(task_queue)
+    monkeypatch.setattr(context_handler, "_ingest_git_repo", lambda *args, **kwargs: (_ for _ in ()).throw(RuntimeError("GitHub 502")))
+
+    context_handler.run_context_ingest_task(payload, retry_count=context_handler.MAX_INGEST_ATTEMPTS - 1)
+
+    job = _job(payload)
+    assert (job["status"], job["attempts"]) == ("error", context_handler.MAX_INGEST_ATTEMPTS)
+    assert not _secret_exists(payload)
+
+
+def test_non_retryable_error_closes_the_job_on_the_first_attempt(task_queue, monkeypatch):
+    payload = _enqueue_git_job(task_queue)
+    not_found = https_fn.HttpsError(code=https_fn.FunctionsErrorCode.NOT_FOUND, message="Repository not found.")
+    monkeypatch.setattr(context_handler, "_ingest_git_repo", lambda *args, **kwargs: (_ for _ in ()).throw(not_found))
+
+    context_handler.run_context_ingest_task(payload, retry_count=0)
+
+    assert _job(payload)["status"] == "error"
+
+
+def test_success_fills_the_placeholder_and_uses_the_stored_token(task_queue, monkeypatch):
+    payload = _enqueue_git_job(task_queue)
+    seen_params = {}
+
+    def fake_ingest(user_id, params, **kwargs):
+        seen_params.update(params)
+        return _ingest_result()
+
+    monkeypatch.setattr(context_handler, "_ingest_git_repo", fake_ingest)
+    context_handler.run_context_ingest_task(payload, retry_count=1)
+
+    message = db.collection("chats").document(CHAT_ID).collection("messages").document(payload["messageId"]).get().to_dict()
+    assert message["ingestJob"]["status"] == "completed"
+    assert message["ingestJob"]["attempts"] == 2
+    assert message["parts"][0]["file_data"]["mime_type"] == "text/plain"
+    assert seen_params["gitToken"] == "ghp_secret"
+    assert not _secret_exists(payload)
+
+
+def test_finished_job_is_not_run_again(task_queue, monkeypatch):
+    payload = _enqueue_git_job(task_queue)
+    monkeypatch.setattr(context_handler, "_ingest_git_repo", lambda *args, **kwargs: _ingest_result())
+    context_handler.run_context_ingest_task(payload, retry_count=0)
+
+    monkeypatch.setattr(context_handler, "_ingest_git_repo", lambda *args, **kwargs: pytest.fail("completed job ran again"))
+    context_handler.run_context_ingest_task(payload, retry_count=1)
+
+
+def test_last_attempt_marks_itself_failed_before_the_timeout(task_queue, monkeypatch):
+    payload = _enqueue_git_job(task_queue)
+    monkeypatch.setattr(context_handler, "INGEST_TASK_TIMEOUT_SECONDS", context_handler.INGEST_TIMEOUT_MARGIN_SECONDS + 0.05)
+    status_while_running = {}
+    watchdog_fired = threading.Event()
+
+    def slow_ingest(user_id, params, **kwargs):
+        for _ in range(100):
+            if _job(payload)["status"] == "error":
+                watchdog_fired.set()
+                break
+            time.sleep(0.01)
+        status_while_running.update(_job(payload))
+        return _ingest_result()
+
+    monkeypatch.setattr(context_handler, "_ingest_git_repo", slow_ingest)
+    context_handler.run_context_ingest_task(payload, retry_count=context_handler.MAX_INGEST_ATTEMPTS - 1)
+
+    assert watchdog_fired.is_set()
+    assert "timed out" in status_while_running["error"]
+
+
+def test_earlier_attempts_do_not_arm_the_timeout(task_queue, monkeypatch):
+    payload = _enqueue_git_job(task_queue)
+    monkeypatch.setattr(context_handler, "INGEST_TASK_TIMEOUT_SECONDS", context_handler.INGEST_TIMEOUT_MARGIN_SECONDS + 0.01)
+
+    def slow_ingest(user_id, params, **kwargs):
+        time.sleep(0.1)
+        assert _job(payload)["status"] == "running"
+        return _ingest_result()
+
+    monkeypatch.setattr(context_handler, "_ingest_git_repo", slow_ingest)
+    context_handler.run_context_ingest_task(payload, retry_count=0)
+    assert _job(payload)["status"] == "completed"
+
+
+@pytest.mark.parametrize("headers, expected", [
+    ({"X-CloudTasks-TaskRetryCount": "2"}, 2),
+    ({"X-CloudTasks-TaskRetryCount": "x"}, None),
+    ({}, None),
+])
+def test_retry_count_is_read_from_the_task_header(headers, expected):
+    assert get_task_retry_count(SimpleNamespace(raw_request=SimpleNamespace(headers=headers))) == expected
+
+
+def test_runs_wait_for_unfinished_ingestion_on_their_branch():
+    history = [
+        {"id": "ctx-done", "ingestJob": {"status": "completed"}},
+        {"id": "ctx-failed", "ingestJob": {"status": "error"}},
+        {"id": "ctx-pending", "ingestJob": {"status": "retrying"}},
+        {"id": "question", "participant": "user:u"},
+    ]
+    assert _find_pending_ingest_message_ids(history) == ["ctx-pending"]
@@ -0,0 +1,91 @@
+# functions/tests/test_deployment_pickle.py
+"""
+Deployed agents are pickled with cloudpickle and unpickled by Vertex AI, where only the deployment
+requirements are installed. These tests build agents the way _deploy_agent_to_vertex_logic does and load
+the pickle in a fresh interpreter that cannot import this repo's modules.
+
+    cd functions && python -m pytest tests
+"""
+import asyncio
+import os
+import subprocess
+import sys
+
+import cloudpickle
+import pytest
+
+FUNCTIONS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, FUNCTIONS_DIR)
+
+from benchmarks.fakes import install_fakes  # noqa: E402  Must run before anything imports common.core.
+
+db, _ = install_fakes(fake_llm=False)
+
+from google.adk.models.lite_llm import LiteLlm, LiteLLMClient  # noqa: E402
+from handlers.vertex.admin import _build_agent_for_deployment  # noqa: E402
+
+PRIMARY_MODEL_ID = "deploy-primary"
+FALLBACK_MODEL_ID = "deploy-fallback"
+
+_LOAD_PICKLE = (
+    "import sys, cloudpickle\n"
+    "agent = cloudpickle.loads(sys.stdin.buffer.read())\n"
+    "print(type(agent).__name__, agent.name)\n"
+)
+
+
+@pytest.fixture(autouse=True)
+def model_configs():
+    db.collection("models").document(PRIMARY_MODEL_ID).set({
+        "name": "Primary", "provider": "anthropic", "modelString": "claude-test",
+        "fallbackModelIds": [FALLBACK_MODEL_ID], "parameters": {"temperature": 0.2},
+    })
+    db.collection("models").document(FALLBACK_MODEL_ID).set({"name": "Fallback", "provider": "openai", "modelString": "gpt-test"})
+
+
+def _worker(name: str) -> dict:
+    return {"name": name, "agentType": "Agent", "modelId": PRIMARY_MODEL_ID, "systemInstruction": "Be brief.", "tools": []}
+
+
+def _agent_tree_config() -> dict:
+    return {
+        "name": "deploy_root", "agentType": "SequentialAgent", "description": "Deployment pickling check.",
+        "childAgents": [
+            {"name": "fan_out", "agentType": "ParallelAgent", "description": "Bounded branches.",
+             "maxParallelBranches": 2, "branchTimeoutSeconds": 30, "childAgents": [_worker("a"), _worker("b"), _worker("c")]},
+            {**_worker("refiner"), "agentType": "LoopAgent", "description": "Budgeted loop.", "maxLoops": 2, "maxLoopSeconds": 60},
+        ],
+    }
+
+
+def _llm_agents(agent):
+    if hasattr(agent, "model"):
+        yield agent
+    for sub_agent in getattr(agent, "sub_agents", None) or []:
+        yield from _llm_agents(sub_agent)
+
+
+def _subprocess_env() -> dict:
+    """The current environment minus the functions directory, so `common` and `handlers` cannot be imported."""
+    env = dict(os.environ)
+    paths = [p for p in env.get("PYTHONPATH", "").split(os.pathsep) if p and os.path.abspath(p) != FUNCTIONS_DIR]
+    env["PYTHONPATH"] = os.pathsep.join(paths)
+    return env
+
+
+def test_deployed_models_are_plain_lite_llm():
+    agent = asyncio.run(_build_agent_for_deployment(_agent_tree_config(), "agentdoc"))
+    models = [a.model for a in _llm_agents(agent)]
+    assert models
+    for model in models:
+        assert type(model) is LiteLlm
+        assert type(model.llm_client) is LiteLLMClient
+
+
+def test_deployed_agent_unpickles_without_repo_modules(tmp_path):
+    agent = asyncio.run(_build_agent_for_deployment(_agent_tree_config(), "agentdoc"))
+    pickled = cloudpickle.dumps(agent)
+    result = subprocess.run([sys.executable, "-c", _LOAD_PICKLE], input=pickled, capture_output=True,
+                            cwd=tmp_path, env=_subprocess_env(), timeout=120)
+    assert result.returncode == 0, result.stderr.decode(errors="replace")[-2000:]
+    assert result.stdout.decode().split() == [type(agent).__name__, agent.name]
@@ -0,0 +1,104 @@
+# functions/tests/test_failover_llm.py
+"""
+FailoverLlm sends a request to the agent's own model and falls back to the next endpoint when one raises or
+stays silent; with hedging, a slow primary races a backup and the loser is shut down. These tests use
+in-process models with fixed latencies.
+
+    cd functions && python -m pytest tests
+"""
+import asyncio
+import os
+import sys
+
+import pytest
+
+FUNCTIONS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, FUNCTIONS_DIR)
+
+from benchmarks.fakes import install_fakes  # noqa: E402  Must run before anything imports common.core.
+
+install_fakes(fake_llm=False)
+
+from google.adk.models import BaseLlm, LlmRequest, LlmResponse  # noqa: E402
+from google.genai import types  # noqa: E402
+from common.agents import failover_llm  # noqa: E402
+from common.agents.failover_llm import FailoverLlm  # noqa: E402
+
+# Names of StubLlm generators whose cleanup ran, in order.
+closed = []
+
+
+class StubLlm(BaseLlm):
+    """Replies "<model>-1", "<model>-2" after latency_seconds, or raises error instead."""
+    latency_seconds: float = 0.0
+    error: str | None = None
+
+    async def generate_content_async(self, llm_request, stream: bool = False):
+        try:
+            await asyncio.sleep(self.latency_seconds)
+            if self.error:
+                raise RuntimeError(self.error)
+            for i in (1, 2):
+                yield LlmResponse(content=types.Content(role="model", parts=[types.Part(text=f"{self.model}-{i}")]))
+        finally:
+            closed.append(self.model)
+
+
+@pytest.fixture(autouse=True)
+def fresh_health(monkeypatch):
+    monkeypatch.setattr(failover_llm, "_unhealthy_until", {})
+    monkeypatch.setattr(failover_llm, "_first_response_latencies", {})
+    closed.clear()
+
+
+def _failover(*llms, **kwargs) -> FailoverLlm:
+    return FailoverLlm(model=llms[0].model, candidates=[(llm, None) for llm in llms], **kwargs)
+
+
+def _texts(model: FailoverLlm, on_first=None) -> list[str]:
+    async def collect():
+        texts = []
+        async for response in model.generate_content_async(LlmRequest()):
+            if not texts and on_first:
+                on_first()
+            texts.append(response.content.parts[0].text)
+        return texts
+
+    return asyncio.run(collect())
+
+
+def test_a_healthy_primary_serves_the_request():
+    assert _texts(_failover(StubLlm(model="primary"), StubLlm(model="backup"))) == ["primary-1", "primary-2"]
+    assert closed == ["primary"]
+
+
+def test_an_erroring_primary_falls_back_and_is_tried_last_afterwards():
+    model = _failover(StubLlm(model="primary", error="503"), StubLlm(model="backup"))
+    assert _texts(model) == ["backup-1", "backup-2"]
+    assert [llm.model for llm, _ in model._ordered_candidates()] == ["backup", "primary"]
+
+
+def test_a_silent_primary_is_abandoned_after_the_request_timeout():
+    model = _failover(StubLlm(model="primary", latency_seconds=5), StubLlm(model="backup"), request_timeout_seconds=0.05)
+    assert _texts(model) == ["backup-1", "backup-2"]
+    assert closed[0] == "primary"
+
+
+def test_every_endpoint_failing_raises():
+    with pytest.raises(RuntimeError, match="Every model endpoint failed"):
+        _texts(_failover(StubLlm(model="primary", error="503"), StubLlm(model="backup", error="429")))
+
+
+def test_a_hedged_backup_that_answers_first_wins_and_the_primary_is_closed():
+    model = _failover(StubLlm(model="primary", latency_seconds=5), StubLlm(model="backup"), hedge_after_seconds=0.05)
+    # The losing request must already be shut down when the winner's first response reaches the caller.
+    closed_at_first_response = []
+    assert _texts(model, on_first=lambda: closed_at_first_response.extend(closed)) == ["backup-1", "backup-2"]
+    assert closed_at_first_response == ["primary"]
+
+
+def test_p95_hedging_waits_for_enough_latency_samples():
+    assert failover_llm.observed_p95_seconds("primary") is None
+    for i in range(failover_llm.MIN_LATENCY_SAMPLES):
+        failover_llm._record_latency("primary", i / 100)
+    assert failover_llm.observed_p95_seconds("primary") == 0.18
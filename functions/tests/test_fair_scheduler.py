@@ -0,0 +1,100 @@
+# functions/tests/test_fair_scheduler.py
+"""
+Each user's agent runs are admitted in arrival order up to their concurrency quota; the rest wait their
+turn without blocking other users. These tests walk the scheduler document through that lifecycle.
+
+    cd functions && python -m pytest tests
+"""
+import os
+import sys
+import time
+
+import pytest
+
+FUNCTIONS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, FUNCTIONS_DIR)
+
+from benchmarks.fakes import install_fakes  # noqa: E402  Must run before anything imports common.core.
+
+db, _ = install_fakes(fake_llm=False)
+
+from handlers.vertex import fair_scheduler  # noqa: E402
+from handlers.vertex.fair_scheduler import register_pending_run, try_acquire_run_slot, release_run_slot  # noqa: E402
+
+USER = "sched-user"
+time_base = time.time()
+
+
+@pytest.fixture(autouse=True)
+def scheduler_state(monkeypatch):
+    monkeypatch.setattr(fair_scheduler, "DEFAULT_MAX_CONCURRENT_RUNS_PER_USER", 2)
+    db.collection(fair_scheduler.SCHEDULER_COLLECTION).document(USER).delete()
+    clock = iter(range(1_000))
+    # Distinct, increasing arrival times, so ordering never depends on two runs landing in the same millisecond.
+    monkeypatch.setattr(fair_scheduler.time, "time", lambda: time_base + next(clock) / 1000)
+
+
+def _state() -> dict:
+    return db.collection(fair_scheduler.SCHEDULER_COLLECTION).document(USER).get().to_dict()
+
+
+def test_runs_beyond_the_quota_get_increasing_positions():
+    assert [register_pending_run(USER, f"run-{i}") for i in range(4)] == [0, 0, 1, 2]
+
+
+def test_a_freed_slot_goes_to_the_earliest_waiting_run():
+    for i in range(4):
+        register_pending_run(USER, f"run-{i}")
+    assert try_acquire_run_slot(USER, "run-0") == 0
+    assert try_acquire_run_slot(USER, "run-1") == 0
+    assert try_acquire_run_slot(USER, "run-3") == 2
+
+    release_run_slot(USER, "run-0")
+    # run-3 was delivered first, but run-2 arrived first and keeps its place.
+    assert try_acquire_run_slot(USER, "run-3") == 1
+    assert try_acquire_run_slot(USER, "run-2") == 0
+    assert set(_state()["running"]) == {"run-1", "run-2"}
+
+    release_run_slot(USER, "run-1")
+    assert try_acquire_run_slot(USER, "run-3") == 0
+
+
+def test_a_retried_task_keeps_its_slot():
+    register_pending_run(USER, "run-0")
+    assert try_acquire_run_slot(USER, "run-0") == 0
+    assert try_acquire_run_slot(USER, "run-0") == 0
+    assert list(_state()["running"]) == ["run-0"]
+
+
+def test_users_are_scheduled_independently():
+    for i in range(3):
+        register_pending_run(USER, f"run-{i}")
+    for i in range(3):
+        try_acquire_run_slot(USER, f"run-{i}")
+    try:
+        assert register_pending_run("other-user", "other-run") == 0
+        assert try_acquire_run_slot("other-user", "other-run") == 0
+    finally:
+        db.collection(fair_scheduler.SCHEDULER_COLLECTION).document("other-user").delete()
+
+
+def test_a_per_user_quota_overrides_the_default():
+    db.collection(fair_scheduler.SCHEDULER_COLLECTION).document(USER).set({"maxConcurrentRuns": 1})
+    assert [register_pending_run(USER, f"run-{i}") for i in range(3)] == [0, 1, 2]
+    release_run_slot(USER, "run-0")
+    assert _state()["maxConcurrentRuns"] == 1
+
+
+def test_a_crashed_workers_slot_is_reclaimed_after_its_lease(monkeypatch):
+    stale_ms = int((time_base - fair_scheduler.RUN_SLOT_LEASE_SECONDS - 1) * 1000)
+    db.collection(fair_scheduler.SCHEDULER_COLLECTION).document(USER).set({"running": {"crashed-a": stale_ms, "crashed-b": stale_ms}})
+    assert register_pending_run(USER, "run-0") == 0
+    assert try_acquire_run_slot(USER, "run-0") == 0
+    assert list(_state()["running"]) == ["run-0"]
+
+
+def test_registering_under_quota_skips_the_transaction(monkeypatch):
+    monkeypatch.setattr(fair_scheduler, "_transact", lambda *args: pytest.fail("fast path used a transaction"))
+    assert register_pending_run(USER, "run-0") == 0
+    assert register_pending_run(USER, "run-1") == 0
+    assert set(_state()["waiting"]) == {"run-0", "run-1"}
@@ -0,0 +1,158 @@
+# functions/tests/test_firestore_session_service.py
+"""
+Local model runs keep their ADK sessions in Firestore, one document per event. Events have to fit
+Firestore's 1 MiB document limit even when a turn carries a multi-megabyte stuffed context, and must come
+back unchanged when the session is resumed.
+
+    cd functions && python -m pytest tests
+"""
+import asyncio
+import os
+import sys
+
+import pytest
+
+FUNCTIONS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, FUNCTIONS_DIR)
+
+from benchmarks.fakes import install_fakes  # noqa: E402  Must run before anything imports common.core.
+
+db, storage_client = install_fakes(fake_llm=False)
+
+from google.adk.events import Event  # noqa: E402
+from google.genai import types  # noqa: E402
+from common import config  # noqa: E402
+from common import firestore_session_service as session_module  # noqa: E402
+from common.firestore_session_service import FirestoreSessionService, MAX_EVENT_BYTES  # noqa: E402
+from handlers.vertex.task.history_builder import _with_carried_retrieval_contexts  # noqa: E402
+
+APP, USER = "session_test_app", "session-user"
+
+
+@pytest.fixture(autouse=True)
+def project_config(monkeypatch):
+    monkeypatch.setattr(config, "get_gcp_project_config", lambda: ("proj", "us-central1", "gs://proj-bucket"))
+
+
+@pytest.fixture
+def service():
+    return FirestoreSessionService()
+
+
+def _user_event(*parts, invocation_id="turn-1") -> Event:
+    return Event(author="user", invocation_id=invocation_id, content=types.Content(role="user", parts=list(parts)))
+
+
+def _stored_events(session_id: str) -> list[dict]:
+    return [doc.to_dict() for doc in db.collection("adkSessions").document(session_id).collection("events").stream()]
+
+
+def _payload_objects(session_id: str) -> list[str]:
+    bucket = storage_client.bucket("proj-event-logs")
+    return [blob.name for blob in bucket.list_blobs(prefix=f"adkSessions/{session_id}/")]
+
+
+def test_small_events_round_trip_unchanged(service):
+    async def scenario():
+        session = await service.create_session(app_name=APP, user_id=USER)
+        await service.append_event(session, _user_event(types.Part.from_text(text="hello")))
+        return session.id, await service.get_session(app_name=APP, user_id=USER, session_id=session.id)
+
+    session_id, resumed = asyncio.run(scenario())
+    assert resumed.events[0].content.parts[0].text == "hello"
+    assert "offloadedParts" not in _stored_events(session_id)[0]
+
+
+def test_multi_megabyte_text_context_is_offloaded_and_restored(service):
+    repo_text = "def handler():\n    return 'ok'\n" * 170_000  # ~5 MB, like a stuffed git repository
+    question = "What does handler return?"
+
+    async def scenario():
+        session = await service.create_session(app_name=APP, user_id=USER)
+        await service.append_event(session, _user_event(
+            types.Part.from_text(text=f"user uploaded file 'repo.txt':\n{repo_text}"), types.Part.from_text(text=question)))
+        return session.id, await service.get_session(app_name=APP, user_id=USER, session_id=session.id)
+
+    session_id, resumed = asyncio.run(scenario())
+    stored = _stored_events(session_id)[0]
+    assert len(stored["event"].encode("utf-8")) <= MAX_EVENT_BYTES
+    assert list(stored["offloadedParts"]) == ["0"]
+    assert resumed.events[0].content.parts[0].text == f"user uploaded file 'repo.txt':\n{repo_text}"
+    assert resumed.events[0].content.parts[1].text == question
+
+
+def test_oversized_inline_media_is_dropped(service):
+    image = types.Part.from_bytes(data=b"\x89PNG" + b"\0" * MAX_EVENT_BYTES, mime_type="image/png")
+
+    async def scenario():
+        session = await service.create_session(app_name=APP, user_id=USER)
+        await service.append_event(session, _user_event(image, types.Part.from_text(text="describe this")))
+        return session.id, await service.get_session(app_name=APP, user_id=USER, session_id=session.id)
+
+    session_id, resumed = asyncio.run(scenario())
+    assert resumed.events[0].content.parts[0].text == "[image/png omitted from stored session]"
+    assert resumed.events[0].content.parts[1].text == "describe this"
+    assert not _payload_objects(session_id)
+
+
+def test_sessions_and_events_carry_an_expiry(service):
+    async def scenario():
+        session = await service.create_session(app_name=APP, user_id=USER)
+        await service.append_event(session, _user_event(types.Part.from_text(text="hello")))
+        return session.id
+
+    session_id = asyncio.run(scenario())
+    session_doc = db.collection("adkSessions").document(session_id).get().to_dict()
+    assert session_doc["expiresAt"] >= _stored_events(session_id)[0]["expiresAt"]
+
+
+def test_delete_session_removes_events_and_offloaded_payloads(service):
+    async def scenario():
+        session = await service.create_session(app_name=APP, user_id=USER)
+        await service.append_event(session, _user_event(types.Part.from_text(text="x" * (2 * MAX_EVENT_BYTES))))
+        assert _payload_objects(session.id)
+        await service.delete_session(app_name=APP, user_id=USER, session_id=session.id)
+        return session.id
+
+    session_id = asyncio.run(scenario())
+    assert not db.collection("adkSessions").document(session_id).get().exists
+    assert not _stored_events(session_id)
+    assert not _payload_objects(session_id)
+
+
+def test_resume_after_expired_events_starts_at_a_user_turn(service, monkeypatch):
+    async def scenario():
+        session = await service.create_session(app_name=APP, user_id=USER)
+        await service.append_event(session, _user_event(types.Part.from_text(text="first question")))
+        await service.append_event(session, Event(author="model", invocation_id="turn-1",
+                                                  content=types.Content(role="model", parts=[types.Part.from_text(text="first answer")])))
+        await service.append_event(session, _user_event(types.Part.from_text(text="second question"), invocation_id="turn-2"))
+        # The TTL policy removed the oldest event while the session stayed in use.
+        events_ref = db.collection("adkSessions").document(session.id).collection("events")
+        events_ref.document(min(doc.id for doc in events_ref.stream())).delete()
+        return await service.get_session(app_name=APP, user_id=USER, session_id=session.id)
+
+    resumed = asyncio.run(scenario())
+    assert [event.content.parts[0].text for event in resumed.events] == ["second question"]
+
+
+def test_resumed_turns_carry_retrieval_contexts_for_the_new_query():
+    retrieval_part = {"file_data": {"file_uri": "gs://b/repo.txt", "mime_type": "text/plain"},
+                      "retrieval": {"index_uri": "gs://b/repo.txt.index.npz", "top_k": 4, "chunk_count": 90}}
+    full_history = [
+        {"id": "ctx", "participant": "context_stuffed", "parts": [retrieval_part, {"text": "note"}]},
+        {"id": "q1", "participant": "user:u", "parts": [{"text": "How is auth done?"}]},
+        {"id": "a1", "participant": "model:m", "parts": [{"text": "With tokens."}]},
+        {"id": "q2", "participant": "user:u", "parts": [{"text": "And logging?"}]},
+    ]
+    new_history = full_history[3:]
+
+    carried = _with_carried_retrieval_contexts(full_history, new_history)
+    assert [message["id"] for message in carried] == ["ctx", "q2"]
+    assert carried[0]["parts"] == [retrieval_part]
+    assert _with_carried_retrieval_contexts(full_history, [{"id": "img", "participant": "user:u", "parts": []}])[0]["id"] == "img"
+
+
+def test_offload_is_skipped_when_the_event_fits():
+    event = _user_event(types.Part.from_text(text="short"))
+    assert session_module._serialize_event(event, offload_text=lambda *args: pytest.fail("offloaded a small event"))[1] == {}
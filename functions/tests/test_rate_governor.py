@@ -0,0 +1,115 @@
+# functions/tests/test_rate_governor.py
+"""
+Every function instance draws on one provider key's requests-per-minute budget through SHARD_COUNT window
+shards in Firestore. These tests check that instances claiming slices of the shards never hand out more than
+the budget between them, and that rate-limit headers pause the key for every instance.
+
+    cd functions && python -m pytest tests
+"""
+import asyncio
+import os
+import sys
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+
+FUNCTIONS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, FUNCTIONS_DIR)
+
+from benchmarks.fakes import install_fakes  # noqa: E402  Must run before anything imports common.core.
+
+db, _ = install_fakes(fake_llm=False)
+
+from common.agents import rate_governor  # noqa: E402
+from common.agents.rate_governor import RateBudgetExceeded, RateGovernor, budget_key  # noqa: E402
+
+PROVIDER = "governor-test"
+NOW = 1_800_000_030.0  # Mid-window, so a test never straddles a window boundary.
+
+
+@pytest.fixture(autouse=True)
+def fixed_clock(monkeypatch):
+    monkeypatch.setattr(rate_governor, "time", SimpleNamespace(time=lambda: NOW, monotonic=time.monotonic))
+
+
+@pytest.fixture
+def key(request):
+    # A fresh budget key per test, so window shards and pause state never carry over.
+    return budget_key(PROVIDER, request.node.name)
+
+
+def _configure(**limits):
+    db.collection(rate_governor.CONFIG_COLLECTION).document(PROVIDER).set(limits)
+
+
+def _shard_usage(key: str) -> list[dict]:
+    window = int(NOW // rate_governor.WINDOW_SECONDS)
+    refs = [db.collection(rate_governor.WINDOWS_COLLECTION).document(f"{key}_{window}_{shard}")
+            for shard in range(rate_governor.SHARD_COUNT)]
+    return [ref.get().to_dict() or {} for ref in refs]
+
+
+def _admitted(governor: RateGovernor, tokens: int = 1) -> bool:
+    try:
+        asyncio.run(governor.acquire(tokens))
+        return True
+    except RateBudgetExceeded:
+        return False
+
+
+def test_instances_together_never_exceed_the_request_budget(key):
+    _configure(rpm=80, maxWaitSeconds=1)
+    instances = [RateGovernor(key, PROVIDER) for _ in range(3)]
+    admitted = 0
+    for _ in range(40):
+        admitted += sum(_admitted(governor) for governor in instances)
+
+    assert admitted == 80
+    shard_budget = 80 // rate_governor.SHARD_COUNT
+    assert [usage["requests"] for usage in _shard_usage(key)] == [shard_budget] * rate_governor.SHARD_COUNT
+
+
+def test_a_claim_takes_a_fraction_of_one_shard(key):
+    _configure(rpm=80)
+    assert _admitted(RateGovernor(key, PROVIDER))
+    # ceil(10 requests per shard * CLAIM_FRACTION) = 3, of which the first call spent one locally.
+    assert sorted(usage.get("requests", 0) for usage in _shard_usage(key)) == [0] * 7 + [3]
+
+
+def test_a_call_larger_than_one_shard_collects_tokens_from_several(key):
+    _configure(tpm=8000)
+    assert _admitted(RateGovernor(key, PROVIDER), tokens=2500)
+    assert sum(usage.get("tokens", 0) for usage in _shard_usage(key)) == 2500
+    assert max(usage.get("tokens", 0) for usage in _shard_usage(key)) == 1000
+
+
+def test_a_rate_limited_response_pauses_the_key_for_other_instances(key, monkeypatch):
+    _configure(maxWaitSeconds=1)
+    writer_threads = []
+    record_state = RateGovernor._record_state
+    monkeypatch.setattr(RateGovernor, "_record_state",
+                        lambda self, update: (writer_threads.append(threading.current_thread()), record_state(self, update)))
+
+    asyncio.run(RateGovernor(key, PROVIDER).observe_headers({"Retry-After": "30"}, rate_limited=True))
+
+    assert writer_threads and writer_threads[0] is not threading.main_thread()
+    assert db.collection(rate_governor.STATE_COLLECTION).document(key).get().to_dict()["pausedUntil"] == NOW + 30
+    with pytest.raises(RateBudgetExceeded):
+        asyncio.run(RateGovernor(key, PROVIDER).acquire(1))
+
+
+def test_unchanged_reported_limits_are_not_rewritten(key, monkeypatch):
+    governor = RateGovernor(key, PROVIDER)
+    asyncio.run(governor.observe_headers({"x-ratelimit-limit-requests": "500"}))
+    monkeypatch.setattr(RateGovernor, "_record_state", lambda *args: pytest.fail("wrote unchanged limits"))
+    asyncio.run(governor.observe_headers({"x-ratelimit-limit-requests": "500"}))
+
+
+@pytest.mark.parametrize("value, expected", [
+    ("20ms", 0.02), ("6m0s", 360.0), ("1.5", 1.5), ("soon", None), (None, None),
+])
+def test_reset_headers_are_parsed(value, expected):
+    parsed = rate_governor._parse_reset_seconds(value)
+    assert (parsed is None) if expected is None else parsed == pytest.approx(expected)
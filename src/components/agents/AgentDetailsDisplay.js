@@ -61,6 +61,25 @@ const AgentDetailsDisplay = ({ agent, model }) => { // Now accepts model object
                         <LoopIcon sx={{ mr: 0.5 }} fontSize="small" /> Max Loops:
                     </Typography>
                     <Typography variant="body2" color="text.secondary" paragraph>{agent.maxLoops || 'Default (3)'}</Typography>
+                    {(agent.maxLoopSeconds || agent.maxLoopTokens || agent.stopOnConvergence) && (
+                        <>
+                            <Typography variant="subtitle1" fontWeight="medium">Loop Budgets:</Typography>
+                            <Typography variant="body2" color="text.secondary" paragraph>
+                                {[agent.maxLoopSeconds && `${agent.maxLoopSeconds}s`, agent.maxLoopTokens && `${agent.maxLoopTokens} tokens`, agent.stopOnConvergence && 'stops on convergence'].filter(Boolean).join(', ')}
+                            </Typography>
+                        </>
+                    )}
+                </>
+            )}
+
+            {agent.agentType === 'ParallelAgent' && (agent.maxParallelBranches || agent.branchTimeoutSeconds) && (
+                <>
+                    <Typography variant="subtitle1" fontWeight="medium" sx={{ mt: 1.5 }}>Branch Limits:</Typography>
+                    <Typography variant="body2" color="text.secondary" paragraph>
+                        {agent.maxParallelBranches ? `${agent.maxParallelBranches} at a time` : 'All at once'}
+                        {agent.branchTimeoutSeconds ? `, ${agent.branchTimeoutSeconds}s per branch` : ''}
+                        {agent.returnPartialResults === false ? ', fail on timeout' : ', partial results on timeout'}
+                    </Typography>
                 </>
             )}
 
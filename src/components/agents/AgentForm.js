@@ -9,7 +9,7 @@ import {
     TextField, Button, Select, MenuItem, FormControl, InputLabel,
     Paper, Grid, Box, CircularProgress, Typography, IconButton, List,
     ListItem, ListItemText, ListItemSecondaryAction, FormHelperText,
-     Stack, Alert
+     Stack, Alert, FormControlLabel, Checkbox
 } from '@mui/material';
 import AddCircleOutlineIcon from '@mui/icons-material/AddCircleOutline';
 import LibraryAddIcon from '@mui/icons-material/LibraryAdd';
@@ -34,7 +34,14 @@ const AgentForm = ({ onSubmit, initialData = {}, isSaving = false }) => {
     // --- State for Tools and Children (mostly unchanged) ---
     const [selectedTools, setSelectedTools] = useState(initialData.tools || []);
     const [maxLoops, setMaxLoops] = useState(initialData.maxLoops || 3);
+    const [maxLoopSeconds, setMaxLoopSeconds] = useState(initialData.maxLoopSeconds ?? '');
+    const [maxLoopTokens, setMaxLoopTokens] = useState(initialData.maxLoopTokens ?? '');
+    const [stopOnConvergence, setStopOnConvergence] = useState(initialData.stopOnConvergence === true);
+    const [maxParallelBranches, setMaxParallelBranches] = useState(initialData.maxParallelBranches ?? '');
+    const [branchTimeoutSeconds, setBranchTimeoutSeconds] = useState(initialData.branchTimeoutSeconds ?? '');
+    const [returnPartialResults, setReturnPartialResults] = useState(initialData.returnPartialResults !== false);
     const [outputKey, setOutputKey] = useState(initialData.outputKey || '');
+    const [compactEventLog, setCompactEventLog] = useState(initialData.compactEventLog || false);
     const [usedCustomRepoUrls, setUsedCustomRepoUrls] = useState(initialData.usedCustomRepoUrls || []);
     const [usedMcpServerUrls, setUsedMcpServerUrls] = useState(initialData.usedMcpServerUrls || []);
 
@@ -97,10 +104,19 @@ const AgentForm = ({ onSubmit, initialData = {}, isSaving = false }) => {
             usedCustomRepoUrls,
             usedMcpServerUrls,
             outputKey: outputKey.trim() || null,
+            compactEventLog,
         };
 
         if (agentType === 'LoopAgent') {
             agentDataToSubmit.maxLoops = Number(maxLoops);
+            agentDataToSubmit.maxLoopSeconds = maxLoopSeconds === '' ? null : Number(maxLoopSeconds);
+            agentDataToSubmit.maxLoopTokens = maxLoopTokens === '' ? null : Number(maxLoopTokens);
+            agentDataToSubmit.stopOnConvergence = stopOnConvergence;
+        }
+        if (agentType === 'ParallelAgent') {
+            agentDataToSubmit.maxParallelBranches = maxParallelBranches === '' ? null : Number(maxParallelBranches);
+            agentDataToSubmit.branchTimeoutSeconds = branchTimeoutSeconds === '' ? null : Number(branchTimeoutSeconds);
+            agentDataToSubmit.returnPartialResults = returnPartialResults;
         }
         if (agentType === 'SequentialAgent' || agentType === 'ParallelAgent') {
             agentDataToSubmit.childAgents = childAgents.map(ca => {
@@ -221,6 +237,70 @@ const AgentForm = ({ onSubmit, initialData = {}, isSaving = false }) => {
                         </Grid>
                     )}
 
+                    {agentType === 'LoopAgent' && (
+                        <>
+                            <Grid item xs={12} sm={6}>
+                                <TextField
+                                    label="Time Budget (seconds)" type="number"
+                                    value={maxLoopSeconds}
+                                    onChange={(e) => setMaxLoopSeconds(e.target.value)}
+                                    InputProps={{ inputProps: { min: 1 } }}
+                                    fullWidth variant="outlined"
+                                    helperText="Stop before an iteration that would run past this. Leave empty for no limit."
+                                />
+                            </Grid>
+                            <Grid item xs={12} sm={6}>
+                                <TextField
+                                    label="Token Budget" type="number"
+                                    value={maxLoopTokens}
+                                    onChange={(e) => setMaxLoopTokens(e.target.value)}
+                                    InputProps={{ inputProps: { min: 1 } }}
+                                    fullWidth variant="outlined"
+                                    helperText="Stop before an iteration that would use more tokens than this. Leave empty for no limit."
+                                />
+                            </Grid>
+                            <Grid item xs={12}>
+                                <FormControlLabel
+                                    control={<Checkbox checked={stopOnConvergence} onChange={(e) => setStopOnConvergence(e.target.checked)} />}
+                                    label="Stop when the output stops changing"
+                                />
+                                <FormHelperText>Compares the value saved under the Output Key after each iteration.</FormHelperText>
+                            </Grid>
+                        </>
+                    )}
+
+                    {agentType === 'ParallelAgent' && (
+                        <>
+                            <Grid item xs={12} sm={4}>
+                                <TextField
+                                    label="Max Parallel Branches" type="number"
+                                    value={maxParallelBranches}
+                                    onChange={(e) => setMaxParallelBranches(e.target.value === '' ? '' : Math.max(1, parseInt(e.target.value, 10) || 1))}
+                                    InputProps={{ inputProps: { min: 1 } }}
+                                    fullWidth variant="outlined"
+                                    helperText="Branches running at once. Leave empty to run all."
+                                />
+                            </Grid>
+                            <Grid item xs={12} sm={4}>
+                                <TextField
+                                    label="Branch Timeout (seconds)" type="number"
+                                    value={branchTimeoutSeconds}
+                                    onChange={(e) => setBranchTimeoutSeconds(e.target.value)}
+                                    InputProps={{ inputProps: { min: 1 } }}
+                                    fullWidth variant="outlined"
+                                    helperText="Time each branch gets once it starts. Leave empty for no limit."
+                                />
+                            </Grid>
+                            <Grid item xs={12} sm={4}>
+                                <FormControlLabel
+                                    control={<Checkbox checked={returnPartialResults} onChange={(e) => setReturnPartialResults(e.target.checked)} />}
+                                    label="Return partial results"
+                                />
+                                <FormHelperText>Record timed-out or failed branches and keep the others' results, instead of failing the run.</FormHelperText>
+                            </Grid>
+                        </>
+                    )}
+
                     {showChildConfig && (
                         <Grid item xs={12}>
                             <Typography variant="h6" gutterBottom>{childAgentSectionTitle}</Typography>
@@ -254,6 +334,14 @@ const AgentForm = ({ onSubmit, initialData = {}, isSaving = false }) => {
                         </Grid>
                     )}
 
+                    <Grid item xs={12}>
+                        <FormControlLabel
+                            control={<Checkbox checked={compactEventLog} onChange={(e) => setCompactEventLog(e.target.checked)} />}
+                            label="Compact event log"
+                        />
+                        <FormHelperText>Stores each run's full event log in Cloud Storage and keeps only tool calls, replies and errors in the reasoning log index.</FormHelperText>
+                    </Grid>
+
                     {formError && <Grid item xs={12}><FormHelperText error sx={{fontSize: '1rem', textAlign:'center'}}>{formError}</FormHelperText></Grid>}
 
                     <Grid item xs={12}>
@@ -2,7 +2,7 @@
 import React from 'react';
 import {
     Dialog, DialogTitle, DialogContent, DialogActions, Button,
-    Typography, Accordion, AccordionSummary, AccordionDetails, Box, Chip, Paper
+    Typography, Accordion, AccordionSummary, AccordionDetails, Box, Chip, Paper, Alert
 } from '@mui/material';
 import ExpandMoreIcon from '@mui/icons-material/ExpandMore';
 import ReactMarkdown from 'react-markdown';
@@ -102,7 +102,17 @@ const EventActionsDisplay = ({ actions }) => {
 };
 
 
-const AgentReasoningLogDialog = ({ open, onClose, events }) => {
+// Shown when the run's events were compacted: Firestore holds only the key events.
+const CompactedLogNotice = ({ eventLog, events, onLoadFullLog }) => {
+    if (!eventLog?.uri || events.length >= eventLog.eventCount) return null;
+    return (
+        <Alert severity="info" sx={{ mb: 2 }} action={onLoadFullLog && <Button color="inherit" size="small" onClick={onLoadFullLog}>Load full log</Button>}>
+            Showing {events.length} key events (tool calls, replies and errors) of {eventLog.eventCount}.
+        </Alert>
+    );
+};
+
+const AgentReasoningLogDialog = ({ open, onClose, events, eventLog, onLoadFullLog }) => {
     if (!events || events.length === 0) {
         return (
             <Dialog open={open} onClose={onClose} maxWidth="sm">
@@ -121,21 +131,30 @@ const AgentReasoningLogDialog = ({ open, onClose, events }) => {
         <Dialog open={open} onClose={onClose} maxWidth="md" fullWidth scroll="paper">
             <DialogTitle>Agent Reasoning Log ({events.length} {events.length === 1 ? 'event' : 'events'})</DialogTitle>
             <DialogContent dividers>
+                <CompactedLogNotice eventLog={eventLog} events={events} onLoadFullLog={onLoadFullLog} />
                 {events.map((event, index) => (
                     <Accordion key={event.id || index} sx={{ mb: 1 }} TransitionProps={{ unmountOnExit: true }}>
                         <AccordionSummary expandIcon={<ExpandMoreIcon />}>
                             <Typography sx={{ width: {xs: '40%', sm:'33%'}, flexShrink: 0 }}>
-                                Event {index + 1} ({event.author || 'System'})
+                                Event {(event.eventIndex ?? index) + 1} ({event.author || 'System'})
                             </Typography>
                             <Typography sx={{ color: 'text.secondary', overflow: 'hidden', textOverflow: 'ellipsis', whiteSpace: 'nowrap' }}>
                                 Type: <Chip label={event.type || "Unknown"} size="small" variant="outlined" />
                                 {event.partial && <Chip label="Partial" size="small" sx={{ml:0.5}} color="info" variant="outlined" />}
+                                {event.truncated && <Chip label="Truncated" size="small" sx={{ml:0.5}} variant="outlined" />}
                                 {event.turn_complete && <Chip label="Turn Complete" size="small" sx={{ml:0.5}} color="success" variant="outlined" />}
+                                {event.error_code && <Chip label={event.error_code} size="small" sx={{ml:0.5}} color="warning" variant="outlined" />}
 
                             </Typography>
                         </AccordionSummary>
                         <AccordionDetails sx={{ bgcolor: 'background.default', borderTop: '1px solid', borderColor: 'divider' }}>
-                            <EventContentDisplay content={event.content} />
+                            {event.error_message && <Alert severity="warning" sx={{ mb: 1 }}>{event.error_message}</Alert>}
+                            {(event.content || !event.error_message) && <EventContentDisplay content={event.content} />}
+                            {event.custom_metadata && Object.keys(event.custom_metadata).length > 0 && (
+                                <Typography component="pre" variant="body2" sx={{ whiteSpace: 'pre-wrap', wordBreak: 'break-all', fontSize: '0.75rem', bgcolor: 'action.hover', p: 0.5, mt: 1, borderRadius: 1 }}>
+                                    {JSON.stringify(event.custom_metadata, null, 2)}
+                                </Typography>
+                            )}
                             <EventActionsDisplay actions={event.actions} /> {/* Display actions here */}
                         </AccordionDetails>
                     </Accordion>
@@ -6,10 +6,12 @@ import CallSplitIcon from '@mui/icons-material/CallSplit';
 import ChevronLeft from '@mui/icons-material/ChevronLeft';
 import ChevronRight from '@mui/icons-material/ChevronRight';
 import DeveloperModeIcon from '@mui/icons-material/DeveloperMode';
+import StopCircleIcon from '@mui/icons-material/StopCircle';
 
-const MessageActions = ({ message, messagesMap, activePath, onNavigate, onFork, onViewLog, getChildrenForMessage, findLeafOfBranch, isAssistantMessage }) => {     const children = getChildrenForMessage(messagesMap, message.id);
+const MessageActions = ({ message, messagesMap, activePath, onNavigate, onFork, onViewLog, onCancelRun, getChildrenForMessage, findLeafOfBranch, isAssistantMessage, isReadOnly }) => {     const children = getChildrenForMessage(messagesMap, message.id);
     const hasForks = children.length > 1;
     const isContextMessage = message.participant === 'context_stuffed';
+    const isRunInProgress = isAssistantMessage && !['completed', 'error', 'cancelled'].includes(message.status);
 
     // Find which of my children is in the active path
     const activeChild = hasForks ? children.find(child => activePath.some(pathMsg => pathMsg.id === child.id)) : null;
@@ -41,6 +43,15 @@ const MessageActions = ({ message, messagesMap, activePath, onNavigate, onFork,
                 </Box>
             )}
             <Box sx={{ position: isContextMessage ? 'static' : 'absolute', right: 0, top: '50%', transform: isContextMessage ? 'none' : 'translateY(-50%)', display: 'flex', alignItems: 'center' }}>
+                {isRunInProgress && !isReadOnly && onCancelRun && (
+                    <Tooltip title={message.cancelRequested ? "Cancelling…" : "Stop this run"}>
+                        <span>
+                            <IconButton size="small" onClick={() => onCancelRun(message.id)} disabled={!!message.cancelRequested}>
+                                <StopCircleIcon fontSize="small" />
+                            </IconButton>
+                        </span>
+                    </Tooltip>
+                )}
                 {isAssistantMessage && (
                     <Tooltip title="View Agent Reasoning Log">
                         <IconButton size="small" onClick={() => onViewLog(message.id)}>
@@ -34,15 +34,33 @@ const parseParticipant = (str, models, agents, currentUser) => {
     return { label: str, icon: <PersonIcon /> };
 };
 
+// Background context ingestion writes its state to msg.ingestJob. The final attempt marks the job failed
+// shortly before its timeout; a job whose last attempt is past its deadline is still shown as failed in case
+// that write never landed.
+const getIngestJobView = (job) => {
+    if (!job || job.status === 'completed') return null;
+    const deadline = job.deadlineAt?.toDate ? job.deadlineAt.toDate() : null;
+    const isStale = deadline && deadline < new Date() && (job.attempts ?? 0) >= (job.maxAttempts ?? 3);
+    if (job.status === 'error' || isStale) {
+        return { failed: true, label: job.error || 'Background ingestion timed out.' };
+    }
+    const { done, total } = job.progress || {};
+    return { failed: false, label: total ? `Ingesting… (${done}/${total})` : 'Ingesting…' };
+};
+
 const MessageContent = ({ msg, isAssistant, messageContentCache }) => {
     const messageStatus = isAssistant ? (msg.status ?? 'initializing') : msg.status;
 
-    if (messageStatus === 'initializing' || messageStatus === 'running') {
+    if (messageStatus === 'initializing' || messageStatus === 'running' || messageStatus === 'queued') {
+        let statusLabel = messageStatus === 'running' ? 'Thinking…' : 'Initializing…';
+        if (messageStatus === 'queued') {
+            statusLabel = msg.queuePosition ? `Queued (position ${msg.queuePosition})…` : 'Queued…';
+        }
         return (
             <Box sx={{ display: 'flex', alignItems: 'center' }}>
                 <LoadingSpinner small />
                 <Typography variant="caption" sx={{ ml: 1 }}>
-                    {messageStatus === 'running' ? 'Thinking…' : 'Initializing…'}
+                    {statusLabel}
                 </Typography>
             </Box>
         );
@@ -62,11 +80,12 @@ const MessageContent = ({ msg, isAssistant, messageContentCache }) => {
     );
 };
 
-const MessageBubble = ({ msg, models, agents, currentUser, messagesMap, activePath, isReadOnly, onFork, onNavigateBranch, onViewLog, onOpenContextDetails, messageContentCache }) => {
+const MessageBubble = ({ msg, models, agents, currentUser, messagesMap, activePath, isReadOnly, onFork, onNavigateBranch, onViewLog, onCancelRun, onOpenContextDetails, messageContentCache }) => {
     const theme = useTheme();
     const participant = parseParticipant(msg.participant, models, agents, currentUser);
     const isAssistant = msg.participant?.startsWith('agent') || msg.participant?.startsWith('model');
     const isContextMessage = msg.participant === 'context_stuffed';
+    const ingestJobView = isContextMessage ? getIngestJobView(msg.ingestJob) : null;
 
     const getBubbleSx = () => {
         const isUser = msg.participant?.startsWith('user:');
@@ -83,10 +102,23 @@ const MessageBubble = ({ msg, models, agents, currentUser, messagesMap, activePa
             <Box sx={{ display: 'flex', alignItems: 'center', gap: 1, mb: 0.5 }}>
                 {participant.icon}
                 <Typography variant="subtitle2">{participant.label}</Typography>
+                {msg.responseCache?.status === 'hit' && (
+                    <Typography variant="caption" color="text.secondary"><i>(cached response)</i></Typography>
+                )}
             </Box>
 
             {isContextMessage ? (
-                <ContextDisplayBubble contextMessage={{ items: extractContextItemsFromMessage(msg) }} onOpenDetails={() => onOpenContextDetails(msg)} />
+                <>
+                    <ContextDisplayBubble contextMessage={{ items: extractContextItemsFromMessage(msg) }} onOpenDetails={() => onOpenContextDetails(msg)} />
+                    {ingestJobView && (
+                        <Box sx={{ display: 'flex', alignItems: 'center', mb: 0.5 }}>
+                            {!ingestJobView.failed && <LoadingSpinner small />}
+                            <Typography variant="caption" color={ingestJobView.failed ? 'error' : 'text.secondary'} sx={{ ml: ingestJobView.failed ? 0 : 1 }}>
+                                {ingestJobView.label}
+                            </Typography>
+                        </Box>
+                    )}
+                </>
             ) : (
                 <Paper sx={{ p: 1.5, wordBreak: 'break-word', whiteSpace: 'pre-wrap', mb: 0.5, borderRadius: 2, ...getBubbleSx() }}>
                     <MessageContent msg={msg} isAssistant={isAssistant} messageContentCache={messageContentCache} />
@@ -95,7 +127,7 @@ const MessageBubble = ({ msg, models, agents, currentUser, messagesMap, activePa
 
             <MessageActions
                 message={msg} messagesMap={messagesMap} activePath={activePath}
-                onNavigate={onNavigateBranch} onFork={onFork} onViewLog={onViewLog}
+                onNavigate={onNavigateBranch} onFork={onFork} onViewLog={onViewLog} onCancelRun={onCancelRun}
                 getChildrenForMessage={getChildrenForMessage} findLeafOfBranch={findLeafOfBranch}
                 isAssistantMessage={isAssistant} isReadOnly={isReadOnly}
             />
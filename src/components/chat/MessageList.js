@@ -3,7 +3,7 @@ import React, { useRef, useEffect } from 'react';
 import { Box } from '@mui/material';
 import MessageBubble from './MessageBubble';
 
-const MessageList = ({ conversationPath, models, agents, currentUser, messagesMap, activePath, isReadOnly, onFork, onNavigateBranch, onViewLog, onOpenContextDetails, messageContentCache }) => {
+const MessageList = ({ conversationPath, models, agents, currentUser, messagesMap, activePath, isReadOnly, onFork, onNavigateBranch, onViewLog, onCancelRun, onOpenContextDetails, messageContentCache }) => {
     const chatEndRef = useRef(null);
 
     useEffect(() => {
@@ -30,6 +30,7 @@ const MessageList = ({ conversationPath, models, agents, currentUser, messagesMa
                     onFork={onFork}
                     onNavigateBranch={onNavigateBranch}
                     onViewLog={onViewLog}
+                    onCancelRun={onCancelRun}
                     onOpenContextDetails={onOpenContextDetails}
                     messageContentCache={messageContentCache}
                 />
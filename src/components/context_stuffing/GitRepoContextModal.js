@@ -1,6 +1,6 @@
 // src/components/context_stuffing/GitRepoContextModal.js
 import React, { useState } from 'react';
-import { Dialog, DialogTitle, DialogContent, DialogActions, Button, TextField, Box, Grid, Typography } from '@mui/material';
+import { Dialog, DialogTitle, DialogContent, DialogActions, Button, TextField, Box, Grid, Typography, FormControlLabel, Checkbox } from '@mui/material';
 
 const GitRepoContextModal = ({ open, onClose, onSubmit }) => {
     const [orgUser, setOrgUser] = useState('');
@@ -10,6 +10,7 @@ const GitRepoContextModal = ({ open, onClose, onSubmit }) => {
     const [excludeExt, setExcludeExt] = useState('');
     const [directory, setDirectory] = useState('');
     const [branch, setBranch] = useState('main');
+    const [useRetrieval, setUseRetrieval] = useState(false);
     const [formError, setFormError] = useState('');
 
     const handleSubmit = () => {
@@ -32,6 +33,7 @@ const GitRepoContextModal = ({ open, onClose, onSubmit }) => {
             excludeExt: excludeExt.trim() ? excludeExt.split(',').map(e => e.trim().replace(/^\./, '').toLowerCase()) : [],
             directory: directory.trim() || '', // Send empty string for root, backend will handle
             branch: branch.trim() || 'main', // Default to main if empty
+            useRetrieval,
         });
         handleClose();
     };
@@ -44,6 +46,7 @@ const GitRepoContextModal = ({ open, onClose, onSubmit }) => {
         setExcludeExt('');
         setDirectory('');
         setBranch('main');
+        setUseRetrieval(false);
         setFormError('');
         onClose();
     };
@@ -142,6 +145,12 @@ const GitRepoContextModal = ({ open, onClose, onSubmit }) => {
                                 helperText="Specific directory to fetch files from (e.g., src/utils). Defaults to root if blank. Fetches recursively."
                             />
                         </Grid>
+                        <Grid item xs={12}>
+                            <FormControlLabel
+                                control={<Checkbox checked={useRetrieval} onChange={(e) => setUseRetrieval(e.target.checked)} />}
+                                label="Use retrieval for large content (sends only the most relevant excerpts per query)"
+                            />
+                        </Grid>
                         {formError && <Grid item xs={12}><Typography color="error">{formError}</Typography></Grid>}
                     </Grid>
                 </Box>
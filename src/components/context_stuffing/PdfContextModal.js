@@ -1,6 +1,6 @@
 // src/components/context_stuffing/PdfContextModal.js
 import React, { useState, useRef } from 'react';
-import { Dialog, DialogTitle, DialogContent, DialogActions, Button, TextField, Box, Typography } from '@mui/material';
+import { Dialog, DialogTitle, DialogContent, DialogActions, Button, TextField, Box, Typography, FormControlLabel, Checkbox } from '@mui/material';
 import CloudUploadIcon from '@mui/icons-material/CloudUpload';
 
 const PdfContextModal = ({ open, onClose, onSubmit }) => {
@@ -8,6 +8,7 @@ const PdfContextModal = ({ open, onClose, onSubmit }) => {
     const [uploadedFile, setUploadedFile] = useState(null);
     const [fileName, setFileName] = useState('');
     const [error, setError] = useState('');
+    const [useRetrieval, setUseRetrieval] = useState(false);
     const fileInputRef = useRef(null);
 
     const handleFileChange = (event) => {
@@ -47,19 +48,13 @@ const PdfContextModal = ({ open, onClose, onSubmit }) => {
         }
         setError('');
 
-        let submissionData = { type: 'pdf' };
+        let submissionData = { type: 'pdf', useRetrieval };
         if (uploadedFile) {
-            const reader = new FileReader();
-            reader.readAsDataURL(uploadedFile);
-            reader.onload = () => {
-                submissionData.fileData = reader.result.split(',')[1]; // Base64 data
-                submissionData.fileName = uploadedFile.name;
-                onSubmit(submissionData);
-                handleClose();
-            };
-            reader.onerror = () => {
-                setError('Error reading file.');
-            };
+            // The file is uploaded directly to storage by the context service.
+            submissionData.file = uploadedFile;
+            submissionData.fileName = uploadedFile.name;
+            onSubmit(submissionData);
+            handleClose();
         } else {
             submissionData.url = pdfUrl;
             onSubmit(submissionData);
@@ -72,6 +67,7 @@ const PdfContextModal = ({ open, onClose, onSubmit }) => {
         setUploadedFile(null);
         setFileName('');
         setError('');
+        setUseRetrieval(false);
         if(fileInputRef.current) fileInputRef.current.value = ""; // Reset file input
         onClose();
     };
@@ -111,6 +107,11 @@ const PdfContextModal = ({ open, onClose, onSubmit }) => {
                             accept="application/pdf"
                         />
                     </Button>
+                    <FormControlLabel
+                        control={<Checkbox checked={useRetrieval} onChange={(e) => setUseRetrieval(e.target.checked)} />}
+                        label="Use retrieval for large content (sends only the most relevant excerpts per query)"
+                        sx={{ mt: 1 }}
+                    />
                     {fileName && <Typography variant="body2" sx={{ mt: 1 }}>Selected file: {fileName}</Typography>}
                     {error && <Typography color="error" sx={{ mt: 1 }}>{error}</Typography>}
                 </Box>
@@ -1,10 +1,11 @@
 // src/components/context_stuffing/WebPageContextModal.js
 import React, { useState } from 'react';
-import { Dialog, DialogTitle, DialogContent, DialogActions, Button, TextField, Box } from '@mui/material';
+import { Dialog, DialogTitle, DialogContent, DialogActions, Button, TextField, Box, FormControlLabel, Checkbox } from '@mui/material';
 
 const WebPageContextModal = ({ open, onClose, onSubmit }) => {
     const [url, setUrl] = useState('');
     const [error, setError] = useState('');
+    const [useRetrieval, setUseRetrieval] = useState(false);
 
     const handleSubmit = () => {
         if (!url.trim()) {
@@ -18,13 +19,14 @@ const WebPageContextModal = ({ open, onClose, onSubmit }) => {
             return;
         }
         setError('');
-        onSubmit({ type: 'webpage', url });
+        onSubmit({ type: 'webpage', url, useRetrieval });
         handleClose();
     };
 
     const handleClose = () => {
         setUrl('');
         setError('');
+        setUseRetrieval(false);
         onClose();
     };
 
@@ -46,6 +48,10 @@ const WebPageContextModal = ({ open, onClose, onSubmit }) => {
                         error={!!error}
                         helperText={error || "Enter the full URL of the web page."}
                     />
+                    <FormControlLabel
+                        control={<Checkbox checked={useRetrieval} onChange={(e) => setUseRetrieval(e.target.checked)} />}
+                        label="Use retrieval for large content (sends only the most relevant excerpts per query)"
+                    />
                 </Box>
             </DialogContent>
             <DialogActions>
@@ -6,6 +6,7 @@ import {
     FormControlLabel, Checkbox
 } from '@mui/material';
 import ProjectSelector from '../projects/ProjectSelector';
+import ModelSelector from './ModelSelector';
 import {
     MODEL_PROVIDERS_LITELLM,
     DEFAULT_LITELLM_PROVIDER_ID,
@@ -18,6 +19,11 @@ const ModelForm = ({ onSubmit, initialData = {}, isSaving = false }) => {
     const [description, setDescription] = useState(initialData.description || '');
     const [projectIds, setProjectIds] = useState(initialData.projectIds || []);
     const [isPublic, setIsPublic] = useState(initialData.isPublic || false);
+    const [responseCache, setResponseCache] = useState(initialData.responseCache || false);
+    const [compactEventLog, setCompactEventLog] = useState(initialData.compactEventLog || false);
+    const [fallbackModelIds, setFallbackModelIds] = useState(initialData.fallbackModelIds || []);
+    const [requestTimeoutSeconds, setRequestTimeoutSeconds] = useState(initialData.requestTimeoutSeconds ?? '');
+    const [hedgeAfterSeconds, setHedgeAfterSeconds] = useState(initialData.hedgeAfterSeconds ?? '');
 
     const [provider, setProvider] = useState(initialData.provider || DEFAULT_LITELLM_PROVIDER_ID);
     const [modelString, setModelString] = useState(initialData.modelString || DEFAULT_LITELLM_BASE_MODEL_ID);
@@ -321,10 +327,16 @@ const ModelForm = ({ onSubmit, initialData = {}, isSaving = false }) => {
             description,
             projectIds,
             isPublic,
+            responseCache,
+            compactEventLog,
             provider,
             modelString,
             systemInstruction,
             parameters: parametersToSave,
+            fallbackModelIds,
+            requestTimeoutSeconds: requestTimeoutSeconds === '' ? null : Number(requestTimeoutSeconds),
+            hedgeAfterSeconds: hedgeAfterSeconds === '' ? null
+                : (String(hedgeAfterSeconds).trim().toLowerCase() === 'p95' ? 'p95' : Number(hedgeAfterSeconds)),
         };
 
         onSubmit(modelData);
@@ -368,6 +380,50 @@ const ModelForm = ({ onSubmit, initialData = {}, isSaving = false }) => {
                             label="Public Model (visible to all users)"
                         />
                     </Grid>
+                    <Grid item xs={12}>
+                        <FormControlLabel
+                            control={<Checkbox checked={responseCache} onChange={(e) => setResponseCache(e.target.checked)} />}
+                            label="Cache responses (reuses replies to identical prompts when temperature is 0)"
+                        />
+                    </Grid>
+                    <Grid item xs={12}>
+                        <FormControlLabel
+                            control={<Checkbox checked={compactEventLog} onChange={(e) => setCompactEventLog(e.target.checked)} />}
+                            label="Compact event log (stores the full log in Cloud Storage and indexes only key events)"
+                        />
+                    </Grid>
+                    <Grid item xs={12}>
+                        <ModelSelector
+                            id="fallback-models-select"
+                            label="Fallback Models (tried in the order selected)"
+                            multiple
+                            selectedModelId={fallbackModelIds}
+                            onSelectionChange={setFallbackModelIds}
+                            projectIds={projectIds}
+                            excludeModelIds={initialData.id ? [initialData.id] : []}
+                            helperText="Optional. Used when this model's provider errors or times out. Not applied to deployed agents."
+                        />
+                    </Grid>
+                    {fallbackModelIds.length > 0 && (
+                        <>
+                            <Grid item xs={12} sm={6}>
+                                <TextField
+                                    label="Request Timeout (seconds)" type="number"
+                                    value={requestTimeoutSeconds} onChange={(e) => setRequestTimeoutSeconds(e.target.value)}
+                                    fullWidth variant="outlined"
+                                    helperText="Fail over when a model has not responded within this time."
+                                />
+                            </Grid>
+                            <Grid item xs={12} sm={6}>
+                                <TextField
+                                    label="Hedge After (seconds or p95)"
+                                    value={hedgeAfterSeconds} onChange={(e) => setHedgeAfterSeconds(e.target.value)}
+                                    fullWidth variant="outlined"
+                                    helperText="Also send the request to the next fallback after this long; the first answer wins."
+                                />
+                            </Grid>
+                        </>
+                    )}
                     <Grid item xs={12} sm={6}>
                         <FormControl fullWidth variant="outlined">
                             <InputLabel id="provider-label">LLM Provider</InputLabel>
@@ -6,7 +6,7 @@ import {
     FormControl, InputLabel, Select, MenuItem, FormHelperText, CircularProgress, Box
 } from '@mui/material';
 
-const ModelSelector = ({ selectedModelId, onSelectionChange, projectIds = [], helperText, required, ...props }) => {
+const ModelSelector = ({ selectedModelId, onSelectionChange, projectIds = [], helperText, required, multiple = false, label = 'Model', excludeModelIds = [], id = 'model-select', ...props }) => {
     const { currentUser } = useAuth();
     const [models, setModels] = useState([]);
     const [loading, setLoading] = useState(true);
@@ -43,12 +43,14 @@ const ModelSelector = ({ selectedModelId, onSelectionChange, projectIds = [], he
 
     return (
         <FormControl fullWidth required={required} {...props}>
-            <InputLabel id="model-select-label">Model</InputLabel>
+            <InputLabel id={`${id}-label`}>{label}</InputLabel>
             <Select
-                labelId="model-select-label"
-                id="model-select"
+                labelId={`${id}-label`}
+                id={id}
                 value={selectedModelId}
-                label="Model"
+                label={label}
+                multiple={multiple}
+                renderValue={multiple ? (ids) => ids.map(modelId => models.find(m => m.id === modelId)?.name || modelId).join(' → ') : undefined}
                 onChange={handleChange}
                 disabled={loading}
             >
@@ -63,7 +65,7 @@ const ModelSelector = ({ selectedModelId, onSelectionChange, projectIds = [], he
                         No models available for the selected project(s).
                     </MenuItem>
                 ) : (
-                    models.map((model) => (
+                    models.filter(model => !excludeModelIds.includes(model.id)).map((model) => (
                         <MenuItem key={model.id} value={model.id}>
                             {model.name}
                         </MenuItem>
@@ -4,7 +4,7 @@ import { useParams } from 'react-router-dom';
 import { useAuth } from '../contexts/AuthContext';
 import { useConfig } from '../contexts/ConfigContext';
 import * as chatService from '../services/chatService';
-import { executeQuery } from '../services/agentService';
+import { executeQuery, cancelAgentRun, getEventLog } from '../services/agentService';
 import { fetchWebPageContent, fetchGitRepoContents, processPdfContent, uploadImageForContext } from '../services/contextService';
 import { useChatManager } from '../hooks/useChatManager';
 import { extractContextItemsFromMessage } from '../utils/chatUtils';
@@ -32,6 +32,7 @@ const ChatPage = ({ isReadOnly = false }) => {
     const [isReasoningLogOpen, setIsReasoningLogOpen] = useState(false);
     const [selectedEventsForLog, setSelectedEventsForLog] = useState([]);
     const [loadingEvents, setLoadingEvents] = useState(false);
+    const [selectedLogMessageId, setSelectedLogMessageId] = useState(null);
     const [isContextLoading, setIsContextLoading] = useState(false);
     const [contextDetailsOpen, setContextDetailsOpen] = useState(false);
     const [contextDetailsItems, setContextDetailsItems] = useState([]);
@@ -40,6 +41,9 @@ const ChatPage = ({ isReadOnly = false }) => {
     const [unsharing, setUnsharing] = useState(false);
     const [snackbar, setSnackbar] = useState({ open: false, message: "" });
 
+    // Queries wait until every context on the active branch has finished background ingestion.
+    const hasPendingIngest = conversationPath.some(msg => ['queued', 'running', 'retrying'].includes(msg.ingestJob?.status));
+
     useEffect(() => {
         if (!isReadOnly && config?.features?.enableChatSharing) {
             chatService.getSharedChatIdForOriginal(effectiveChatId)
@@ -51,9 +55,18 @@ const ChatPage = ({ isReadOnly = false }) => {
     const handleFork = (msgId) => !isReadOnly && setActiveLeafMsgId(msgId);
     const handleNavigateBranch = (newLeafId) => !isReadOnly && setActiveLeafMsgId(newLeafId);
 
+    const handleCancelRun = async (messageId) => {
+        try {
+            await cancelAgentRun(effectiveChatId, messageId);
+        } catch (err) {
+            setPageError(`Failed to cancel run: ${err.message}`);
+        }
+    };
+
     const handleOpenReasoningLog = async (messageId) => {
         setLoadingEvents(true);
         setIsReasoningLogOpen(true);
+        setSelectedLogMessageId(messageId);
         try {
             const events = await chatService.getEventsForMessage(effectiveChatId, messageId);
             setSelectedEventsForLog(events);
@@ -64,6 +77,18 @@ const ChatPage = ({ isReadOnly = false }) => {
         }
     };
 
+    // Compacted runs only index key events in Firestore; the full log is downloaded from Cloud Storage on request.
+    const handleLoadFullEventLog = async () => {
+        setLoadingEvents(true);
+        try {
+            setSelectedEventsForLog(await getEventLog(effectiveChatId, selectedLogMessageId));
+        } catch (err) {
+            setPageError(`Failed to load the full event log: ${err.message}`);
+        } finally {
+            setLoadingEvents(false);
+        }
+    };
+
     const handleActionSubmit = async (composerAction, composerValue) => {
         setSending(true);
         setPageError(null);
@@ -83,7 +108,8 @@ const ChatPage = ({ isReadOnly = false }) => {
                     agentId: composerAction.type === 'agent' ? composerAction.id : undefined,
                     modelId: composerAction.type === 'model' ? composerAction.id : undefined,
                     adkUserId: currentUser.uid,
-                    parentMessageId: activeLeafMsgId
+                    parentMessageId: activeLeafMsgId,
+                    inline: composerAction.type === 'model'
                 });
             }
         } catch (err) {
@@ -175,6 +201,7 @@ const ChatPage = ({ isReadOnly = false }) => {
                     onFork={handleFork}
                     onNavigateBranch={handleNavigateBranch}
                     onViewLog={handleOpenReasoningLog}
+                    onCancelRun={handleCancelRun}
                     onOpenContextDetails={openContextDetailsForMessage}
                     messageContentCache={messageContentCache}
                 />
@@ -185,14 +212,15 @@ const ChatPage = ({ isReadOnly = false }) => {
                         agents={agents}
                         isReadOnly={isReadOnly}
                         sending={sending}
-                        isContextLoading={isContextLoading}
+                        isContextLoading={isContextLoading || hasPendingIngest}
                         onActionSubmit={handleActionSubmit}
                         onContextSubmit={handleContextSubmit}
                     />
                 )}
             </Paper>
 
-            <AgentReasoningLogDialog open={isReasoningLogOpen} onClose={() => setIsReasoningLogOpen(false)} events={loadingEvents ? [] : selectedEventsForLog} />
+            <AgentReasoningLogDialog open={isReasoningLogOpen} onClose={() => setIsReasoningLogOpen(false)} events={loadingEvents ? [] : selectedEventsForLog}
+                eventLog={messagesMap?.[selectedLogMessageId]?.eventLog} onLoadFullLog={handleLoadFullEventLog} />
             <ContextDetailsDialog open={contextDetailsOpen} onClose={() => setContextDetailsOpen(false)} contextItems={contextDetailsItems} />
             <Snackbar open={snackbar.open} autoHideDuration={3000} onClose={() => setSnackbar(s => ({ ...s, open: false }))} message={snackbar.message} />
         </Container>
@@ -3,6 +3,8 @@ import { createCallable } from '../firebaseConfig';
 
 const deployAgentToVertexCallable = createCallable('deploy_agent_to_vertex');
 const executeQueryCallable = createCallable('executeQuery'); // Renamed
+const cancelAgentRunCallable = createCallable('cancelAgentRun');
+const getEventLogCallable = createCallable('getEventLog');
 const deleteVertexAgentCallable = createCallable('delete_vertex_agent');
 const checkVertexAgentDeploymentStatusCallable = createCallable('check_vertex_agent_deployment_status');
 const listMcpServerToolsCallable = createCallable('list_mcp_server_tools');
@@ -62,7 +64,7 @@ export const deployAgent = async (agentConfig, agentDocId) => {
 };
 
 // This function now handles querying agents OR models
-export const executeQuery = async ({ agentId, modelId, message, adkUserId, chatId, parentMessageId, stuffedContextItems }) => {
+export const executeQuery = async ({ agentId, modelId, message, adkUserId, chatId, parentMessageId, stuffedContextItems, inline = false }) => {
     try {
         const payload = {
             agentId, // Can be null
@@ -71,7 +73,8 @@ export const executeQuery = async ({ agentId, modelId, message, adkUserId, chatI
             adkUserId,
             chatId,
             parentMessageId,
-            stuffedContextItems
+            stuffedContextItems,
+            inline // Model-only runs may execute inside the callable instead of via the task queue
         };
         // This cloud function now returns the new messageId immediately
         const result = await executeQueryCallable(payload);
@@ -82,6 +85,33 @@ export const executeQuery = async ({ agentId, modelId, message, adkUserId, chatI
     }
 };
 
+export const cancelAgentRun = async (chatId, messageId) => {
+    try {
+        const result = await cancelAgentRunCallable({ chatId, messageId });
+        return result.data;
+    } catch (error) {
+        console.error("Error cancelling agent run:", error);
+        throw error;
+    }
+};
+
+// The callable returns a short-lived signed URL for the gzipped JSONL log in Cloud Storage. The object is
+// stored with gzip content encoding, so the browser hands back the decompressed lines.
+export const getEventLog = async (chatId, messageId) => {
+    try {
+        const { data } = await getEventLogCallable({ chatId, messageId });
+        const response = await fetch(data.downloadUrl);
+        if (!response.ok) {
+            throw new Error(`Event log download failed with status ${response.status}`);
+        }
+        const text = await response.text();
+        return text.split('\n').filter(line => line.trim()).map(line => JSON.parse(line));
+    } catch (error) {
+        console.error("Error loading full event log:", error);
+        throw error;
+    }
+};
+
 export const deleteAgentDeployment = async (resourceName, agentDocId) => {
     try {
         const result = await deleteVertexAgentCallable({ resourceName, agentDocId });
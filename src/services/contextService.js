@@ -2,16 +2,22 @@
 import { createCallable } from '../firebaseConfig';
 
 const fetchWebPageContentCallable = createCallable('fetch_web_page_content');
-const uploadImageForContextCallable = createCallable('uploadImageForContext');
 const fetchGitRepoContentsCallable = createCallable('fetch_git_repo_contents');
 const processPdfContentCallable = createCallable('process_pdf_content');
+const createContextUploadUrlCallable = createCallable('createContextUploadUrl');
+const finalizeContextUploadCallable = createCallable('finalizeContextUpload');
+const ingestContextSourcesCallable = createCallable('ingestContextSources');
 
 // Each callable now creates the context message in Firestore directly.
 // Therefore, chatId and parentMessageId must be provided.
+// Git repos and PDFs are ingested in the background: the callable returns { success, background, messageId }
+// right away and the placeholder context message is filled in (see its `ingestJob` field) when the job finishes.
+// Text contexts accept an optional `useRetrieval` flag: large contexts are then indexed at ingest
+// and only the chunks relevant to the latest user message are sent to the model.
 
-export const fetchWebPageContent = async ({ url, chatId, parentMessageId }) => {
+export const fetchWebPageContent = async ({ url, chatId, parentMessageId, useRetrieval }) => {
     try {
-        const result = await fetchWebPageContentCallable({ url, chatId, parentMessageId });
+        const result = await fetchWebPageContentCallable({ url, chatId, parentMessageId, useRetrieval });
         return result.data; // { success, name, storageUrl, type, mimeType, messageId, preview }
     } catch (error) {
         console.error("Error calling fetchWebPageContent callable:", error);
@@ -19,9 +25,9 @@ export const fetchWebPageContent = async ({ url, chatId, parentMessageId }) => {
     }
 };
 
-export const fetchGitRepoContents = async ({ orgUser, repoName, gitToken, includeExt, excludeExt, directory, branch, chatId, parentMessageId }) => {
+export const fetchGitRepoContents = async ({ orgUser, repoName, gitToken, includeExt, excludeExt, directory, branch, chatId, parentMessageId, useRetrieval }) => {
     try {
-        const result = await fetchGitRepoContentsCallable({ orgUser, repoName, gitToken, includeExt, excludeExt, directory, branch, chatId, parentMessageId });
+        const result = await fetchGitRepoContentsCallable({ orgUser, repoName, gitToken, includeExt, excludeExt, directory, branch, chatId, parentMessageId, useRetrieval, background: true });
         return result.data; // { success, name, storageUrl, type, mimeType, messageId, preview }
     } catch (error) {
         console.error("Error calling fetchGitRepoContents callable:", error);
@@ -29,9 +35,38 @@ export const fetchGitRepoContents = async ({ orgUser, repoName, gitToken, includ
     }
 };
 
-export const processPdfContent = async ({ url, fileData, fileName, chatId, parentMessageId }) => { // fileData is base64 string
+// Uploads a File straight to GCS through a signed URL, then asks the backend to process it in place.
+// This avoids sending base64 file bodies through the callable payload.
+const uploadFileDirect = async ({ file, contextType, chatId, parentMessageId, useRetrieval }) => {
+    const mimeType = file.type || (contextType === 'pdf' ? 'application/pdf' : 'application/octet-stream');
+    const { data: uploadInfo } = await createContextUploadUrlCallable({ fileName: file.name, mimeType, contextType });
+    const response = await fetch(uploadInfo.uploadUrl, {
+        method: 'PUT',
+        headers: uploadInfo.uploadHeaders, // Content-Type and x-goog-content-length-range, both covered by the signature
+        body: file
+    });
+    if (!response.ok) {
+        throw new Error(`Direct upload failed with status ${response.status}`);
+    }
+    const result = await finalizeContextUploadCallable({
+        uploadPath: uploadInfo.uploadPath,
+        fileName: file.name,
+        mimeType,
+        contextType,
+        chatId,
+        parentMessageId,
+        useRetrieval,
+        background: contextType === 'pdf'
+    });
+    return result.data; // { success, name, storageUrl, type, mimeType, messageId, preview }
+};
+
+export const processPdfContent = async ({ url, file, fileName, chatId, parentMessageId, useRetrieval }) => {
     try {
-        const result = await processPdfContentCallable({ url, fileData, fileName, chatId, parentMessageId });
+        if (file) {
+            return await uploadFileDirect({ file, contextType: 'pdf', chatId, parentMessageId, useRetrieval });
+        }
+        const result = await processPdfContentCallable({ url, fileName, chatId, parentMessageId, useRetrieval, background: true });
         return result.data; // { success, name, storageUrl, type, mimeType, messageId, preview }
     } catch (error) {
         console.error("Error calling processPdfContent callable:", error);
@@ -39,30 +74,40 @@ export const processPdfContent = async ({ url, fileData, fileName, chatId, paren
     }
 };
 
-export const uploadImageForContext = (params) => {
+export const uploadImageForContext = async (params) => {
     // params: { file: File, chatId, parentMessageId }
     const { file, chatId, parentMessageId } = params || {};
-    return new Promise((resolve, reject) => {
-        if (!file) {
-            return reject(new Error("File is required."));
-        }
-        const reader = new FileReader();
-        reader.readAsDataURL(file);
-        reader.onload = async () => {
-            try {
-                const base64Data = reader.result.split(',')[1];
-                const result = await uploadImageForContextCallable({
-                    fileData: base64Data,
-                    fileName: file.name,
-                    mimeType: file.type,
-                    chatId,
-                    parentMessageId
-                });
-                resolve(result.data); // { success, name, storageUrl, signedUrl?, type, mimeType, messageId, preview }
-            } catch (error) {
-                reject(error);
+    if (!file) {
+        throw new Error("File is required.");
+    }
+    try {
+        return await uploadFileDirect({ file, contextType: 'image', chatId, parentMessageId }); // { success, name, storageUrl, publicUrl, type, mimeType, messageId, preview }
+    } catch (error) {
+        console.error("Error uploading image for context:", error);
+        throw error;
+    }
+};
+
+// Attaches several context sources in a single call. Files must be uploaded first; pass them as
+// { type: 'pdf' | 'image', file } and they are sent to storage via signed URLs before ingestion.
+// Other sources: { type: 'webpage', url }, { type: 'gitrepo', orgUser, repoName, ... }, { type: 'pdf', url }.
+export const ingestContextSources = async ({ sources, chatId, parentMessageId }) => {
+    try {
+        const preparedSources = await Promise.all((sources || []).map(async (source) => {
+            if (!source.file) return source;
+            const { file, ...rest } = source;
+            const mimeType = file.type || (source.type === 'pdf' ? 'application/pdf' : 'application/octet-stream');
+            const { data: uploadInfo } = await createContextUploadUrlCallable({ fileName: file.name, mimeType, contextType: source.type });
+            const response = await fetch(uploadInfo.uploadUrl, { method: 'PUT', headers: uploadInfo.uploadHeaders, body: file });
+            if (!response.ok) {
+                throw new Error(`Direct upload of ${file.name} failed with status ${response.status}`);
             }
-        };
-        reader.onerror = error => reject(error);
-    });
-};
\ No newline at end of file
+            return { ...rest, uploadPath: uploadInfo.uploadPath, fileName: file.name, mimeType };
+        }));
+        const result = await ingestContextSourcesCallable({ sources: preparedSources, chatId, parentMessageId });
+        return result.data; // { success, results: [{ index, success, messageId?, preview?, error? }] }
+    } catch (error) {
+        console.error("Error calling ingestContextSources callable:", error);
+        throw error;
+    }
+};